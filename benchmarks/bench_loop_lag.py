@@ -0,0 +1,94 @@
+"""
+Benchmark: event-loop lag under mixed load, inline vs executor offload.
+
+Simulates what process_kontext_request does with large uploads (base64
+decode + SHA-256 of the decoded bytes) while small requests keep arriving.
+A probe measures how late the event loop wakes up from a short sleep:
+that delay is what every other request experiences as added latency.
+
+    python -m benchmarks.bench_loop_lag --uploads 8 --upload-mb 10
+"""
+import argparse
+import asyncio
+import base64
+import hashlib
+import os
+import statistics
+import time
+
+from services.cache_service import hash_image_bytes
+from services.executor_service import run_in_process, run_in_thread, shutdown_executors
+from services.image_transforms import decode_base64_image
+
+PROBE_INTERVAL_SECONDS = 0.005
+
+
+async def process_upload_inline(image_data: str) -> str:
+    image_bytes = base64.b64decode(image_data)
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+async def process_upload_offloaded(image_data: str) -> str:
+    image_bytes = await run_in_process(decode_base64_image, image_data, size_bytes=len(image_data))
+    return await run_in_thread(hash_image_bytes, image_bytes, size_bytes=len(image_bytes))
+
+
+async def measure(process_upload, uploads: list) -> dict:
+    lags = []
+    stop = asyncio.Event()
+
+    async def probe():
+        while not stop.is_set():
+            started_at = time.perf_counter()
+            await asyncio.sleep(PROBE_INTERVAL_SECONDS)
+            lags.append(time.perf_counter() - started_at - PROBE_INTERVAL_SECONDS)
+
+    probe_task = asyncio.create_task(probe())
+    started_at = time.perf_counter()
+
+    # Uploads arrive a few milliseconds apart, like concurrent users
+    async def delayed(index, image_data):
+        await asyncio.sleep(index * 0.01)
+        return await process_upload(image_data)
+
+    await asyncio.gather(*(delayed(index, image_data) for index, image_data in enumerate(uploads)))
+    total_seconds = time.perf_counter() - started_at
+    stop.set()
+    await probe_task
+
+    lags_ms = sorted(lag * 1000 for lag in lags)
+    return {
+        "total_ms": total_seconds * 1000,
+        "lag_p50_ms": statistics.median(lags_ms),
+        "lag_p99_ms": lags_ms[min(len(lags_ms) - 1, int(len(lags_ms) * 0.99))],
+        "lag_max_ms": lags_ms[-1]
+    }
+
+
+async def run_benchmark(upload_count: int, upload_mb: float) -> None:
+    uploads = [base64.b64encode(os.urandom(int(upload_mb * 1024 * 1024))).decode() for _ in range(upload_count)]
+
+    # Start the worker processes before measuring
+    await process_upload_offloaded(uploads[0])
+
+    print(f"{upload_count} concurrent uploads of {upload_mb}MB (decode + SHA-256)")
+    for label, process_upload in (("inline", process_upload_inline), ("offloaded", process_upload_offloaded)):
+        result = await measure(process_upload, uploads)
+        print(
+            f"{label:>10}: total {result['total_ms']:7.0f}ms | loop lag p50 {result['lag_p50_ms']:6.1f}ms "
+            f"p99 {result['lag_p99_ms']:6.1f}ms max {result['lag_max_ms']:6.1f}ms"
+        )
+
+    shutdown_executors()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Event-loop lag: inline vs offloaded upload processing.")
+    parser.add_argument("--uploads", type=int, default=8)
+    parser.add_argument("--upload-mb", type=float, default=10.0)
+    args = parser.parse_args()
+    asyncio.run(run_benchmark(args.uploads, args.upload_mb))
+
+
+if __name__ == "__main__":
+    main()
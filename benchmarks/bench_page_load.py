@@ -0,0 +1,98 @@
+"""
+Benchmark: requests and bytes per page load, before and after build_assets.py.
+
+Simulates a browser with a cache against two setups:
+- before: index.html as a plain FileResponse, /static via plain StaticFiles
+- after:  the build (fingerprinted, minified, precompressed) served like main.py
+          does: index.html revalidated (no-cache), /assets immutable
+
+For each setup it loads the page twice (first visit, repeat visit) and counts
+the HTTP requests made and the response body bytes on the wire. The browser
+sends Accept-Encoding: gzip, br and If-None-Match for anything cached that is
+not immutable (heuristic freshness is ignored, as browsers differ).
+
+    python -m benchmarks.bench_page_load
+"""
+import re
+import tempfile
+
+from fastapi import FastAPI, Request
+from fastapi.responses import FileResponse
+from fastapi.staticfiles import StaticFiles
+from fastapi.testclient import TestClient
+
+from build_assets import build
+from services.http_service import CachedStaticFiles
+
+ASSET_REFERENCE_PATTERN = re.compile(r'(?:href|src)="(/(?:static|assets)/[^"]+)"')
+
+
+def make_before_app() -> FastAPI:
+    before_app = FastAPI()
+    before_app.mount("/static", StaticFiles(directory="static"), name="static")
+
+    @before_app.get("/")
+    async def root():
+        return FileResponse("static/index.html")
+
+    return before_app
+
+
+def make_after_app(build_directory: str) -> FastAPI:
+    after_app = FastAPI()
+    after_app.mount("/assets", CachedStaticFiles(directory=f"{build_directory}/assets", immutable=True), name="assets")
+    frontend_files = CachedStaticFiles(directory=build_directory)
+
+    @after_app.get("/")
+    async def root(request: Request):
+        return await frontend_files.get_response("index.html", request.scope)
+
+    return after_app
+
+
+def load_page(client: TestClient, browser_cache: dict) -> dict:
+    """One page view: the HTML, then every stylesheet/script it references."""
+    stats = {"requests": 0, "bytes": 0}
+
+    def fetch(url: str) -> str:
+        cached = browser_cache.get(url)
+        if cached and cached["immutable"]:
+            return cached["body"]  # Served from the browser cache, no request
+
+        headers = {"Accept-Encoding": "gzip, br"}
+        if cached and cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        response = client.get(url, headers=headers)
+        stats["requests"] += 1
+        stats["bytes"] += int(response.headers.get("content-length", 0))
+        if response.status_code == 304:
+            return cached["body"]
+
+        browser_cache[url] = {
+            "etag": response.headers.get("etag"),
+            "immutable": "immutable" in response.headers.get("cache-control", ""),
+            "body": response.text
+        }
+        return response.text
+
+    html = fetch("/")
+    for asset_url in ASSET_REFERENCE_PATTERN.findall(html):
+        fetch(asset_url)
+    return stats
+
+
+def main() -> None:
+    build_directory = tempfile.mkdtemp(prefix="fal-proxy-assets-")
+    build("static", build_directory)
+
+    print(f"{'setup':<8} {'first visit':>22} {'repeat visit':>22}")
+    for name, app in (("before", make_before_app()), ("after", make_after_app(build_directory))):
+        client, browser_cache = TestClient(app), {}
+        first_visit = load_page(client, browser_cache)
+        repeat_visit = load_page(client, browser_cache)
+        print(f"{name:<8} {first_visit['requests']:>3} req {first_visit['bytes']:>8} bytes "
+              f"{repeat_visit['requests']:>6} req {repeat_visit['bytes']:>8} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Benchmark: bytes saved and end-to-end latency of input preprocessing.
+
+Generates photo-like JPEG/PNG inputs of different sizes, runs them through
+preprocess_image and reports:
+- bytes before/after
+- preprocessing time (process pool, including pickling)
+- estimated transfer time for the input (upload to Supabase + fal.ai download)
+
+Transfer time is modelled from --bandwidth-mbps because the real services
+are not available offline. Run from the repository root:
+
+    python -m benchmarks.bench_preprocess --max-edge 1536
+"""
+import argparse
+import asyncio
+import io
+import time
+
+from PIL import Image, ImageFilter
+
+from services.executor_service import shutdown_executors
+from services.preprocess_service import preprocess_image
+
+INPUT_SIZES = [(1024, 768), (3000, 2000), (6000, 4000)]
+
+
+def make_photo_like_image(width: int, height: int, image_format: str) -> bytes:
+    """Noise blurred into soft detail: compresses roughly like a real photo."""
+    noise = Image.effect_noise((width // 4, height // 4), 64).convert("RGB")
+    image = noise.resize((width, height), Image.Resampling.BICUBIC).filter(ImageFilter.GaussianBlur(1))
+    buffer = io.BytesIO()
+    image.save(buffer, format=image_format, quality=92)
+    return buffer.getvalue()
+
+
+async def run_benchmark(max_edge: int, bandwidth_mbps: float) -> None:
+    bytes_per_second = bandwidth_mbps * 1024 * 1024 / 8
+    # Warm up the process pool so the first row does not include worker start-up
+    await preprocess_image(make_photo_like_image(2048, 2048, "JPEG"), "image/jpeg", max_edge=max_edge)
+
+    print(f"max_edge={max_edge}px, modelled bandwidth={bandwidth_mbps} Mbit/s (input crosses the network twice)")
+    print(f"{'input':>18} {'before':>10} {'after':>10} {'saved':>7} {'cpu ms':>8} {'e2e before':>11} {'e2e after':>10}")
+
+    for image_format, mime_type in (("JPEG", "image/jpeg"), ("PNG", "image/png")):
+        for width, height in INPUT_SIZES:
+            original = make_photo_like_image(width, height, image_format)
+
+            started_at = time.perf_counter()
+            processed = await preprocess_image(original, mime_type, max_edge=max_edge)
+            preprocess_seconds = time.perf_counter() - started_at
+
+            before_seconds = 2 * len(original) / bytes_per_second
+            after_seconds = preprocess_seconds + 2 * len(processed) / bytes_per_second
+            saved_percent = 100 * (1 - len(processed) / len(original))
+
+            print(
+                f"{image_format} {width}x{height:<6} {len(original) / 1e6:>9.2f}M {len(processed) / 1e6:>9.2f}M "
+                f"{saved_percent:>6.1f}% {preprocess_seconds * 1000:>8.0f} "
+                f"{before_seconds * 1000:>9.0f}ms {after_seconds * 1000:>8.0f}ms"
+            )
+
+    shutdown_executors()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--max-edge", type=int, default=1536)
+    parser.add_argument("--bandwidth-mbps", type=float, default=100.0)
+    args = parser.parse_args()
+    asyncio.run(run_benchmark(args.max_edge, args.bandwidth_mbps))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark: JSON serialization time and bytes on the wire per response.
+
+Compares the stdlib encoder (starlette JSONResponse, FastAPI's previous
+default) with ORJSONResponse, and the body size without compression, with
+gzip and with brotli (as sent by CompressionMiddleware), for:
+- a kontext result (4 images with thumbnail/medium variants)
+- a large list payload (history/batch-sized, 500 rows)
+
+    python -m benchmarks.bench_serialization --iterations 2000
+"""
+import argparse
+import time
+
+from starlette.responses import JSONResponse
+
+from services.http_service import ORJSONResponse, compress, COMPRESSION_MIN_BYTES
+
+
+def make_kontext_result(image_count: int = 4) -> dict:
+    base_url = "https://abcdefghijklmnop.supabase.co/storage/v1/object/public/images"
+    return {
+        "images": [
+            {
+                "url": f"{base_url}/generated/{index:08x}-3f1c2a9e7b6d4c1e8f0a.jpg",
+                "width": 1024,
+                "height": 768,
+                "variants": {
+                    "thumbnail": {"avif": f"{base_url}/{index:08x}/thumbnail.avif", "webp": f"{base_url}/{index:08x}/thumbnail.webp"},
+                    "medium": {"avif": f"{base_url}/{index:08x}/medium.avif", "webp": f"{base_url}/{index:08x}/medium.webp"}
+                }
+            }
+            for index in range(image_count)
+        ],
+        "prompt": "Turn the sky into a dramatic orange sunset and add reflections on the water"
+    }
+
+
+def make_history_payload(row_count: int = 500) -> list:
+    return [
+        {
+            "id": index,
+            "endpoint": "/kontext",
+            "input_image_url": f"https://example.com/inputs/{index}.jpg",
+            "prompt": f"make it look like a watercolor painting, variation {index % 17}",
+            "status": "success" if index % 10 else "failed",
+            "output_image_urls": [f"https://abcdefghijklmnop.supabase.co/storage/v1/object/public/images/{index:08x}.jpg"],
+            "total_response_time": 4200 + index,
+            "fal_api_time": 3900 + index,
+            "created_at": "2026-10-19T12:00:00.000000"
+        }
+        for index in range(row_count)
+    ]
+
+
+def time_render(response_class, content, iterations: int) -> float:
+    """Microseconds per render (the part of a response the encoder controls)."""
+    renderer = response_class.__new__(response_class)
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        renderer.render(content)
+    return (time.perf_counter() - started_at) / iterations * 1e6
+
+
+def time_compress(body: bytes, encoding: str, iterations: int) -> float:
+    started_at = time.perf_counter()
+    for _ in range(iterations):
+        compress(body, encoding)
+    return (time.perf_counter() - started_at) / iterations * 1e6
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+
+    payloads = {"kontext result": make_kontext_result(), "history (500 rows)": make_history_payload()}
+    for name, content in payloads.items():
+        # Fewer iterations for the large payload so the run stays short
+        iterations = args.iterations if name == "kontext result" else max(1, args.iterations // 20)
+        body = ORJSONResponse.__new__(ORJSONResponse).render(content)
+        stdlib_us = time_render(JSONResponse, content, iterations)
+        orjson_us = time_render(ORJSONResponse, content, iterations)
+
+        print(f"{name}:")
+        print(f"  encode   json {stdlib_us:>9.1f}us | orjson {orjson_us:>8.1f}us | {stdlib_us / orjson_us:.1f}x faster")
+        print(f"  bytes    identity {len(body):>7}", end="")
+        for encoding in ("gzip", "br"):
+            compressed = compress(body, encoding)
+            print(f" | {encoding} {len(compressed):>6} ({100 * len(compressed) / len(body):.0f}%, "
+                  f"{time_compress(body, encoding, iterations):.0f}us)", end="")
+        print()
+        if len(body) < COMPRESSION_MIN_BYTES:
+            print(f"  (below COMPRESSION_MIN_BYTES={COMPRESSION_MIN_BYTES}: sent uncompressed)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark: cold-start time of the app, in fresh processes.
+
+Measures three numbers per run:
+- import: `import main` (what every worker / fork pays before serving)
+- live:   process start -> GET /health/live returns 200 (uvicorn accepting requests)
+- ready:  process start -> GET /health/ready returns 200 (Redis/DB/storage warmed up)
+
+Without real credentials, missing settings fall back to local placeholders:
+an unreachable Redis, a SQLite file and a fake Supabase URL (creating the
+client does not connect).
+
+    python -m benchmarks.bench_startup --runs 5 --json startup.json
+    python -X importtime -c "import main" 2> importtime.log   # per-module import profile
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+from benchmarks.fakes import find_free_port
+
+IMPORT_SNIPPET = "import time; started_at = time.perf_counter(); import main; print((time.perf_counter() - started_at) * 1000)"
+READY_TIMEOUT_SECONDS = 60.0
+
+
+def benchmark_environment(work_dir: str) -> dict:
+    env = dict(os.environ)
+    env.setdefault("FAL_KEY", "benchmark_fal_key")
+    env.setdefault("SUPABASE_URL", "http://127.0.0.1:1")
+    env.setdefault("SUPABASE_KEY", "benchmark_supabase_key")
+    env.setdefault("REDIS_URL", "redis://127.0.0.1:1")
+    env.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(work_dir, 'startup.db')}")
+    env.setdefault("LOG_LEVEL", "ERROR")
+    return env
+
+
+def measure_import_ms(env: dict) -> float:
+    completed = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET], env=env, capture_output=True, text=True, check=True
+    )
+    return float(completed.stdout.strip().splitlines()[-1])
+
+
+def measure_time_to_ready(env: dict) -> dict:
+    port = find_free_port()
+    started_at = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    live_ms = ready_ms = None
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{port}", timeout=5.0) as client:
+            while ready_ms is None:
+                elapsed_ms = (time.perf_counter() - started_at) * 1000
+                if elapsed_ms > READY_TIMEOUT_SECONDS * 1000 or server.poll() is not None:
+                    raise RuntimeError("Server did not become ready")
+                try:
+                    if live_ms is None and client.get("/health/live").status_code == 200:
+                        live_ms = (time.perf_counter() - started_at) * 1000
+                    if live_ms is not None and client.get("/health/ready").status_code == 200:
+                        ready_ms = (time.perf_counter() - started_at) * 1000
+                except httpx.TransportError:
+                    pass
+                time.sleep(0.005)
+    finally:
+        server.terminate()
+        server.wait(timeout=15)
+
+    return {"live_ms": live_ms, "ready_ms": ready_ms}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Cold-start time: import, liveness and readiness.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", help="Also write the results to this file (e.g. a CI artifact)")
+    args = parser.parse_args()
+
+    env = benchmark_environment(tempfile.mkdtemp(prefix="fal-proxy-startup-"))
+    runs = []
+    for _ in range(args.runs):
+        run = {"import_ms": measure_import_ms(env), **measure_time_to_ready(env)}
+        runs.append(run)
+
+    summary = {metric: round(statistics.median(run[metric] for run in runs), 1) for metric in ("import_ms", "live_ms", "ready_ms")}
+    print(f"median of {args.runs} runs: import {summary['import_ms']:.0f}ms | "
+          f"live {summary['live_ms']:.0f}ms | ready {summary['ready_ms']:.0f}ms")
+
+    if args.json:
+        with open(args.json, "w") as results_file:
+            json.dump({"median": summary, "runs": runs}, results_file, indent=2)
+            results_file.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""
+Local stand-ins for the external services, used by the load test.
+
+- FakeStorageServer: HTTP server speaking the subset of the Supabase Storage
+  API the app uses (upload, public URL download). Also serves the sample
+  input/output images that fake fal and URL requests point at.
+- FakeFal: replaces fal_client.submit_async with a queue that waits a
+  configurable latency and fails at a configurable rate.
+
+Both run in-process so the benchmark needs no credentials or network.
+"""
+import asyncio
+import email.parser
+import email.policy
+import io
+import random
+import socket
+import threading
+import time
+import uuid
+from typing import Optional
+
+import uvicorn
+from PIL import Image
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+
+def find_free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def make_sample_jpeg(width: int, height: int, seed: int = 0) -> bytes:
+    """A noisy JPEG (noise keeps the size realistic, flat colours compress to nothing)."""
+    rng = random.Random(seed)
+    tile = Image.frombytes("RGB", (64, 64), bytes(rng.getrandbits(8) for _ in range(64 * 64 * 3)))
+    image = tile.resize((width, height))
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+
+class BackgroundServer:
+    """Runs an ASGI app with uvicorn on its own thread and event loop."""
+
+    def __init__(self, app, port: Optional[int] = None):
+        self.port = port or find_free_port()
+        self.server = uvicorn.Server(uvicorn.Config(
+            app, host="127.0.0.1", port=self.port, log_level="warning", access_log=False
+        ))
+        self._thread = threading.Thread(target=self.server.run, name=f"server-{self.port}", daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, timeout_seconds: float = 15.0) -> "BackgroundServer":
+        self._thread.start()
+        deadline = time.monotonic() + timeout_seconds
+        while not self.server.started:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError(f"Server on port {self.port} did not start")
+            time.sleep(0.01)
+        return self
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self._thread.join(timeout=10)
+
+
+class FakeStorageServer(BackgroundServer):
+    """
+    Minimal Supabase Storage API:
+        POST/PUT /storage/v1/object/{bucket}/{path}         multipart upload (storage3 client)
+        GET      /storage/v1/object/public/{bucket}/{path}  public download
+        GET      /assets/{name}                             fixtures (sample input/output images)
+    """
+
+    def __init__(self, assets: dict, port: Optional[int] = None):
+        self.assets = assets
+        self.objects = {}
+        self.upload_count = 0
+        app = Starlette(routes=[
+            Route("/storage/v1/object/public/{bucket}/{path:path}", self.download, methods=["GET"]),
+            Route("/storage/v1/object/{bucket}/{path:path}", self.upload, methods=["POST", "PUT"]),
+            Route("/assets/{name}", self.asset, methods=["GET"])
+        ])
+        super().__init__(app, port)
+
+    async def upload(self, request: Request) -> Response:
+        body = await request.body()
+        content_type = request.headers.get("content-type", "application/octet-stream")
+        file_bytes = body
+        if content_type.startswith("multipart/"):
+            message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+                b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body
+            )
+            for part in message.iter_parts():
+                if part.get_param("name", header="content-disposition") == "file":
+                    file_bytes = part.get_payload(decode=True)
+                    content_type = part.get_content_type()
+
+        key = f"{request.path_params['bucket']}/{request.path_params['path']}"
+        self.objects[key] = (file_bytes, content_type)
+        self.upload_count += 1
+        return JSONResponse({"Key": key, "Id": str(uuid.uuid4())})
+
+    async def download(self, request: Request) -> Response:
+        stored = self.objects.get(f"{request.path_params['bucket']}/{request.path_params['path']}")
+        if stored is None:
+            return JSONResponse({"statusCode": "404", "error": "not_found", "message": "Object not found"}, 404)
+        return Response(stored[0], media_type=stored[1])
+
+    async def asset(self, request: Request) -> Response:
+        asset_bytes = self.assets.get(request.path_params["name"])
+        if asset_bytes is None:
+            return Response(status_code=404)
+        return Response(asset_bytes, media_type="image/jpeg")
+
+
+class FakeJobHandle:
+    def __init__(self, request_id: str, result: dict, latency_seconds: float):
+        self.request_id = request_id
+        self._result = result
+        self._latency_seconds = latency_seconds
+
+    async def get(self) -> dict:
+        # The queue wait + generation time, like polling a real fal job
+        await asyncio.sleep(self._latency_seconds)
+        return self._result
+
+
+class FakeFal:
+    """
+    Drop-in for fal_client.submit_async.
+
+    Latency is uniformly jittered by +/-25% around latency_ms; error_rate is
+    the fraction of submissions that raise (tenacity retries them, as with real fal).
+    """
+
+    def __init__(self, output_url: str, latency_ms: float = 200, error_rate: float = 0.0, seed: int = 0):
+        self.output_url = output_url
+        self.latency_seconds = latency_ms / 1000
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.submitted = 0
+        self.failed = 0
+
+    async def submit_async(self, model_path: str, arguments: dict) -> FakeJobHandle:
+        self.submitted += 1
+        if self.rng.random() < self.error_rate:
+            self.failed += 1
+            raise RuntimeError("fake fal: simulated upstream error")
+
+        latency_seconds = self.latency_seconds * self.rng.uniform(0.75, 1.25)
+        images = [{"url": self.output_url, "width": 1024, "height": 768}] * (arguments.get("num_images") or 1)
+        return FakeJobHandle(str(uuid.uuid4()), {"images": images, "prompt": arguments["prompt"]}, latency_seconds)
@@ -0,0 +1,290 @@
+"""
+Load test: the real FastAPI app (real HTTP server, middleware, cache and
+storage code paths) against local fakes for fal, Supabase Storage and Redis.
+The app runs in a separate process; this process only generates load.
+
+What is faked:
+- fal: fal_client.submit_async -> benchmarks.fakes.FakeFal (latency + error rate)
+- Supabase Storage: benchmarks.fakes.FakeStorageServer (real HTTP, storage3 client unchanged)
+- Redis: fakeredis, or a real local Redis with --redis-url
+- Database: SQLite file in a temp dir
+The rate limiter is disabled so it does not cap the measured throughput.
+
+Scenarios vary the input mix (URL vs base64 upload) and the cache hit ratio.
+Results are printed and can be saved as a JSON baseline; later runs compared
+against that baseline exit non-zero if throughput or latency regressed.
+
+    python -m benchmarks.load_test                                  # all scenarios
+    python -m benchmarks.load_test --scenario mixed --concurrency 50
+    python -m benchmarks.load_test --save-baseline benchmarks/baseline.json
+    python -m benchmarks.load_test --baseline benchmarks/baseline.json  # exit 1 on regression
+"""
+import argparse
+import asyncio
+import base64
+import json
+import multiprocessing
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import uuid
+from typing import Optional
+from unittest.mock import patch
+
+import httpx
+
+from benchmarks.fakes import BackgroundServer, FakeFal, FakeStorageServer, find_free_port, make_sample_jpeg
+
+# name -> (cache hit ratio, upload ratio)
+SCENARIOS = {
+    "cache-hit": {"cache_hit_ratio": 1.0, "upload_ratio": 0.0},
+    "url-miss": {"cache_hit_ratio": 0.0, "upload_ratio": 0.0},
+    "upload-miss": {"cache_hit_ratio": 0.0, "upload_ratio": 1.0},
+    "mixed": {"cache_hit_ratio": 0.7, "upload_ratio": 0.3}
+}
+HOT_PROMPT_COUNT = 10  # Distinct cached requests that "hits" are drawn from
+DEFAULT_TOLERANCE = 0.20  # Allowed relative slowdown before a metric counts as a regression
+MAX_ERROR_RATE_INCREASE = 0.01
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def summarize(latencies_ms: list, errors: int, wall_seconds: float) -> dict:
+    latencies_ms = sorted(latencies_ms)
+    total = len(latencies_ms) + errors
+    return {
+        "requests": total,
+        "errors": errors,
+        "error_rate": round(errors / total, 4) if total else 0.0,
+        "rps": round(len(latencies_ms) / wall_seconds, 2) if wall_seconds else 0.0,
+        "p50_ms": round(percentile(latencies_ms, 0.50), 2),
+        "p95_ms": round(percentile(latencies_ms, 0.95), 2),
+        "p99_ms": round(percentile(latencies_ms, 0.99), 2)
+    }
+
+
+def compare_to_baseline(results: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> list:
+    """
+    Returns one message per regressed metric (empty list = no regressions).
+
+    A regression is: RPS lower, or p50/p95/p99 higher, than the baseline by
+    more than `tolerance` (relative), or an error rate increase over 1 point.
+    Scenarios missing from the baseline are skipped.
+    """
+    regressions = []
+    for name, current in results["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if previous is None:
+            continue
+        if current["rps"] < previous["rps"] * (1 - tolerance):
+            regressions.append(f"{name}: rps {current['rps']} < baseline {previous['rps']}")
+        for metric in ("p50_ms", "p95_ms", "p99_ms"):
+            if current[metric] > previous[metric] * (1 + tolerance):
+                regressions.append(f"{name}: {metric} {current[metric]} > baseline {previous[metric]}")
+        if current["error_rate"] > previous["error_rate"] + MAX_ERROR_RATE_INCREASE:
+            regressions.append(f"{name}: error_rate {current['error_rate']} > baseline {previous['error_rate']}")
+    return regressions
+
+
+def build_request_plan(count: int, cache_hit_ratio: float, upload_ratio: float, seed: int) -> list:
+    """
+    Returns (input kind, prompt) per request. Hits reuse one of the warmed hot
+    prompts, misses get a prompt nobody has asked for yet.
+    """
+    rng = random.Random(seed)
+    plan = []
+    for _ in range(count):
+        input_kind = "upload" if rng.random() < upload_ratio else "url"
+        if rng.random() < cache_hit_ratio:
+            prompt = f"hot prompt {rng.randrange(HOT_PROMPT_COUNT)}"
+        else:
+            prompt = f"cold prompt {uuid.uuid4()}"
+        plan.append((input_kind, prompt))
+    return plan
+
+
+async def run_scenario(client: httpx.AsyncClient, payloads: dict, plan: list, concurrency: int) -> dict:
+    # Warm every hot (input kind, prompt) pair the plan uses, outside the measurement
+    for input_kind, prompt in sorted({item for item in plan if item[1].startswith("hot")}):
+        await client.post("/kontext", json={**payloads[input_kind], "prompt": prompt})
+
+    latencies_ms = []
+    errors = 0
+    pending = iter(plan)
+
+    async def worker():
+        nonlocal errors
+        for input_kind, prompt in pending:
+            started_at = time.perf_counter()
+            try:
+                response = await client.post("/kontext", json={**payloads[input_kind], "prompt": prompt})
+                failed = response.status_code != 200
+            except httpx.HTTPError:
+                failed = True
+            if failed:
+                errors += 1
+            else:
+                latencies_ms.append((time.perf_counter() - started_at) * 1000)
+
+    started_at = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies_ms, errors, time.perf_counter() - started_at)
+
+
+def configure_environment(storage_url: str, work_dir: str) -> None:
+    """Points the app at the fakes. Must run before main is imported."""
+    os.environ["FAL_KEY"] = "benchmark_fal_key"
+    os.environ["SUPABASE_URL"] = storage_url
+    os.environ["SUPABASE_KEY"] = "benchmark_supabase_key"
+    # Unreachable on purpose: the startup ping fails fast and leaves the client set below in place
+    os.environ["REDIS_URL"] = "redis://127.0.0.1:1"
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(work_dir, 'benchmark.db')}"
+    os.environ.setdefault("LOG_LEVEL", "ERROR")
+
+
+def create_redis_client(redis_url: Optional[str]):
+    if redis_url:
+        import redis
+        return redis.Redis.from_url(redis_url, decode_responses=True)
+    try:
+        import fakeredis
+    except ImportError:
+        sys.exit("fakeredis is not installed (pip install -r requirements-dev.txt) and no --redis-url was given")
+    return fakeredis.FakeRedis(decode_responses=True)
+
+
+def serve_app_with_fakes(app_port: int, storage_port: int, assets: dict, options: dict) -> None:
+    """
+    Subprocess entry point: fake storage + the real app with fal/Redis swapped out.
+
+    Runs in its own process so the load generator does not share the GIL
+    (and the CPU) with the server it is measuring.
+    """
+    storage = FakeStorageServer(assets, port=storage_port).start()
+    configure_environment(storage.base_url, tempfile.mkdtemp(prefix="fal-proxy-bench-"))
+
+    # Imported only now: main reads the environment at import time
+    import fal_client
+    import main
+    from services import cache_service
+
+    cache_service.redis_client = create_redis_client(options["redis_url"])
+    main.limiter.enabled = False
+    fake_fal = FakeFal(
+        f"{storage.base_url}/assets/output.jpg", options["fal_latency_ms"], options["fal_error_rate"], options["seed"]
+    )
+    with patch.object(fal_client, "submit_async", fake_fal.submit_async):
+        # Main thread of this process: uvicorn handles SIGTERM and runs the lifespan shutdown
+        BackgroundServer(main.app, port=app_port).server.run()
+
+
+async def wait_until_ready(client: httpx.AsyncClient, app_process, timeout_seconds: float = 60.0) -> None:
+    deadline = time.monotonic() + timeout_seconds
+    while time.monotonic() < deadline:
+        if not app_process.is_alive():
+            raise RuntimeError("App process exited during startup")
+        try:
+            if (await client.get("/health")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.1)
+    raise RuntimeError("App did not become ready")
+
+
+async def run_load_test(args: argparse.Namespace) -> dict:
+    input_jpeg = make_sample_jpeg(1024, 768, seed=1)
+    assets = {"input.jpg": input_jpeg, "output.jpg": make_sample_jpeg(1024, 768, seed=2)}
+    app_port, storage_port = find_free_port(), find_free_port()
+    options = {key: getattr(args, key) for key in ("redis_url", "fal_latency_ms", "fal_error_rate", "seed")}
+
+    app_process = multiprocessing.get_context("spawn").Process(
+        target=serve_app_with_fakes, args=(app_port, storage_port, assets, options), name="app-under-test"
+    )
+    app_process.start()
+
+    storage_url = f"http://127.0.0.1:{storage_port}"
+    payloads = {
+        "url": {"image_url": f"{storage_url}/assets/input.jpg"},
+        "upload": {"image_data": base64.b64encode(input_jpeg).decode()}
+    }
+    scenario_names = [args.scenario] if args.scenario else list(SCENARIOS)
+    results = {
+        "meta": {
+            "command": " ".join(["python -m benchmarks.load_test"] + sys.argv[1:]),
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "fal_latency_ms": args.fal_latency_ms,
+            "fal_error_rate": args.fal_error_rate,
+            "seed": args.seed,
+            # Not imported from services: the spawned app process re-imports this module before its env is set
+            "derivative_mode": os.getenv("DERIVATIVE_MODE", "deferred"),
+            "redis": "redis" if args.redis_url else "fakeredis",
+            "python": platform.python_version(),
+            "machine": f"{platform.system()} {platform.machine()}, {os.cpu_count()} CPUs"
+        },
+        "scenarios": {}
+    }
+
+    try:
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{app_port}", timeout=120.0, limits=limits) as client:
+            await wait_until_ready(client, app_process)
+            for index, name in enumerate(scenario_names):
+                plan = build_request_plan(args.requests, seed=args.seed + index, **SCENARIOS[name])
+                summary = await run_scenario(client, payloads, plan, args.concurrency)
+                results["scenarios"][name] = summary
+                print(
+                    f"{name:>12}: {summary['rps']:8.1f} req/s | p50 {summary['p50_ms']:7.1f}ms "
+                    f"p95 {summary['p95_ms']:7.1f}ms p99 {summary['p99_ms']:7.1f}ms | "
+                    f"errors {summary['errors']}/{summary['requests']}"
+                )
+    finally:
+        app_process.terminate()
+        app_process.join(timeout=15)
+
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load test the app against local fakes for fal, Supabase and Redis.")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), help="Run one scenario (default: all)")
+    parser.add_argument("--requests", type=int, default=100, help="Measured requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--fal-latency-ms", type=float, default=200.0)
+    parser.add_argument("--fal-error-rate", type=float, default=0.0)
+    parser.add_argument("--redis-url", help="Use a real Redis instead of fakeredis")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save-baseline", help="Write the results to this JSON file")
+    parser.add_argument("--baseline", help="Compare against this JSON file and exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    results = asyncio.run(run_load_test(args))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2)
+            baseline_file.write("\n")
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            regressions = compare_to_baseline(results, json.load(baseline_file), args.tolerance)
+        if regressions:
+            print("REGRESSIONS:\n  " + "\n  ".join(regressions))
+            sys.exit(1)
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+"""
+Frontend build: minify, fingerprint and precompress static/ into static/dist/.
+
+Why: every page view re-downloaded the unminified CSS/JS, because the
+files had no cache headers and no way to tell a changed file from an old
+one. After this build:
+- assets are minified and named by content hash (css/style.<hash>.css),
+  so they can be cached forever (Cache-Control: immutable); a change
+  produces a new name, referenced from the rebuilt index.html
+- every text file has .gz and .br siblings, compressed once at build time
+  at maximum level, and served instead of the original when accepted
+- index.html itself is served with Cache-Control: no-cache (revalidated
+  on each visit, usually a 304)
+
+Output: static/dist/index.html, static/dist/assets/..., static/dist/manifest.json
+(source path -> fingerprinted path). main.py serves the build when the
+manifest exists and the plain static/ files otherwise.
+
+The minifiers are deliberately conservative (no JS parser): comments and
+indentation go, line breaks stay, so automatic semicolon insertion and
+string contents are never affected.
+
+    python build_assets.py
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+
+import brotli
+
+SOURCE_DIRECTORY = "static"
+OUTPUT_DIRECTORY = os.path.join("static", "dist")
+ASSETS_URL_PREFIX = "/assets/"
+SOURCE_URL_PREFIX = "/static/"
+FINGERPRINT_LENGTH = 10
+PRECOMPRESS_EXTENSIONS = (".html", ".css", ".js", ".svg", ".json", ".txt")
+PRECOMPRESSED_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+CSS_STRING_PATTERN = re.compile(r"(\"(?:\\.|[^\"\\])*\"|'(?:\\.|[^'\\])*')")
+
+
+def minify_css(source: str) -> str:
+    """Drops comments and whitespace around CSS punctuation; strings are left untouched."""
+    source = re.sub(r"/\*.*?\*/", "", source, flags=re.DOTALL)
+    parts = CSS_STRING_PATTERN.split(source)
+    for index in range(0, len(parts), 2):  # Even indexes are outside strings
+        code = re.sub(r"\s+", " ", parts[index])
+        code = re.sub(r"\s*([{};,>])\s*", r"\1", code)
+        code = re.sub(r":\s+", ":", code)
+        parts[index] = code.replace(";}", "}")
+    return "".join(parts).strip()
+
+
+def minify_js(source: str) -> str:
+    """Line-based: removes indentation, blank lines and whole-line // comments."""
+    lines = (line.strip() for line in source.splitlines())
+    return "\n".join(line for line in lines if line and not line.startswith("//"))
+
+
+def minify_html(source: str) -> str:
+    """Removes comments and indentation (line breaks stay, so inline spacing is unchanged)."""
+    source = re.sub(r"<!--(?!\[if).*?-->", "", source, flags=re.DOTALL)
+    lines = (line.strip() for line in source.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+MINIFIERS = {".css": minify_css, ".js": minify_js, ".html": minify_html}
+
+
+def fingerprint_name(relative_path: str, content: bytes) -> str:
+    stem, extension = os.path.splitext(relative_path)
+    return f"{stem}.{hashlib.sha256(content).hexdigest()[:FINGERPRINT_LENGTH]}{extension}"
+
+
+def rewrite_references(text: str, manifest: dict) -> str:
+    """Points /static/<file> references at the fingerprinted /assets/<file>."""
+    for source_path, built_path in manifest.items():
+        text = text.replace(f"{SOURCE_URL_PREFIX}{source_path}", f"{ASSETS_URL_PREFIX}{built_path}")
+    return text
+
+
+def write_with_precompressed(path: str, content: bytes) -> dict:
+    """Writes the file plus .gz/.br siblings (for text types); returns bytes per encoding."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as output_file:
+        output_file.write(content)
+    sizes = {"identity": len(content)}
+
+    if path.endswith(PRECOMPRESS_EXTENSIONS):
+        compressed_versions = {
+            "gzip": gzip.compress(content, compresslevel=9, mtime=0),  # mtime=0: reproducible builds
+            "br": brotli.compress(content, quality=11)
+        }
+        for encoding, compressed in compressed_versions.items():
+            with open(path + PRECOMPRESSED_SUFFIXES[encoding], "wb") as output_file:
+                output_file.write(compressed)
+            sizes[encoding] = len(compressed)
+    return sizes
+
+
+def build(source_directory: str = SOURCE_DIRECTORY, output_directory: str = OUTPUT_DIRECTORY) -> dict:
+    """
+    Builds the frontend; returns {source path: {"path", "original_bytes", "bytes"}}
+    where "bytes" holds the output size per encoding.
+    """
+    if os.path.exists(output_directory):
+        shutil.rmtree(output_directory)
+
+    asset_paths = []
+    for directory, subdirectories, file_names in os.walk(source_directory):
+        if os.path.abspath(directory).startswith(os.path.abspath(output_directory)):
+            continue
+        for file_name in file_names:
+            relative_path = os.path.relpath(os.path.join(directory, file_name), source_directory).replace(os.sep, "/")
+            if relative_path != "index.html":
+                asset_paths.append(relative_path)
+    # Stylesheets last: they may reference other assets (url(/static/...)), never the reverse
+    asset_paths.sort(key=lambda path: (path.endswith(".css"), path))
+
+    manifest = {}
+    report = {}
+    for relative_path in asset_paths + ["index.html"]:
+        with open(os.path.join(source_directory, relative_path), "rb") as source_file:
+            original = source_file.read()
+        content = original
+
+        extension = os.path.splitext(relative_path)[1]
+        if extension in MINIFIERS:
+            text = rewrite_references(content.decode("utf-8"), manifest)
+            content = MINIFIERS[extension](text).encode("utf-8")
+
+        if relative_path == "index.html":
+            # Not fingerprinted: its URL is the entry point; it is revalidated instead
+            built_path = relative_path
+            output_path = os.path.join(output_directory, relative_path)
+        else:
+            built_path = fingerprint_name(relative_path, content)
+            manifest[relative_path] = built_path
+            output_path = os.path.join(output_directory, "assets", built_path)
+
+        report[relative_path] = {
+            "path": built_path,
+            "original_bytes": len(original),
+            "bytes": write_with_precompressed(output_path, content)
+        }
+
+    with open(os.path.join(output_directory, "manifest.json"), "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=2, sort_keys=True)
+        manifest_file.write("\n")
+
+    return report
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Minify, fingerprint and precompress the frontend.")
+    parser.add_argument("--source", default=SOURCE_DIRECTORY)
+    parser.add_argument("--output", default=OUTPUT_DIRECTORY)
+    args = parser.parse_args()
+
+    report = build(args.source, args.output)
+    print(f"{'file':<22} {'original':>9} {'minified':>9} {'gzip':>7} {'br':>7}  output")
+    for source_path, entry in report.items():
+        sizes = entry["bytes"]
+        print(f"{source_path:<22} {entry['original_bytes']:>9} {sizes['identity']:>9} "
+              f"{sizes.get('gzip', '-'):>7} {sizes.get('br', '-'):>7}  {entry['path']}")
+    original_total = sum(entry["original_bytes"] for entry in report.values())
+    brotli_total = sum(entry["bytes"].get("br", entry["bytes"]["identity"]) for entry in report.values())
+    print(f"total: {original_total} -> {brotli_total} bytes with brotli ({100 * brotli_total / original_total:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,14 @@
 from fastapi import FastAPI, HTTPException, Request
-from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import RedirectResponse, PlainTextResponse, JSONResponse, Response, StreamingResponse
 from pydantic import BaseModel, HttpUrl
+from fastapi.concurrency import run_in_threadpool
 from dotenv import load_dotenv
+from contextlib import asynccontextmanager
+import asyncio
+import hmac
+import logging
 import os
+import time
 from typing import Optional, Literal
 
 # Rate limiting
@@ -12,44 +17,280 @@ from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 
 # Internal services
-from services.image_service import download_image, save_image
+from services.logging_service import configure_logging
+from services.http_service import (
+    ORJSONResponse,
+    CompressionMiddleware,
+    CachedStaticFiles,
+    conditional_json_response,
+    compute_etag
+)
+from services.tracing_service import (
+    REQUEST_ID_HEADER,
+    configure_tracing,
+    start_span,
+    set_span_attribute,
+    resolve_request_id,
+    parse_traceparent,
+    format_traceparent,
+    set_request_id,
+    reset_request_id,
+    flush_spans
+)
+from services.image_service import download_image, save_image, init_supabase, check_storage
 from services.fal_service import kontext_nonblocking
+from services.preprocess_service import preprocess_image
+from services.executor_service import run_in_process, run_in_thread, get_executor_stats, shutdown_executors
+from services.image_transforms import decode_base64_image
+from services.diagnostics_service import (
+    DEBUG_PROFILER_ENABLED,
+    start_loop_monitor,
+    stop_loop_monitor,
+    get_loop_stats,
+    profile
+)
+from services.derivative_service import save_generated_image, get_or_create_derivative
+from services.model_router import (
+    QUALITY_LEVELS,
+    ROUTER_LATENCY_SLO_MS,
+    ROUTER_MAX_ATTEMPTS,
+    choose_models,
+    track_model_call,
+    get_router_stats
+)
 
 # Database setup
-from services.database import engine, Base
-from services import models
+from services.database import init_database, check_database, dispose_database
+from services.history_service import record_request
+
+# Durable re-host queue (step 4 retries after a paid generation)
+from services.rehost_service import (
+    REHOST_QUEUE_ENABLED,
+    REHOST_POLL_INTERVAL_SECONDS,
+    RehostQueued,
+    enqueue_rehost_job,
+    get_pending_job_id,
+    get_rehost_job,
+    run_rehost_worker_forever
+)
+
+# Cache administration (stats, bulk invalidation, snapshots)
+from services.cache_admin import get_cache_stats, purge_cache, export_cache, import_cache
+
+# Cache warming (background refresh of popular entries)
+from services.cache_warmer import (
+    CACHE_WARMER_INTERVAL_SECONDS,
+    run_cache_warmer_forever
+)
 
 # Cache imports
 from services.cache_service import (
-    retrieve_cached_response,
-    store_response_in_cache,
-    retrieve_cached_response_for_upload,
-    store_response_in_cache_for_upload
+    generate_unique_request_key,
+    generate_unique_request_key_for_image_hash,
+    hash_image_bytes,
+    get_cache_entry,
+    set_cache_entry,
+    init_redis,
+    check_redis,
+    close_redis,
+    is_cache_available,
+    get_result_id,
+    get_cache_key_for_result_id,
+    get_legacy_result_cache_keys,
+    acquire_refresh_lock,
+    release_refresh_lock,
+    keep_refresh_lock_alive,
+    acquire_generation_lock,
+    release_generation_lock,
+    keep_generation_lock_alive,
+    is_generation_in_flight,
+    retrieve_negative_result,
+    store_negative_result,
+    parse_cache_model_versions,
+    CACHE_MODEL_VERSIONS_SETTING
 )
 
-import base64
 from services.image_service import validate_upload_file_size, validate_image_type_from_magic_bytes
+from services.shared_state import get_rate_limit_storage_uri, get_job_status
 
 
 # Load environment variables
 load_dotenv()
 
-FAL_KEY = os.getenv("FAL_KEY")
-if not FAL_KEY:
-    raise ValueError("FAL_KEY not found in .env file! App cannot start.")
+logger = logging.getLogger(__name__)
 
-Base.metadata.create_all(bind=engine)
+READINESS_CHECK_TIMEOUT_SECONDS = 2.0
+IN_FLIGHT_POLL_SECONDS = 0.25  # How often a coalesced request checks for the leader's result
+RESULT_CACHE_CONTROL = "public, max-age=60"  # A refresh may replace the entry; revalidating is a cheap 304
+FRONTEND_BUILD_DIRECTORY = os.path.join("static", "dist")  # Output of build_assets.py
+JOB_CACHE_CONTROL = "no-cache"  # Job status changes: always revalidate (unchanged -> 304)
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")  # Unset: /admin/* does not exist (404)
 
 # Rate limiting configuration
-# Uses IP address to track request rates and prevent abuse
-limiter = Limiter(key_func=get_remote_address)
+# Uses IP address to track request rates and prevent abuse.
+# With SHARED_STATE_BACKEND=redis the counters live in Redis, so the limit
+# holds across all workers/replicas (falls back to memory if Redis is down).
+limiter = Limiter(
+    key_func=get_remote_address,
+    storage_uri=get_rate_limit_storage_uri(),
+    in_memory_fallback_enabled=True
+)
+
+
+# Filled in by warm_up_services(); /health/ready reports 503 until "ready" is True
+startup_state = {"ready": False, "startup_ms": None, "checks": {}}
+
+
+def validate_config() -> None:
+    """
+    Fails startup on missing required settings (cheap, no network).
+
+    Raises:
+        ValueError: If FAL_KEY or the Supabase credentials are missing,
+                    or CACHE_MODEL_VERSIONS is malformed
+    """
+    if not os.getenv("FAL_KEY"):
+        raise ValueError("FAL_KEY not found in .env file! App cannot start.")
+    if not os.getenv("SUPABASE_URL") or not os.getenv("SUPABASE_KEY"):
+        raise ValueError("Missing SUPABASE_URL or SUPABASE_KEY in .env file")
+    parse_cache_model_versions(CACHE_MODEL_VERSIONS_SETTING)
+
+
+async def warm_up_services() -> None:
+    """
+    Per-process connection warm-up, all in parallel.
+
+    Nothing here runs at import time, so importing main is cheap and each
+    worker process (uvicorn --workers, gunicorn forks) opens its own connections.
+    Nothing here can block boot either: failures are reported by /health/ready.
+
+    - Redis: optional, failure disables the cache
+    - Database: optional (request history)
+    - Storage (Supabase): required for readiness
+    """
+    started_at = time.perf_counter()
+    redis_result, database_result, storage_result = await asyncio.gather(
+        asyncio.to_thread(init_redis),
+        asyncio.to_thread(init_database),
+        asyncio.to_thread(init_supabase),
+        return_exceptions=True
+    )
+    startup_state["startup_ms"] = round((time.perf_counter() - started_at) * 1000)
+    startup_state["checks"] = {
+        "redis": "ok" if redis_result is True else "disabled",
+        "database": "ok" if database_result is True else "error",
+        "storage": "error" if isinstance(storage_result, Exception) else "ok"
+    }
+    startup_state["ready"] = True
+    logger.info("Warm-up complete", extra={"startup_ms": startup_state["startup_ms"], **startup_state["checks"]})
+
+
+async def shutdown_services() -> None:
+    startup_state["ready"] = False
+    await asyncio.gather(asyncio.to_thread(close_redis), asyncio.to_thread(dispose_database))
+
 
-app = FastAPI(title="fal proxy app")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Starts background jobs when the server starts and stops them on shutdown.
+
+    Connections (Redis, database, storage) are opened here, per worker
+    process, instead of at import time.
+    The cache warmer only runs when CACHE_WARMER_INTERVAL_SECONDS > 0,
+    the event-loop monitor only when LOOP_MONITOR_ENABLED=true,
+    the re-host worker only when the queue is enabled (DATABASE_URL set).
+    """
+    configure_logging()
+    configure_tracing()
+    validate_config()
+
+    # Accept connections right away (live); /health/ready flips once this finishes
+    warm_up_task = asyncio.create_task(warm_up_services())
+    start_loop_monitor()
+
+    cache_warmer_task = None
+    if CACHE_WARMER_INTERVAL_SECONDS > 0:
+        cache_warmer_task = asyncio.create_task(
+            run_cache_warmer_forever(generate_for_cache_warmer, ENDPOINT_MODEL_PATHS)
+        )
+
+    rehost_worker_task = None
+    if REHOST_QUEUE_ENABLED:
+        rehost_worker_task = asyncio.create_task(run_rehost_worker_forever(rehost_generated_images))
+
+    yield
+
+    warm_up_task.cancel()
+    if cache_warmer_task:
+        cache_warmer_task.cancel()
+    if rehost_worker_task:
+        rehost_worker_task.cancel()
+    shutdown_executors()
+    stop_loop_monitor()
+    await shutdown_services()
+    flush_spans()
+
+
+app = FastAPI(title="fal proxy app", lifespan=lifespan, default_response_class=ORJSONResponse)
+app.add_middleware(CompressionMiddleware)
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+
+async def rehost_queued_handler(request: Request, exc: RehostQueued) -> Response:
+    """
+    Generation succeeded but re-hosting is still in progress: 202 with the job to poll.
+    "status" is the job's own status, as GET /jobs/{id} reports it.
+    """
+    status_url = f"/jobs/{exc.job_id}"
+    job_status = get_job_status(exc.job_id) or {}
+    return ORJSONResponse(
+        {"status": job_status.get("status", "pending"), "job_id": exc.job_id, "status_url": status_url},
+        status_code=202,
+        headers={"Location": status_url, "Retry-After": str(int(REHOST_POLL_INTERVAL_SECONDS))}
+    )
+
+
+app.add_exception_handler(RehostQueued, rehost_queued_handler)
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    Wraps every request in a root span and tags it with a request id.
+
+    - X-Request-ID from the caller is kept (so ids match across services), otherwise generated
+    - A W3C traceparent header continues the caller's trace
+    - Both are returned in the response headers so users can quote them in bug reports
+    """
+    request_id = resolve_request_id(request.headers.get(REQUEST_ID_HEADER))
+    trace_id, parent_span_id = parse_traceparent(request.headers.get("traceparent"))
+    request_id_token = set_request_id(request_id)
+    try:
+        span_attributes = {"http.method": request.method, "http.path": request.url.path, "request.id": request_id}
+        with start_span("http.request", span_attributes, trace_id=trace_id, parent_span_id=parent_span_id) as span:
+            response = await call_next(request)
+            span.set_attribute("http.status_code", response.status_code)
+            if response.status_code >= 500:
+                span.status = "ERROR"
+    finally:
+        reset_request_id(request_id_token)
+
+    response.headers[REQUEST_ID_HEADER] = request_id
+    response.headers["traceparent"] = format_traceparent(span)
+    return response
+
+
 # Mount static files
-app.mount("/static", StaticFiles(directory="static"), name="static")
+# The built frontend (python build_assets.py) is used when present: fingerprinted,
+# minified, precompressed assets under /assets, cached as immutable. /static keeps
+# serving the source files (revalidated on every use) for development.
+FRONTEND_IS_BUILT = os.path.exists(os.path.join(FRONTEND_BUILD_DIRECTORY, "manifest.json"))
+app.mount("/static", CachedStaticFiles(directory="static"), name="static")
+if FRONTEND_IS_BUILT:
+    app.mount("/assets", CachedStaticFiles(directory=os.path.join(FRONTEND_BUILD_DIRECTORY, "assets"), immutable=True), name="assets")
+frontend_files = CachedStaticFiles(directory=FRONTEND_BUILD_DIRECTORY if FRONTEND_IS_BUILT else "static")
 
 
 class ImageRequest(BaseModel):
@@ -79,6 +320,16 @@ class ImageRequest(BaseModel):
     acceleration: Optional[Literal["none", "regular", "high"]] = None
     resolution_mode: Optional[Literal["auto", "match_input", "1:1", "16:9", "21:9", "3:2", "2:3", "4:5", "5:4", "3:4", "4:3", "9:16", "9:21"]] = None
 
+
+class CachePurgeRequest(BaseModel):
+    """Filters for POST /admin/cache/purge; all given filters must match. At least one (or all=true) is required."""
+    model: Optional[str] = None
+    version: Optional[int] = None
+    legacy: bool = False
+    older_than_seconds: Optional[float] = None
+    all: bool = False
+    dry_run: bool = False
+
 # Instead of hardcoding endpoint paths in multiple places, define them once here.
 FAL_ENDPOINT_CONFIG = {
     "kontext": "fal-ai/flux-pro/kontext",
@@ -87,9 +338,23 @@ FAL_ENDPOINT_CONFIG = {
 }
 
 
+# Route path -> model path. Request history stores the route path, so the
+# cache warmer uses this to replay popular requests against the right model.
+ENDPOINT_MODEL_PATHS = {
+    "/kontext": FAL_ENDPOINT_CONFIG["kontext"],
+    "/kontext/max": FAL_ENDPOINT_CONFIG["kontext-max"],
+    "/kontext/dev": FAL_ENDPOINT_CONFIG["kontext-dev"]
+}
+MODEL_PATH_ENDPOINTS = {model_path: route for route, model_path in ENDPOINT_MODEL_PATHS.items()}
+
+
 # This function contains ALL the repeated logic from your original endpoints.
 # Now we write it ONCE and reuse it everywhere.
-async def process_kontext_request(request: ImageRequest, fal_model_path: str) -> dict:
+async def process_kontext_request(
+    request: ImageRequest,
+    fal_model_path: str,
+    response_info: Optional[dict] = None
+) -> dict:
     """
     Generic handler for ALL kontext endpoints.
 
@@ -98,6 +363,11 @@ async def process_kontext_request(request: ImageRequest, fal_model_path: str) ->
     2. image_data: Decode base64 from file upload
 
     Both follow the same flow after getting the image bytes.
+    Every request (cache hit, success or failure) is recorded in the
+    `requests` table so the cache warmer knows what is popular.
+
+    Args:
+        response_info: Optional dict filled with "cache_key" (None if uncacheable)
     """
     # Validate: exactly one input method
     if not request.image_url and not request.image_data:
@@ -110,128 +380,447 @@ async def process_kontext_request(request: ImageRequest, fal_model_path: str) ->
             status_code=400,
             detail="Please provide only one: image_url OR image_data, not both"
         )
-    
+
+    request_started_at = time.perf_counter()
+    set_span_attribute("fal.model", fal_model_path)
+
+    # Decode uploads once, off the event loop: the bytes are reused for the cache key and the pipeline
+    decoded_upload_bytes = None
+    if request.image_data:
+        with start_span("input.decode", {"upload.base64_bytes": len(request.image_data)}):
+            decoded_upload_bytes = await decode_upload(request.image_data)
+
     # Check cache for both URLs and uploads
-    cached_result = None
-    if request.image_url:
-        cached_result = retrieve_cached_response(str(request.image_url), request.prompt, fal_model_path)
-    elif request.image_data:
-        cached_result = retrieve_cached_response_for_upload(request.image_data, request.prompt, fal_model_path)
-    if cached_result:
+    with start_span("cache.lookup") as span:
+        cache_key = await get_request_cache_key(request, fal_model_path, decoded_upload_bytes)
+        cache_entry = get_cache_entry(cache_key) if cache_key else None
+        span.set_attribute("cache.key", cache_key or "")
+        span.set_attribute("cache.result", ("stale" if cache_entry[1] else "hit") if cache_entry else "miss")
+    if response_info is not None:
+        response_info["cache_key"] = cache_key
+    if cache_entry:
+        cached_result, is_stale = cache_entry
+        if is_stale:
+            # Serve the stale result now, refresh it in the background
+            schedule_background_refresh(cache_key, request, fal_model_path)
+        record_request_history(request, fal_model_path, request_started_at, "success", cached_result)
         return cached_result
 
+    # An identical request already paid for this generation and its re-hosting is queued: share that job
+    if cache_key:
+        pending_job_id = get_pending_job_id(cache_key)
+        if pending_job_id:
+            raise RehostQueued(pending_job_id)
+
+    # Single-flight: identical concurrent misses (on any worker) share one fal.ai generation
+    generation_lock_token = None
+    if cache_key and is_cache_available():
+        generation_lock_token = acquire_generation_lock(cache_key)
+        if not generation_lock_token:
+            with start_span("cache.wait_in_flight", {"cache.key": cache_key}):
+                in_flight_result = await wait_for_in_flight_result(cache_key)
+            if in_flight_result is not None:
+                record_request_history(request, fal_model_path, request_started_at, "success", in_flight_result)
+                return in_flight_result
+        else:
+            # Another request may have stored the result and released the lock between our miss and our acquire
+            cache_entry = get_cache_entry(cache_key)
+            if cache_entry:
+                release_generation_lock(cache_key, generation_lock_token)
+                record_request_history(request, fal_model_path, request_started_at, "success", cache_entry[0])
+                return cache_entry[0]
+
+    pipeline_timings = {}
+    # Held for as long as the generation takes (fal retries and uploads included)
+    generation_lock_renewal = (
+        asyncio.create_task(keep_generation_lock_alive(cache_key, generation_lock_token))
+        if generation_lock_token else None
+    )
+    try:
+        response_data = await run_kontext_pipeline(
+            request, fal_model_path, pipeline_timings, decoded_upload_bytes, cache_key
+        )
+
+        # Step 5: Save to cache (for both URL and upload requests), before waiting requests are released
+        if cache_key:
+            with start_span("cache.store", {"cache.key": cache_key}):
+                set_cache_entry(cache_key, response_data)
+    except HTTPException as e:
+        record_request_history(
+            request, fal_model_path, request_started_at, "failed",
+            timings=pipeline_timings, error_message=str(e.detail)
+        )
+        raise
+    except RehostQueued:
+        record_request_history(
+            request, fal_model_path, request_started_at, "queued",
+            timings=pipeline_timings, error_message="Re-hosting queued"
+        )
+        raise
+    finally:
+        if generation_lock_token:
+            generation_lock_renewal.cancel()
+            release_generation_lock(cache_key, generation_lock_token)
+
+    record_request_history(
+        request, fal_model_path, request_started_at, "success", response_data, timings=pipeline_timings
+    )
+    return response_data
+
+
+async def run_kontext_pipeline(
+    request: ImageRequest,
+    fal_model_path: str,
+    timings: Optional[dict] = None,
+    decoded_upload_bytes: Optional[bytes] = None,
+    cache_key: Optional[str] = None
+) -> dict:
+    """
+    Runs steps 1-4 (fetch input, upload input, call fal.ai, re-host outputs)
+    without touching the cache.
+
+    Split out of process_kontext_request so the cache warmer can regenerate a
+    popular entry without being short-circuited by the entry it is refreshing.
+
+    Args:
+        timings: Optional dict filled with "fal_api_time" (ms) and
+                 "input_image_url" (our public copy of the input)
+        decoded_upload_bytes: Already-decoded image_data, if the caller has it
+        cache_key: Where a queued re-host job caches its result (see step 4)
+
+    Raises:
+        RehostQueued: fal.ai succeeded but step 4 failed; a background job
+                      retries it (only when the re-host queue is available)
+    """
+    if timings is None:
+        timings = {}
+
+    # Known-bad URLs are rejected without downloading them again
+    if request.image_url:
+        known_input_error = retrieve_negative_result(str(request.image_url))
+        if known_input_error:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Failed to process input image: {known_input_error}"
+            )
+
     # STEP 1: Get image bytes (different source, same result)
     try:
-        if request.image_url:
-            # From URL: download it
-            user_source_image_bytes = await download_image(str(request.image_url))
-        else:
-            # From upload: decode base64
-            user_source_image_bytes = base64.b64decode(request.image_data)
-            # Validate the uploaded file size
-            validate_upload_file_size(len(user_source_image_bytes))
+        with start_span("input.fetch", {"input.source": "url" if request.image_url else "upload"}) as span:
+            if request.image_url:
+                # From URL: download it
+                user_source_image_bytes = await download_image(str(request.image_url))
+            else:
+                # From upload: decode base64 (in the process pool for large uploads)
+                if decoded_upload_bytes is None:
+                    decoded_upload_bytes = await run_in_process(
+                        decode_base64_image, request.image_data, size_bytes=len(request.image_data)
+                    )
+                user_source_image_bytes = decoded_upload_bytes
+                # Validate the uploaded file size
+                validate_upload_file_size(len(user_source_image_bytes))
 
-        # Validate image type for both URL and upload
-        validate_image_type_from_magic_bytes(user_source_image_bytes)
+            # Validate image type for both URL and upload
+            source_mime_type = validate_image_type_from_magic_bytes(user_source_image_bytes)
+            span.set_attribute("input.bytes", len(user_source_image_bytes))
+            span.set_attribute("input.mime_type", source_mime_type)
     except ValueError as e:
         # User error: invalid URL, wrong format, too large
+        # These fail the same way every time, so remember them for a few minutes
+        if request.image_url:
+            store_negative_result(str(request.image_url), str(e))
         raise HTTPException(
             status_code=400,
             detail=f"Failed to process input image: {str(e)}"
         )
     except Exception as e:
         # Network/server error after retries (for URLs)
-        print(f"Input image processing error: {e}")
+        logger.exception("Input image processing error", extra={"error": str(e)})
         raise HTTPException(
             status_code=500,
             detail="Failed to process input image. Please check the input and try again."
         )
 
+    # Optional: shrink oversized inputs (runs in a worker process, falls back to the original)
+    with start_span("input.preprocess", {"input.bytes": len(user_source_image_bytes)}) as span:
+        user_source_image_bytes = await preprocess_image(user_source_image_bytes, source_mime_type)
+        span.set_attribute("output.bytes", len(user_source_image_bytes))
+
     # STEP 2: Upload input image to Supabase and get public URL (SAME for both)
     try:
-        public_input_image_url = await save_image(user_source_image_bytes)
+        with start_span("input.upload") as span:
+            public_input_image_url = await save_image(user_source_image_bytes)
+            span.set_attribute("storage.url", public_input_image_url)
+        timings["input_image_url"] = public_input_image_url
     except ValueError as e:
         # Image validation failed
         raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         # Supabase upload failed
-        print(f"Supabase upload error (input): {e}")
+        logger.exception("Supabase upload error (input)", extra={"error": str(e)})
         raise HTTPException(
             status_code=500,
             detail="Failed to upload input image to storage. Please try again."
         )
 
     # STEP 3: Call fal.ai API
+    fal_call_started_at = time.perf_counter()
     try:
-        fal_api_response = await kontext_nonblocking(
-            image_url=public_input_image_url,
-            prompt=request.prompt,
-            model_path=fal_model_path,
-            seed=request.seed,
-            guidance_scale=request.guidance_scale,
-            sync_mode=request.sync_mode,
-            num_images=request.num_images,
-            output_format=request.output_format,
-            enhance_prompt=request.enhance_prompt,
-            safety_tolerance=request.safety_tolerance,
-            aspect_ratio=request.aspect_ratio,
-            num_inference_steps=request.num_inference_steps,
-            enable_safety_checker=request.enable_safety_checker,
-            acceleration=request.acceleration,
-            resolution_mode=request.resolution_mode
-        )
+        # Child fal.submit spans record each retry attempt and the fal request id
+        # track_model_call feeds the /kontext/auto router's latency/error stats
+        with start_span("fal.generate", {"fal.model": fal_model_path}), track_model_call(fal_model_path):
+            fal_api_response = await kontext_nonblocking(
+                image_url=public_input_image_url,
+                prompt=request.prompt,
+                model_path=fal_model_path,
+                seed=request.seed,
+                guidance_scale=request.guidance_scale,
+                sync_mode=request.sync_mode,
+                num_images=request.num_images,
+                output_format=request.output_format,
+                enhance_prompt=request.enhance_prompt,
+                safety_tolerance=request.safety_tolerance,
+                aspect_ratio=request.aspect_ratio,
+                num_inference_steps=request.num_inference_steps,
+                enable_safety_checker=request.enable_safety_checker,
+                acceleration=request.acceleration,
+                resolution_mode=request.resolution_mode
+            )
     except Exception as e:
         # fal.ai API failed after retries
-        print(f"fal.ai API error: {e}")
+        logger.error("fal.ai API error", extra={"error": str(e), "fal_model": fal_model_path})
         raise HTTPException(
             status_code=503,
             detail="fal.ai had a problem"
         )
+    finally:
+        timings["fal_api_time"] = int((time.perf_counter() - fal_call_started_at) * 1000)
 
     # STEP 4: Download and upload generated images (SAME for both)
     try:
-        processed_response_images = []
-        for remote_image_data in fal_api_response.get("images", []):
+        return await rehost_generated_images(fal_api_response)
+    except Exception as e:
+        logger.exception("Generated image processing error", extra={"error": str(e)})
+        # The generation is already paid for: keep it and retry re-hosting in the background
+        with start_span("rehost.enqueue"):
+            job_id = await run_in_threadpool(enqueue_rehost_job, fal_api_response, fal_model_path, cache_key, str(e))
+        if job_id:
+            raise RehostQueued(job_id)
+        raise HTTPException(
+            status_code=500,
+            detail="Failed to process generated images. The fal.ai completed but we couldn't save the results."
+        )
+
+
+async def rehost_generated_images(fal_api_response: dict) -> dict:
+    """
+    Step 4: copies the generated images from fal.ai's CDN to our storage
+    (plus variants) and builds the response. Also run by the re-host worker.
+    """
+    processed_response_images = []
+    with start_span("outputs.rehost", {"outputs.count": len(fal_api_response.get("images", []))}):
+        for image_index, remote_image_data in enumerate(fal_api_response.get("images", [])):
             remote_image_url = remote_image_data["url"]
 
-            # Download generated image from fal.ai
-            generated_asset_bytes = await download_image(remote_image_url)
+            with start_span("output.image", {"image.index": image_index, "fal.url": remote_image_url}) as span:
+                # Download generated image from fal.ai
+                generated_asset_bytes = await download_image(remote_image_url)
 
-            # Upload to our Supabase storage
-            public_generated_url = await save_image(generated_asset_bytes)
+                # Upload to our Supabase storage (plus thumbnail/medium variants)
+                saved_generated_image = await save_generated_image(generated_asset_bytes)
+                span.set_attribute("storage.url", saved_generated_image["url"])
 
-            processed_response_images.append({
-                "url": public_generated_url,
+            processed_image = {
+                "url": saved_generated_image["url"],
                 "width": remote_image_data.get("width"),
                 "height": remote_image_data.get("height")
-            })
-    except Exception as e:
-        # Failed to process generated images
-        print(f"Generated image processing error: {e}")
-        raise HTTPException(
-            status_code=500,
-            detail="Failed to process generated images. The fal.ai completed but we couldn't save the results."
-        )
+            }
+            if "variants" in saved_generated_image:
+                processed_image["variants"] = saved_generated_image["variants"]
+            processed_response_images.append(processed_image)
 
     # Build response
-    response_data = {
+    return {
         "images": processed_response_images,
         "prompt": fal_api_response.get("prompt")
     }
 
-    # Step 5: Save to cache (for both URL and upload requests)
+
+async def decode_upload(image_data: str) -> Optional[bytes]:
+    """
+    Decodes a base64 upload, in the process pool when it is large.
+
+    Returns None for invalid base64; run_kontext_pipeline reports that error to the user.
+    """
+    try:
+        return await run_in_process(decode_base64_image, image_data, size_bytes=len(image_data))
+    except ValueError:
+        return None
+
+
+async def get_request_cache_key(
+    request: ImageRequest,
+    fal_model_path: str,
+    decoded_upload_bytes: Optional[bytes] = None
+) -> Optional[str]:
+    """
+    Builds the cache key once per request (URL inputs hash the URL,
+    uploads hash the decoded image bytes in the thread pool).
+
+    Returns None for uploads that could not be decoded.
+    """
     if request.image_url:
-        store_response_in_cache(str(request.image_url), request.prompt, fal_model_path, response_data)
-    elif request.image_data:
-        store_response_in_cache_for_upload(request.image_data, request.prompt, fal_model_path, response_data)
+        return generate_unique_request_key(str(request.image_url), request.prompt, fal_model_path)
+    if decoded_upload_bytes is None:
+        return None
 
-    return response_data
+    image_hash = await run_in_thread(hash_image_bytes, decoded_upload_bytes, size_bytes=len(decoded_upload_bytes))
+    return generate_unique_request_key_for_image_hash(image_hash, request.prompt, fal_model_path)
+
+
+def build_kontext_response(response_data: dict, response_info: dict, headers: Optional[dict] = None) -> Response:
+    """
+    Kontext result with the ETag a later GET /results/{id} returns for the same
+    bytes, and a Content-Location pointing there (re-fetch with If-None-Match).
+
+    The body must be exactly the cached payload for that to hold: per-response
+    details (e.g. routing) go in `headers`, never in the body.
+    """
+    response = ORJSONResponse(response_data, headers=headers)
+    response.headers["ETag"] = compute_etag(response.body)
+    if response_info.get("cache_key") and is_cache_available():
+        response.headers["Content-Location"] = f"/results/{get_result_id(response_info['cache_key'])}"
+    return response
+
+
+async def wait_for_in_flight_result(cache_key: str) -> Optional[dict]:
+    """
+    Waits while another request (possibly on another worker) generates the same key.
+
+    The leader renews its lock while it works, so waiting ends when the lock
+    goes away: released after the result was stored, or expired because the
+    leader died.
+
+    Returns:
+        dict: The other request's result, once it is in the cache
+        None: If that request failed or died; the caller generates itself
+    """
+    while True:
+        await asyncio.sleep(IN_FLIGHT_POLL_SECONDS)
+        # Lock first, then cache: the leader stores the result before releasing the lock
+        still_in_flight = is_generation_in_flight(cache_key)
+        cache_entry = get_cache_entry(cache_key)
+        if cache_entry:
+            return cache_entry[0]
+        if not still_in_flight:
+            # The leader may have handed its generation to the re-host queue
+            pending_job_id = get_pending_job_id(cache_key)
+            if pending_job_id:
+                raise RehostQueued(pending_job_id)
+            return None
+
+
+# Keep references to background refreshes so they are not garbage collected mid-flight
+background_refresh_tasks = set()
+
+
+def schedule_background_refresh(cache_key: str, request: ImageRequest, fal_model_path: str) -> None:
+    """
+    Starts one background refresh for a stale cache entry.
+
+    The Redis lock makes this single-flight: if many users hit the same stale
+    entry at once, only the first one triggers a new fal.ai generation.
+    """
+    refresh_lock_token = acquire_refresh_lock(cache_key)
+    if not refresh_lock_token:
+        return
+
+    refresh_task = asyncio.create_task(refresh_cache_entry(cache_key, request, fal_model_path, refresh_lock_token))
+    background_refresh_tasks.add(refresh_task)
+    refresh_task.add_done_callback(background_refresh_tasks.discard)
+
+
+async def refresh_cache_entry(cache_key: str, request: ImageRequest, fal_model_path: str, refresh_lock_token: str) -> None:
+    """Regenerates a stale cache entry. Failures keep the stale entry in place."""
+    refresh_lock_renewal = asyncio.create_task(keep_refresh_lock_alive(cache_key, refresh_lock_token))
+    try:
+        with start_span("cache.refresh", {"cache.key": cache_key}):
+            response_data = await run_kontext_pipeline(request, fal_model_path, cache_key=cache_key)
+            set_cache_entry(cache_key, response_data)
+    except Exception as e:
+        logger.warning("Background refresh failed", extra={"cache_key": cache_key, "error": str(e)})
+    finally:
+        refresh_lock_renewal.cancel()
+        release_refresh_lock(cache_key, refresh_lock_token)
+
+
+# Keep references to pending history writes so they are not garbage collected mid-flight
+background_history_tasks = set()
+
+
+def record_request_history(
+    request: ImageRequest,
+    fal_model_path: str,
+    request_started_at: float,
+    status: str,
+    response_data: Optional[dict] = None,
+    timings: Optional[dict] = None,
+    error_message: Optional[str] = None
+) -> None:
+    """
+    Records the request in the `requests` table in the background.
+
+    Fire-and-forget: the response never waits for the database (a cache hit
+    would otherwise pay a DB round-trip). The row is built now, so the
+    response time is the one the user saw; the insert runs in the threadpool.
+
+    Uploads have no user-supplied URL, so they are stored as "upload:<our copy>"
+    which keeps them out of the cache warmer's (URL-only) candidates.
+    The generation params are stored so the warmer can replay the exact request.
+    """
+    timings = timings or {}
+    if request.image_url:
+        input_image_ref = str(request.image_url)
+    else:
+        input_image_ref = f"upload:{timings.get('input_image_url', '')}"
+
+    history_task = asyncio.create_task(run_in_threadpool(
+        record_request,
+        endpoint=MODEL_PATH_ENDPOINTS.get(fal_model_path, fal_model_path),
+        input_image_url=input_image_ref,
+        prompt=request.prompt,
+        status=status,
+        request_params=get_generation_params(request),
+        output_image_urls=[image["url"] for image in response_data.get("images", [])] if response_data else None,
+        total_response_time=int((time.perf_counter() - request_started_at) * 1000),
+        fal_api_time=timings.get("fal_api_time"),
+        error_message=error_message
+    ))
+    background_history_tasks.add(history_task)
+    history_task.add_done_callback(finish_history_task)
+
+
+def finish_history_task(history_task: asyncio.Task) -> None:
+    background_history_tasks.discard(history_task)
+    if not history_task.cancelled() and history_task.exception() is not None:
+        logger.warning("Request history write failed", extra={"error": str(history_task.exception())})
+
+
+def get_generation_params(request: ImageRequest) -> dict:
+    """Everything except the input and prompt that the user set (the cache key ignores these)."""
+    return request.model_dump(exclude={"image_url", "image_data", "prompt"}, exclude_none=True)
+
+
+async def generate_for_cache_warmer(image_url: str, prompt: str, model_path: str, params: dict) -> dict:
+    """Replays one popular request for the cache warmer, with the generation params it was made with."""
+    warmer_request = ImageRequest(image_url=image_url, prompt=prompt, **params)
+    return await run_kontext_pipeline(warmer_request, model_path)
 
 
 @app.get("/")
-async def root():
-    """Serve the frontend UI"""
-    return FileResponse("static/index.html")
+async def root(request: Request):
+    """Serve the frontend UI (no-cache: revalidated on each visit, so a new build shows up at once)"""
+    return await frontend_files.get_response("index.html", request.scope)
 
 @app.get("/health")
 async def health():
@@ -239,22 +828,247 @@ async def health():
     return {"message": "fal proxy app is running, go to /docs# for API documentation"}
 
 
+@app.get("/health/live")
+async def health_live():
+    """Liveness: the process and event loop respond. Never touches dependencies."""
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+async def health_ready():
+    """
+    Readiness: startup finished and storage is usable; Redis/database state is
+    reported but optional (the app degrades without them).
+    Each check runs in a thread with a timeout so a hung dependency can't hang the probe.
+    """
+    if not startup_state["ready"]:
+        return JSONResponse({"status": "starting", "checks": {}}, status_code=503)
+
+    check_functions = {"redis": check_redis, "database": check_database, "storage": check_storage}
+    results = await asyncio.gather(*(
+        asyncio.wait_for(asyncio.to_thread(check), READINESS_CHECK_TIMEOUT_SECONDS)
+        for check in check_functions.values()
+    ), return_exceptions=True)
+    checks = {
+        name: result if isinstance(result, str) else "timeout"
+        for name, result in zip(check_functions, results)
+    }
+
+    is_ready = checks["storage"] == "ok"
+    return JSONResponse(
+        {"status": "ready" if is_ready else "not_ready", "checks": checks, "startup_ms": startup_state["startup_ms"]},
+        status_code=200 if is_ready else 503
+    )
+
+
+@app.get("/metrics")
+async def metrics():
+    """Runtime metrics (executor queue depths, per-model router stats, event-loop lag) for monitoring"""
+    runtime_metrics = {"executors": get_executor_stats(), "models": get_router_stats()}
+    loop_stats = get_loop_stats()
+    if loop_stats is not None:
+        runtime_metrics["event_loop"] = loop_stats
+    return runtime_metrics
+
+
+def require_admin(request: Request) -> None:
+    """
+    Admin and debug endpoints need ADMIN_TOKEN as a bearer token.
+    Without ADMIN_TOKEN they answer 404, as if they did not exist.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = request.headers.get("authorization", "").removeprefix("Bearer ").strip()
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+def require_cache_admin(request: Request) -> None:
+    require_admin(request)
+    if not is_cache_available():
+        raise HTTPException(status_code=503, detail="Cache is not connected")
+
+
+@app.get("/debug/profile")
+async def debug_profile(request: Request, seconds: float = 5.0):
+    """
+    Samples all thread stacks for N seconds and returns them in collapsed
+    format (load into speedscope.app or pipe into flamegraph.pl).
+    Only available when DEBUG_PROFILER_ENABLED=true, and with the ADMIN_TOKEN.
+    """
+    if not DEBUG_PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Not Found")
+    require_admin(request)
+
+    try:
+        collapsed_stacks = await profile(seconds)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+    return PlainTextResponse(collapsed_stacks)
+
+
+@app.get("/admin/cache/stats")
+async def admin_cache_stats(request: Request):
+    """Entries, stale entries and size per model and cache version (SCAN + pipelines)."""
+    require_cache_admin(request)
+    return await run_in_threadpool(get_cache_stats)
+
+
+@app.post("/admin/cache/purge")
+async def admin_cache_purge(request: Request, purge_request: CachePurgeRequest):
+    """Deletes cache entries by model, version, age or legacy layout (dry_run only counts them)."""
+    require_cache_admin(request)
+    if purge_request.version is not None and not purge_request.model:
+        raise HTTPException(status_code=400, detail="version requires model")
+    has_filter = purge_request.model or purge_request.legacy or purge_request.older_than_seconds is not None
+    if not (has_filter or purge_request.all):
+        raise HTTPException(status_code=400, detail="Give model, legacy, older_than_seconds or all=true")
+
+    return await run_in_threadpool(
+        purge_cache,
+        purge_request.model,
+        purge_request.version,
+        purge_request.legacy,
+        purge_request.older_than_seconds,
+        purge_request.dry_run
+    )
+
+
+@app.get("/admin/cache/export")
+async def admin_cache_export(request: Request, model: Optional[str] = None, version: Optional[int] = None):
+    """Streams a JSON lines snapshot (the format `import` reads back)."""
+    require_cache_admin(request)
+    # A sync iterator: Starlette reads it in a thread, page by page
+    return StreamingResponse(export_cache(model, version), media_type="application/x-ndjson")
+
+
+@app.post("/admin/cache/import")
+async def admin_cache_import(request: Request, replace: bool = False):
+    """Restores a JSON lines snapshot from the request body (existing entries kept unless replace=true)."""
+    require_cache_admin(request)
+    body = await request.body()
+    return await run_in_threadpool(import_cache, body.decode("utf-8").splitlines(), replace)
+
+
+@app.get("/images/{image_id}/{variant_name}")
+async def image_variant(image_id: str, variant_name: str):
+    """
+    Serves a deferred derivative (e.g. /images/<id>/thumbnail.webp).
+    Rendered and stored on first access, then redirects to the storage URL.
+    """
+    try:
+        variant_url = await get_or_create_derivative(image_id, variant_name)
+    except ValueError:
+        raise HTTPException(status_code=404, detail="Image variant not found")
+    except Exception as e:
+        logger.exception("Derivative error", extra={"image_id": image_id, "variant_name": variant_name})
+        raise HTTPException(status_code=500, detail="Failed to create image variant")
+
+    return RedirectResponse(variant_url, status_code=302)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(request: Request, job_id: str):
+    """
+    Status of a queued re-host job (the 202 from a kontext endpoint points here):
+    "pending"/"running", "succeeded" with the result, or "failed" with the error.
+    Repeat polls of an unchanged job get 304.
+    """
+    try:
+        job_status = await run_in_threadpool(get_rehost_job, job_id)
+    except Exception as e:
+        logger.warning("Job store unavailable", extra={"job_id": job_id, "error": str(e)})
+        raise HTTPException(status_code=503, detail="Job status is temporarily unavailable")
+    if job_status is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+
+    return conditional_json_response(request, job_status, JOB_CACHE_CONTROL)
+
+
+@app.get("/results/{result_id}")
+async def get_result(request: Request, result_id: str):
+    """
+    A cached kontext result by id (the Content-Location of the POST response).
+    Sends ETag/Cache-Control; a repeat GET with If-None-Match gets 304 and no body.
+    """
+    cache_key = get_cache_key_for_result_id(result_id)
+    # Ids handed out before the model was part of the key are bare hashes
+    candidate_keys = [cache_key] if cache_key else get_legacy_result_cache_keys(result_id, FAL_ENDPOINT_CONFIG.values())
+    cache_entry = None
+    for candidate_key in candidate_keys:
+        cache_entry = get_cache_entry(candidate_key)
+        if cache_entry:
+            break
+    if cache_entry is None:
+        raise HTTPException(status_code=404, detail="Result not found or expired")
+
+    return conditional_json_response(request, cache_entry[0], RESULT_CACHE_CONTROL)
+
+
 @app.post("/kontext")
 @limiter.limit("5/minute")
 async def kontext_endpoint(request: Request, image_request: ImageRequest):
     """Standard kontext endpoint that accepts image_url or image_data with prompt"""
-    return await process_kontext_request(image_request, FAL_ENDPOINT_CONFIG["kontext"])
+    response_info = {}
+    response_data = await process_kontext_request(image_request, FAL_ENDPOINT_CONFIG["kontext"], response_info)
+    return build_kontext_response(response_data, response_info)
 
 
 @app.post("/kontext/max")
 @limiter.limit("5/minute")
 async def kontext_max_endpoint(request: Request, image_request: ImageRequest):
     """Max quality kontext endpoint that accepts image_url or image_data with prompt"""
-    return await process_kontext_request(image_request, FAL_ENDPOINT_CONFIG["kontext-max"])
+    response_info = {}
+    response_data = await process_kontext_request(image_request, FAL_ENDPOINT_CONFIG["kontext-max"], response_info)
+    return build_kontext_response(response_data, response_info)
 
 
 @app.post("/kontext/dev")
 @limiter.limit("5/minute")
 async def kontext_dev_endpoint(request: Request, image_request: ImageRequest):
     """Dev kontext endpoint that accepts image_url or image_data with prompt"""
-    return await process_kontext_request(image_request, FAL_ENDPOINT_CONFIG["kontext-dev"])
\ No newline at end of file
+    response_info = {}
+    response_data = await process_kontext_request(image_request, FAL_ENDPOINT_CONFIG["kontext-dev"], response_info)
+    return build_kontext_response(response_data, response_info)
+
+
+@app.post("/kontext/auto")
+@limiter.limit("5/minute")
+async def kontext_auto_endpoint(
+    request: Request,
+    image_request: ImageRequest,
+    policy: Literal["fastest", "cheapest"] = "fastest",
+    min_quality: Literal["draft", "standard", "max"] = "standard",
+    latency_slo_ms: int = ROUTER_LATENCY_SLO_MS
+):
+    """
+    Routed kontext endpoint: picks the model from live latency, error rate and
+    queue depth (see services/model_router.py). If fal.ai fails on the chosen
+    model, the request is retried once on the next sibling model.
+    The response reports the model that produced it (X-Kontext-Model header).
+    """
+    candidate_models = choose_models(policy, QUALITY_LEVELS[min_quality], latency_slo_ms)[:ROUTER_MAX_ATTEMPTS]
+    set_span_attribute("router.policy", policy)
+    set_span_attribute("router.candidates", ",".join(candidate_models))
+
+    for attempt_index, fal_model_path in enumerate(candidate_models):
+        response_info = {}
+        try:
+            response_data = await process_kontext_request(image_request, fal_model_path, response_info)
+        except HTTPException as e:
+            # Only fal.ai failures (503) are worth a sibling; bad input fails the same everywhere
+            if e.status_code != 503 or attempt_index == len(candidate_models) - 1:
+                raise
+            logger.warning("Model failed, falling back to sibling", extra={
+                "fal_model": fal_model_path, "fallback_model": candidate_models[attempt_index + 1]
+            })
+            continue
+
+        # Routing details are per response, not part of the cached entry: headers keep
+        # the body identical to GET /results/{id}, so its ETag revalidates there
+        return build_kontext_response(response_data, response_info, headers={
+            "X-Kontext-Model": fal_model_path,
+            "X-Kontext-Routing-Policy": policy,
+            "X-Kontext-Routing-Fallback": "true" if attempt_index > 0 else "false"
+        })
@@ -0,0 +1,72 @@
+"""
+Production launcher: uvicorn with one worker process per available CPU.
+
+Why: a single uvicorn process uses one core (image decoding, hashing and
+AVIF encoding are CPU-bound). Workers share nothing in memory, so rate
+limits, single-flight locks and job status go through Redis
+(SHARED_STATE_BACKEND=redis, set here by default when REDIS_URL is present).
+
+    python serve.py                      # WEB_CONCURRENCY workers, default: CPU count
+    WEB_CONCURRENCY=4 PORT=8000 python serve.py
+
+Behind a load balancer, FORWARDED_ALLOW_IPS must list the proxy so the
+rate limiter sees the client IP from X-Forwarded-For instead of the proxy's.
+"""
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+
+def available_cpu_count() -> int:
+    """
+    CPUs this process may actually use: the affinity mask, further limited
+    by a cgroup v2 CPU quota (docker --cpus / Kubernetes limits).
+    """
+    try:
+        cpu_count = len(os.sched_getaffinity(0))
+    except AttributeError:  # Not available on macOS
+        cpu_count = os.cpu_count() or 1
+
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as cpu_max_file:
+            quota, period = cpu_max_file.read().split()
+        if quota != "max":
+            cpu_count = min(cpu_count, max(1, int(int(quota) / int(period))))
+    except (OSError, ValueError):
+        pass
+
+    return max(1, cpu_count)
+
+
+def resolve_worker_count() -> int:
+    configured = os.getenv("WEB_CONCURRENCY")
+    if configured:
+        return max(1, int(configured))
+    return available_cpu_count()
+
+
+def main() -> None:
+    workers = resolve_worker_count()
+
+    # Must be set before workers import main (the limiter reads it at import)
+    os.environ.setdefault("SHARED_STATE_BACKEND", "redis" if os.getenv("REDIS_URL") else "memory")
+    if workers > 1 and os.environ["SHARED_STATE_BACKEND"] != "redis":
+        logging.basicConfig()
+        logger.warning(
+            "Running %d workers without Redis: rate limits and single-flight are per worker", workers
+        )
+
+    import uvicorn
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=workers,
+        proxy_headers=True,
+        forwarded_allow_ips=os.getenv("FORWARDED_ALLOW_IPS", "127.0.0.1"),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,394 @@
+"""
+Cache administration: per-model stats, bulk invalidation and snapshots.
+
+Why: the cache only had per-request reads and writes. Questions like "how
+much of the cache is fal-ai/flux-pro/kontext/max?" or "drop everything
+generated before the model update" needed ad-hoc KEYS calls, which block
+Redis for the whole keyspace walk.
+
+Keys are kontext_cache:{model path}:v{version}:{hash} (see
+cache_service.build_cache_key), so one model, or one version of it, is a
+SCAN MATCH pattern. Everything here:
+- walks the keyspace with SCAN (SCAN_BATCH_SIZE keys per call, never KEYS)
+- sends the per-key commands of each SCAN page as one pipeline, so a page
+  costs two round trips instead of one per key
+- never touches lock keys ({cache_key}:refreshing / :generating)
+
+Legacy keys (kontext_cache:{hash}, written before the model was part of the
+key) are reported as "legacy". Their model cannot be recovered from the
+hash: they are moved to the new layout when read (cache_service.read_cache_value),
+expire on their own, or can be dropped with `purge --legacy`.
+
+    python -m services.cache_admin stats
+    python -m services.cache_admin purge --model fal-ai/flux-pro/kontext --version 1 --dry-run
+    python -m services.cache_admin purge --older-than 86400
+    python -m services.cache_admin export cache.jsonl --model fal-ai/flux-pro/kontext/max
+    python -m services.cache_admin import cache.jsonl
+
+The same operations are served under /admin/cache/* when ADMIN_TOKEN is set.
+"""
+import argparse
+import contextlib
+import json
+import logging
+import sys
+import time
+from typing import Iterable, Iterator, List, Optional
+
+from services import cache_service
+from services.cache_service import (
+    CACHE_KEY_PREFIX,
+    CACHE_STALE_WINDOW_SECONDS,
+    CACHE_TTL_SECONDS,
+    get_model_cache_version,
+    parse_cache_key
+)
+
+logger = logging.getLogger(__name__)
+
+SCAN_BATCH_SIZE = 500  # Keys per SCAN call, and commands per pipeline
+LEGACY_BUCKET = "legacy"
+GLOB_SPECIAL_CHARACTERS = "\\*?[]"
+
+
+def get_redis_client():
+    if cache_service.redis_client is None:
+        raise RuntimeError("Redis is not connected")
+    return cache_service.redis_client
+
+
+def escape_glob(text: str) -> str:
+    return "".join(f"\\{char}" if char in GLOB_SPECIAL_CHARACTERS else char for char in text)
+
+
+def build_match_pattern(model: Optional[str] = None, version: Optional[int] = None) -> str:
+    """SCAN MATCH pattern for all entries, one model, or one version of a model."""
+    if model is None:
+        return f"{CACHE_KEY_PREFIX}*"
+    if version is None:
+        return f"{CACHE_KEY_PREFIX}{escape_glob(model)}:v*"
+    return f"{CACHE_KEY_PREFIX}{escape_glob(model)}:v{version}:*"
+
+
+def scan_cache_keys(
+    model: Optional[str] = None,
+    version: Optional[int] = None,
+    legacy: Optional[bool] = False
+) -> Iterator[List[tuple]]:
+    """
+    Yields pages of (key, parsed key) for cache entries (lock keys skipped).
+
+    legacy=True yields only legacy keys, legacy=None both kinds (one walk of the
+    whole keyspace). A key may be yielded twice if the keyspace is resized
+    during the walk (a SCAN guarantee), never skipped.
+    """
+    redis_client = get_redis_client()
+    # Legacy keys carry no model or version, so any walk that includes them matches everything
+    match_pattern = build_match_pattern(model, version) if legacy is False else build_match_pattern()
+    cursor = 0
+    while True:
+        cursor, keys = redis_client.scan(cursor=cursor, match=match_pattern, count=SCAN_BATCH_SIZE)
+        page = []
+        for key in keys:
+            parsed_key = parse_cache_key(key)
+            if parsed_key is None or (legacy is not None and parsed_key["legacy"] != legacy):
+                continue
+            # MATCH is a glob: "{model}:v*" could also match a model path that continues with ":v"
+            if model is not None and legacy is False and parsed_key["model"] != model:
+                continue
+            page.append((key, parsed_key))
+        if page:
+            yield page
+        if cursor == 0:
+            return
+
+
+def get_entry_age_seconds(cached_json_string: Optional[str], now: float) -> Optional[float]:
+    """
+    Age of an entry from its envelope; None if it cannot be told.
+
+    Entries written before "created_at" was added have the default soft TTL
+    (store_response_in_cache), so fresh_until - CACHE_TTL_SECONDS is their creation time.
+    """
+    if not cached_json_string:
+        return None
+    try:
+        envelope = json.loads(cached_json_string)
+    except ValueError:
+        return None
+    if not isinstance(envelope, dict):
+        return None
+    if "created_at" in envelope:
+        return now - envelope["created_at"]
+    if "fresh_until" in envelope:
+        return now - (envelope["fresh_until"] - CACHE_TTL_SECONDS)
+    return None
+
+
+def new_stats_bucket() -> dict:
+    return {"entries": 0, "stale_entries": 0, "value_bytes": 0, "memory_bytes": 0}
+
+
+def new_legacy_stats_bucket() -> dict:
+    """Legacy values are plain JSON without a fresh_until envelope: they have no stale/fresh state."""
+    return {"entries": 0, "value_bytes": 0, "memory_bytes": 0}
+
+
+def get_cache_stats() -> dict:
+    """
+    Entries, stale entries and size per model (and per version of each model),
+    plus legacy keys as their own category, from a single SCAN of the keyspace.
+
+    Per page, one pipeline of STRLEN + TTL + MEMORY USAGE per key. MEMORY USAGE
+    includes Redis' own overhead, but some managed Redis services disable it:
+    memory_bytes is then None and value_bytes is the only size.
+    An entry is stale when its remaining TTL is within the stale window (legacy
+    entries have no such window and are never counted as stale).
+    """
+    redis_client = get_redis_client()
+    stats = {"models": {}, LEGACY_BUCKET: new_legacy_stats_bucket(), "total": new_stats_bucket()}
+    memory_usage_supported = True
+
+    for page in scan_cache_keys(legacy=None):
+        with_memory_usage = memory_usage_supported
+        pipeline = redis_client.pipeline(transaction=False)
+        for key, _ in page:
+            pipeline.strlen(key)
+            pipeline.ttl(key)
+            if with_memory_usage:
+                pipeline.memory_usage(key)
+        results = pipeline.execute(raise_on_error=False)
+        commands_per_key = 3 if with_memory_usage else 2
+
+        for index, (key, parsed_key) in enumerate(page):
+            value_bytes, ttl_seconds = results[index * commands_per_key:index * commands_per_key + 2]
+            if ttl_seconds == -2 or isinstance(value_bytes, Exception):
+                continue  # Expired between SCAN and the pipeline
+            memory_bytes = results[index * commands_per_key + 2] if with_memory_usage else None
+            if isinstance(memory_bytes, Exception):
+                memory_usage_supported = False
+                memory_bytes = None
+
+            if parsed_key["legacy"]:
+                buckets = [stats[LEGACY_BUCKET]]
+            else:
+                model_stats = stats["models"].setdefault(parsed_key["model"], {
+                    **new_stats_bucket(),
+                    "current_version": get_model_cache_version(parsed_key["model"]),
+                    "versions": {}
+                })
+                version_stats = model_stats["versions"].setdefault(str(parsed_key["version"]), new_stats_bucket())
+                buckets = [model_stats, version_stats]
+
+            for bucket in buckets + [stats["total"]]:
+                bucket["entries"] += 1
+                if not parsed_key["legacy"]:
+                    bucket["stale_entries"] += int(0 <= ttl_seconds <= CACHE_STALE_WINDOW_SECONDS)
+                bucket["value_bytes"] += value_bytes
+                bucket["memory_bytes"] += memory_bytes or 0
+
+    if not memory_usage_supported:
+        for bucket in iterate_stats_buckets(stats):
+            bucket["memory_bytes"] = None
+    return stats
+
+
+def iterate_stats_buckets(stats: dict) -> Iterator[dict]:
+    yield stats[LEGACY_BUCKET]
+    yield stats["total"]
+    for model_stats in stats["models"].values():
+        yield model_stats
+        yield from model_stats["versions"].values()
+
+
+def purge_cache(
+    model: Optional[str] = None,
+    version: Optional[int] = None,
+    legacy: bool = False,
+    older_than_seconds: Optional[float] = None,
+    dry_run: bool = False
+) -> dict:
+    """
+    Deletes the entries matching all given filters (no filter: every entry).
+
+    Deletion is UNLINK (memory is freed in the background, Redis does not
+    block on large values), one pipeline per page. older_than_seconds needs
+    each entry's envelope, read with a pipelined GET first.
+
+    Returns:
+        dict: {"matched", "deleted"} (deleted is 0 with dry_run)
+    """
+    redis_client = get_redis_client()
+    summary = {"matched": 0, "deleted": 0}
+
+    for page in scan_cache_keys(model=model, version=version, legacy=legacy):
+        keys = [key for key, _ in page]
+        if older_than_seconds is not None:
+            pipeline = redis_client.pipeline(transaction=False)
+            for key in keys:
+                pipeline.get(key)
+            now = time.time()
+            keys = [
+                key for key, cached_json_string in zip(keys, pipeline.execute())
+                if (get_entry_age_seconds(cached_json_string, now) or 0) > older_than_seconds
+            ]
+
+        summary["matched"] += len(keys)
+        if dry_run or not keys:
+            continue
+        pipeline = redis_client.pipeline(transaction=False)
+        for key in keys:
+            pipeline.unlink(key)
+        summary["deleted"] += sum(pipeline.execute())
+
+    logger.info("Cache purge", extra={
+        "model": model, "version": version, "legacy": legacy,
+        "older_than_seconds": older_than_seconds, "dry_run": dry_run, **summary
+    })
+    return summary
+
+
+def export_cache(model: Optional[str] = None, version: Optional[int] = None) -> Iterator[str]:
+    """
+    Snapshot as JSON lines: {"key", "value", "expires_at"} (unix time, None = no expiry).
+
+    An absolute expiry (not the remaining TTL) means a snapshot restored
+    later does not bring entries back for longer than they had left.
+    Legacy entries are exported only with the whole cache (no model filter).
+    """
+    redis_client = get_redis_client()
+    key_pages = [scan_cache_keys(model=model, version=version)]
+    if model is None:
+        key_pages.append(scan_cache_keys(legacy=True))
+
+    for pages in key_pages:
+        for page in pages:
+            pipeline = redis_client.pipeline(transaction=False)
+            for key, _ in page:
+                pipeline.get(key)
+                pipeline.pttl(key)
+            results = pipeline.execute()
+            now = time.time()
+            for index, (key, _) in enumerate(page):
+                value, ttl_ms = results[2 * index], results[2 * index + 1]
+                if value is None or ttl_ms == -2:
+                    continue
+                expires_at = round(now + ttl_ms / 1000, 3) if ttl_ms >= 0 else None
+                yield json.dumps({"key": key, "value": value, "expires_at": expires_at}) + "\n"
+
+
+def import_cache(lines: Iterable[str], replace: bool = False) -> dict:
+    """
+    Restores a snapshot from export_cache(), one pipeline per SCAN_BATCH_SIZE lines.
+
+    Existing entries are kept unless replace=True (SET NX: a snapshot never
+    overwrites a newer result). Only cache entry keys are accepted, and
+    entries that expired since the export are skipped.
+
+    Returns:
+        dict: {"imported", "skipped_existing", "skipped_expired", "invalid"}
+    """
+    redis_client = get_redis_client()
+    summary = {"imported": 0, "skipped_existing": 0, "skipped_expired": 0, "invalid": 0}
+
+    def write_batch(batch: List[tuple]) -> None:
+        pipeline = redis_client.pipeline(transaction=False)
+        for key, value, ttl_ms in batch:
+            pipeline.set(key, value, px=ttl_ms, nx=not replace)
+        for written in pipeline.execute():
+            summary["imported" if written else "skipped_existing"] += 1
+
+    batch = []
+    for line in lines:
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+            key, value, expires_at = entry["key"], entry["value"], entry.get("expires_at")
+        except (ValueError, KeyError, TypeError):
+            summary["invalid"] += 1
+            continue
+        if not isinstance(key, str) or not isinstance(value, str) or parse_cache_key(key) is None:
+            summary["invalid"] += 1
+            continue
+
+        ttl_ms = None
+        if expires_at is not None:
+            ttl_ms = int((expires_at - time.time()) * 1000)
+            if ttl_ms <= 0:
+                summary["skipped_expired"] += 1
+                continue
+
+        batch.append((key, value, ttl_ms))
+        if len(batch) >= SCAN_BATCH_SIZE:
+            write_batch(batch)
+            batch = []
+    if batch:
+        write_batch(batch)
+
+    logger.info("Cache import", extra={"replace": replace, **summary})
+    return summary
+
+
+def main() -> None:
+    """CLI entry point (uses REDIS_URL, like the web app)."""
+    parser = argparse.ArgumentParser(description="Inspect, invalidate and snapshot the kontext cache.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    subparsers.add_parser("stats", help="Entries, stale entries and size per model and version")
+
+    purge_parser = subparsers.add_parser("purge", help="Delete entries by model, version, age or legacy layout")
+    purge_parser.add_argument("--model", help="fal model path, e.g. fal-ai/flux-pro/kontext")
+    purge_parser.add_argument("--version", type=int, help="Only this cache version of --model")
+    purge_parser.add_argument("--legacy", action="store_true", help="Only keys written before the per-model layout")
+    purge_parser.add_argument("--older-than", type=float, help="Only entries created more than this many seconds ago")
+    purge_parser.add_argument("--all", action="store_true", help="Required to purge without any filter")
+    purge_parser.add_argument("--dry-run", action="store_true", help="Count matching entries, delete nothing")
+
+    export_parser = subparsers.add_parser("export", help="Write a JSON lines snapshot")
+    export_parser.add_argument("file", help="Output file ('-' for stdout)")
+    export_parser.add_argument("--model")
+    export_parser.add_argument("--version", type=int)
+
+    import_parser = subparsers.add_parser("import", help="Restore a JSON lines snapshot")
+    import_parser.add_argument("file", help="Input file ('-' for stdin)")
+    import_parser.add_argument("--replace", action="store_true", help="Overwrite existing entries")
+
+    args = parser.parse_args()
+    if getattr(args, "version", None) is not None and not args.model:
+        parser.error("--version requires --model")
+    if args.command == "purge" and not (args.model or args.legacy or args.older_than is not None or args.all):
+        parser.error("purge needs --model, --legacy, --older-than or --all")
+
+    from services.logging_service import configure_logging
+
+    configure_logging()
+    try:
+        cache_service.parse_cache_model_versions(cache_service.CACHE_MODEL_VERSIONS_SETTING)
+    except ValueError as e:
+        sys.exit(str(e))
+    if not cache_service.init_redis():
+        sys.exit("Redis is not reachable (check REDIS_URL)")
+
+    if args.command == "stats":
+        result = get_cache_stats()
+    elif args.command == "purge":
+        result = purge_cache(args.model, args.version, args.legacy, args.older_than, args.dry_run)
+    elif args.command == "export":
+        output_file = contextlib.nullcontext(sys.stdout) if args.file == "-" else open(args.file, "w")
+        with output_file as output_file:
+            exported = 0
+            for line in export_cache(args.model, args.version):
+                output_file.write(line)
+                exported += 1
+        result = {"exported": exported}
+    else:
+        input_file = contextlib.nullcontext(sys.stdin) if args.file == "-" else open(args.file)
+        with input_file as input_file:
+            result = import_cache(input_file, replace=args.replace)
+
+    print(json.dumps(result, indent=2), file=sys.stderr if getattr(args, "file", None) == "-" else sys.stdout)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,22 +1,121 @@
 import redis
 import json
 import hashlib
+import logging
 import os
-
-CACHE_TTL_SECONDS = 3600  # 1 hour default expiration for cached responses
+import re
+import time
+from typing import Optional
+
+from services.shared_state import get_shared_state, keep_lock_alive
+
+CACHE_TTL_SECONDS = 3600  # 1 hour: how long a cached response counts as fresh
+CACHE_STALE_WINDOW_SECONDS = int(os.getenv("CACHE_STALE_WINDOW_SECONDS", "3600"))  # Extra time stale data may be served
+NEGATIVE_CACHE_TTL_SECONDS = int(os.getenv("NEGATIVE_CACHE_TTL_SECONDS", "300"))  # 5 min for known-bad inputs
+# Lock TTLs only bound how long a crashed holder blocks others: a live holder
+# renews its lock (keep_*_lock_alive) however long fal retries and uploads take
+REFRESH_LOCK_TTL_SECONDS = 60
+GENERATION_LOCK_TTL_SECONDS = 60
 REDIS_URL = os.getenv("REDIS_URL")
+REDIS_CONNECT_TIMEOUT_SECONDS = 5  # Startup must not hang on an unreachable Redis
+
+# Key layout: kontext_cache:{model path}:v{model cache version}:{hash}
+# Bump a model's version after an upstream model update, e.g.
+# CACHE_MODEL_VERSIONS="fal-ai/flux-pro/kontext=2": its old entries are no longer
+# read and expire on their own (or purge them: python -m services.cache_admin).
+CACHE_KEY_PREFIX = "kontext_cache:"
+CACHE_MODEL_VERSIONS_SETTING = os.getenv("CACHE_MODEL_VERSIONS", "")
 
+
+def parse_cache_model_versions(setting: str) -> dict:
+    """
+    Parses "model=version,model=version" into {model path: version}.
+
+    Raises:
+        ValueError: Naming CACHE_MODEL_VERSIONS and the bad item (e.g. "model=v2")
+    """
+    model_versions = {}
+    for item in setting.split(","):
+        if not item.strip():
+            continue
+        model_path, _, version = item.partition("=")
+        if not model_path.strip() or not version.strip().isdigit() or int(version) < 1:
+            raise ValueError(
+                f"Invalid CACHE_MODEL_VERSIONS item {item.strip()!r}: expected <model path>=<version number>, "
+                f"e.g. fal-ai/flux-pro/kontext=2"
+            )
+        model_versions[model_path.strip()] = int(version)
+    return model_versions
+
+
+# Never raises at import (that would crash every worker with no hint of the
+# setting): a bad value leaves the defaults here and validate_config() fails startup with the details
 try:
-    redis_client = redis.Redis.from_url(
-        REDIS_URL, 
-        decode_responses=True  # Return strings instead of bytes
-    )
-    redis_client.ping()
-    print("Redis connection successful")
-except Exception as e:
-    print(f"Redis connection failed: {e}")
-    print("Cache will be disabled - all requests will hit fal.ai API")
-    redis_client = None
+    CACHE_MODEL_VERSIONS = parse_cache_model_versions(CACHE_MODEL_VERSIONS_SETTING)
+except ValueError:
+    CACHE_MODEL_VERSIONS = {}
+# Keys written before the model was part of the key (kontext_cache:{hash}) are
+# still read, and moved to the new layout on their first hit. Can be turned off
+# once they have expired (CACHE_TTL_SECONDS + CACHE_STALE_WINDOW_SECONDS after upgrading).
+CACHE_LEGACY_KEY_FALLBACK = os.getenv("CACHE_LEGACY_KEY_FALLBACK", "true").lower() == "true"
+CACHE_HASH_PATTERN = re.compile(r"[0-9a-f]{64}")
+RESULT_ID_PATTERN = re.compile(r"[A-Za-z0-9._~-]+:v[0-9]+:[0-9a-f]{64}")
+
+logger = logging.getLogger(__name__)
+
+# Created by init_redis() in the app lifespan (once per worker process).
+# None means "not connected": every cache function then behaves like a miss.
+redis_client = None
+
+
+def init_redis() -> bool:
+    """
+    Connects to Redis and checks the connection with a ping.
+
+    Called at startup, not at import: importing this module must not open
+    connections (worker forks would share them, and an unreachable Redis
+    would block the import).
+
+    Returns:
+        bool: True if Redis is usable, False if the cache stays disabled
+    """
+    global redis_client
+    if not REDIS_URL:
+        logger.warning("REDIS_URL not set, cache disabled - all requests will hit fal.ai API")
+        return False
+
+    try:
+        client = redis.Redis.from_url(
+            REDIS_URL,
+            decode_responses=True,  # Return strings instead of bytes
+            socket_connect_timeout=REDIS_CONNECT_TIMEOUT_SECONDS
+        )
+        client.ping()
+    except Exception as e:
+        logger.warning("Redis connection failed, cache disabled - all requests will hit fal.ai API", extra={"error": str(e)})
+        return False
+
+    redis_client = client
+    logger.info("Redis connection successful")
+    return True
+
+
+def check_redis() -> str:
+    """Readiness check: "ok", "disabled" (no client) or "error"."""
+    if redis_client is None:
+        return "disabled"
+    try:
+        redis_client.ping()
+        return "ok"
+    except Exception:
+        return "error"
+
+
+def close_redis() -> None:
+    global redis_client
+    if redis_client is not None:
+        redis_client.close()
+        redis_client = None
 
 
 def generate_unique_request_key(image_url: str, prompt: str, model_path: str) -> str:
@@ -28,12 +127,82 @@ def generate_unique_request_key(image_url: str, prompt: str, model_path: str) ->
     - /kontext vs /kontext/max should have separate cache entries
     
     Why SHA256 hashing - Same inputs always produce same key
-    Key structure: kontext_cache:<hash>
+    Key structure: kontext_cache:<model path>:v<version>:<hash>
     """
     input_signature = f"{image_url}::{prompt}::{model_path}"
     hashed_signature = hashlib.sha256(input_signature.encode()).hexdigest()
-    cache_key = f"kontext_cache:{hashed_signature}"
-    return cache_key
+    return build_cache_key(model_path, hashed_signature)
+
+
+def get_model_cache_version(model_path: str) -> int:
+    return CACHE_MODEL_VERSIONS.get(model_path, 1)
+
+
+def build_cache_key(model_path: str, hashed_signature: str) -> str:
+    """
+    Why the model and its version are in the key (not only in the hash):
+    - Entries can be counted and purged per model with SCAN MATCH
+    - Bumping a model's version invalidates all its entries without touching Redis
+    """
+    return f"{CACHE_KEY_PREFIX}{model_path}:v{get_model_cache_version(model_path)}:{hashed_signature}"
+
+
+def parse_cache_key(cache_key: str) -> Optional[dict]:
+    """
+    Splits a cache entry key into model, version and hash.
+
+    Returns:
+        dict: {"model", "version", "hash", "legacy"}; legacy keys have no model/version
+        None: For anything else under the prefix (e.g. ":refreshing" locks)
+    """
+    if not cache_key.startswith(CACHE_KEY_PREFIX):
+        return None
+    key_body = cache_key[len(CACHE_KEY_PREFIX):]
+    if CACHE_HASH_PATTERN.fullmatch(key_body):
+        return {"model": None, "version": None, "hash": key_body, "legacy": True}
+
+    key_parts = key_body.rsplit(":", 2)
+    if len(key_parts) != 3 or not re.fullmatch(r"v[0-9]+", key_parts[1]) or not CACHE_HASH_PATTERN.fullmatch(key_parts[2]):
+        return None
+    return {"model": key_parts[0], "version": int(key_parts[1][1:]), "hash": key_parts[2], "legacy": False}
+
+
+def get_legacy_cache_key(cache_key: str) -> Optional[str]:
+    """
+    Where the same entry lived before the model was part of the key (same hash).
+    Legacy entries count as version 1: after a version bump they are not read.
+    """
+    parsed_key = parse_cache_key(cache_key)
+    if parsed_key is None or parsed_key["legacy"] or parsed_key["version"] != 1:
+        return None
+    return f"{CACHE_KEY_PREFIX}{parsed_key['hash']}"
+
+
+def get_result_id(cache_key: str) -> str:
+    """
+    Public id of a cached result (GET /results/{id}): the key without its
+    prefix, with "/" in the model path replaced by "~" to keep it one URL segment.
+    """
+    return cache_key[len(CACHE_KEY_PREFIX):].replace("/", "~")
+
+
+def get_cache_key_for_result_id(result_id: str):
+    """Inverse of get_result_id; None for ids that cannot be a cache key (see get_legacy_result_cache_keys)."""
+    if not RESULT_ID_PATTERN.fullmatch(result_id):
+        return None
+    return f"{CACHE_KEY_PREFIX}{result_id.replace('~', '/')}"
+
+
+def get_legacy_result_cache_keys(result_id: str, model_paths) -> list:
+    """
+    Keys that may hold a result handed out as a bare hash (ids issued before
+    the model was part of the key): the legacy key, then the key it is moved
+    to on its first read, for each model (the hash belongs to exactly one).
+    Empty for anything that is not a bare hash.
+    """
+    if not CACHE_HASH_PATTERN.fullmatch(result_id):
+        return []
+    return [f"{CACHE_KEY_PREFIX}{result_id}"] + [build_cache_key(model_path, result_id) for model_path in model_paths]
 
 
 def retrieve_cached_response(image_url: str, prompt: str, model_path: str):
@@ -41,30 +210,17 @@ def retrieve_cached_response(image_url: str, prompt: str, model_path: str):
     Attempts to retrieve cached API response from Redis for a specific model.
     
     Returns:
-        dict: Cached response if found
+        dict: Cached response if found (fresh or stale)
         None: If cache miss or Redis unavailable
     
     Graceful degradation:
     - If Redis is down, returns None (app continues working)
     - Cache failures don't crash the application
     """
-    if redis_client is None:
+    cache_entry = get_cache_entry(generate_unique_request_key(image_url, prompt, model_path))
+    if cache_entry is None:
         return None
-        
-    try:
-        cache_key = generate_unique_request_key(image_url, prompt, model_path)
-        cached_json_string = redis_client.get(cache_key)
-        
-        if cached_json_string:
-            print(f"Cache HIT: {cache_key}")
-            return json.loads(cached_json_string)
-        else:
-            print(f"Cache MISS: {cache_key}")
-            
-    except Exception as read_error:
-        print(f"Cache read error: {read_error}")
-    
-    return None
+    return cache_entry[0]
 
 
 def store_response_in_cache(
@@ -84,20 +240,275 @@ def store_response_in_cache(
     
     Args:
         model_path: Which fal.ai model was used (for cache separation)
-        expiration_seconds: How long to keep in cache (default: 1 hour)
+        expiration_seconds: How long the entry counts as fresh (default: 1 hour)
+    """
+    set_cache_entry(generate_unique_request_key(image_url, prompt, model_path), response_data, expiration_seconds)
+
+
+# ============================================================================
+# Key-level functions (soft/hard TTL with stale-while-revalidate)
+# ============================================================================
+
+def get_cache_entry(cache_key: str):
+    """
+    Reads a cache entry and tells the caller whether it is stale.
+
+    Soft vs hard TTL:
+    - Soft TTL (CACHE_TTL_SECONDS): the entry is fresh and served as-is
+    - Hard TTL (soft + CACHE_STALE_WINDOW_SECONDS): Redis deletes the entry
+    - In between the entry is stale: it is still served instantly, and the
+      caller should refresh it in the background (stale-while-revalidate)
+
+    Returns:
+        tuple: (response_data, is_stale) if found
+        None: If cache miss or Redis unavailable
+    """
+    if redis_client is None:
+        return None
+
+    try:
+        cached_json_string = read_cache_value(cache_key)
+
+        if not cached_json_string:
+            logger.info("Cache MISS", extra={"cache_key": cache_key})
+            return None
+
+        cached_value = json.loads(cached_json_string)
+
+        # Entries written before soft TTLs existed are plain responses: treat as fresh
+        if not (isinstance(cached_value, dict) and "fresh_until" in cached_value and "response" in cached_value):
+            logger.info("Cache HIT", extra={"cache_key": cache_key})
+            return cached_value, False
+
+        is_stale = time.time() > cached_value["fresh_until"]
+        logger.info("Cache STALE" if is_stale else "Cache HIT", extra={"cache_key": cache_key})
+        return cached_value["response"], is_stale
+
+    except Exception as read_error:
+        logger.warning("Cache read error", extra={"error": str(read_error)})
+
+    return None
+
+
+def read_cache_value(cache_key: str) -> Optional[str]:
+    """
+    Raw cached JSON for a key, falling back to its legacy key.
+
+    The legacy key is only read on a miss (hits stay one GET; a miss is
+    followed by a generation anyway). A legacy hit is moved to the new key:
+    RENAMENX keeps its TTL and never overwrites a newer entry.
+    """
+    cached_json_string = redis_client.get(cache_key)
+    legacy_key = get_legacy_cache_key(cache_key) if CACHE_LEGACY_KEY_FALLBACK else None
+    if cached_json_string or legacy_key is None:
+        return cached_json_string
+
+    legacy_json_string = redis_client.get(legacy_key)
+    if not legacy_json_string:
+        return None
+
+    try:
+        redis_client.renamenx(legacy_key, cache_key)
+        logger.info("Cache key migrated", extra={"cache_key": cache_key, "legacy_key": legacy_key})
+    except redis.exceptions.ResponseError:
+        pass  # Expired or migrated by another request in between
+    return legacy_json_string
+
+
+def set_cache_entry(cache_key: str, response_data: dict, expiration_seconds: int = CACHE_TTL_SECONDS):
+    """
+    Writes a cache entry that is fresh for expiration_seconds and kept for
+    another CACHE_STALE_WINDOW_SECONDS so it can be served while it refreshes.
     """
     if redis_client is None:
         return
 
+    try:
+        now = time.time()
+        json_string = json.dumps({
+            "response": response_data,
+            "created_at": now,  # Lets the admin CLI purge entries by age
+            "fresh_until": now + expiration_seconds
+        })
+
+        redis_client.setex(cache_key, expiration_seconds + CACHE_STALE_WINDOW_SECONDS, json_string)
+        logger.info("Cache SAVE", extra={
+            "cache_key": cache_key, "ttl_seconds": expiration_seconds, "stale_window_seconds": CACHE_STALE_WINDOW_SECONDS
+        })
+
+    except Exception as e:
+        logger.warning("Cache write error", extra={"error": str(e)})
+
+
+def acquire_refresh_lock(cache_key: str) -> Optional[str]:
+    """
+    Makes sure only one background refresh runs per cache key.
+
+    Uses the shared-state lock (Redis SET NX when connected) so that concurrent
+    stale hits, even on other workers or servers, trigger a single fal.ai
+    generation instead of one per request.
+
+    Returns:
+        str: Lock token if the caller should run the refresh (pass it to release/keep-alive)
+        None: Another refresh is already running
+    """
+    return get_shared_state().acquire_lock(f"{cache_key}:refreshing", REFRESH_LOCK_TTL_SECONDS)
+
+
+def release_refresh_lock(cache_key: str, token: str) -> None:
+    """Releases the lock taken by acquire_refresh_lock (no-op if it was lost meanwhile)."""
+    get_shared_state().release_lock(f"{cache_key}:refreshing", token)
+
+
+async def keep_refresh_lock_alive(cache_key: str, token: str) -> None:
+    await keep_lock_alive(f"{cache_key}:refreshing", token, REFRESH_LOCK_TTL_SECONDS)
+
+
+def acquire_generation_lock(cache_key: str) -> Optional[str]:
+    """
+    Single-flight for cache misses: the first request for a key generates,
+    identical concurrent requests wait for its result (see is_generation_in_flight).
+
+    Returns:
+        str: Lock token for the generating request
+        None: Another request is generating this key
+    """
+    return get_shared_state().acquire_lock(f"{cache_key}:generating", GENERATION_LOCK_TTL_SECONDS)
+
+
+def release_generation_lock(cache_key: str, token: str) -> None:
+    get_shared_state().release_lock(f"{cache_key}:generating", token)
+
+
+async def keep_generation_lock_alive(cache_key: str, token: str) -> None:
+    await keep_lock_alive(f"{cache_key}:generating", token, GENERATION_LOCK_TTL_SECONDS)
+
+
+def is_generation_in_flight(cache_key: str) -> bool:
+    return get_shared_state().is_locked(f"{cache_key}:generating")
+
+
+def is_cache_available() -> bool:
+    """True when responses can actually be cached (Redis connected)."""
+    return redis_client is not None
+
+
+def get_cached_response_ttl(image_url: str, prompt: str, model_path: str):
+    """
+    Returns how many seconds a cached response has left before it goes stale.
+
+    Used by the cache warmer to refresh popular entries before users would
+    have to trigger a background refresh themselves.
+
+    Returns:
+        int: Remaining fresh time in seconds (-1 if the entry never expires)
+        None: If the entry does not exist or Redis is unavailable
+    """
+    if redis_client is None:
+        return None
+
     try:
         cache_key = generate_unique_request_key(image_url, prompt, model_path)
-        json_string = json.dumps(response_data)
+        cached_json_string = read_cache_value(cache_key)
+        if not cached_json_string:
+            return None
+
+        cached_value = json.loads(cached_json_string)
+        if isinstance(cached_value, dict) and "fresh_until" in cached_value:
+            return max(0, int(cached_value["fresh_until"] - time.time()))
+
+        # Entries written before soft TTLs existed: fall back to the Redis TTL
+        remaining_seconds = redis_client.ttl(cache_key)
+        if remaining_seconds is None or remaining_seconds == -2:
+            return None
+        return remaining_seconds
+
+    except Exception as e:
+        logger.warning("Cache TTL read error", extra={"error": str(e)})
+
+    return None
+
+
+# ============================================================================
+# Negative caching (known-bad inputs)
+# ============================================================================
+
+def generate_negative_cache_key(image_url: str) -> str:
+    """
+    Creates the negative cache key for an input URL.
+
+    Only the URL is hashed: a URL that 404s or is not an image fails the
+    same way for every prompt and model.
+    Key structure: kontext_negative:<hash>
+    """
+    hashed_url = hashlib.sha256(image_url.encode()).hexdigest()
+    return f"kontext_negative:{hashed_url}"
+
 
-        redis_client.setex(cache_key, expiration_seconds, json_string)
-        print(f"Cache SAVE: {cache_key} (TTL: {expiration_seconds}s)")
+def retrieve_negative_result(image_url: str):
+    """
+    Checks whether an input URL recently failed validation.
 
+    Returns:
+        str: The original validation error message if the URL is known-bad
+        None: If not known-bad or Redis unavailable
+    """
+    if redis_client is None:
+        return None
+
+    try:
+        error_message = redis_client.get(generate_negative_cache_key(image_url))
+        if error_message:
+            logger.info("Negative cache HIT", extra={"image_url": image_url})
+            return error_message
+    except Exception as read_error:
+        logger.warning("Negative cache read error", extra={"error": str(read_error)})
+
+    return None
+
+
+def store_negative_result(image_url: str, error_message: str, expiration_seconds: int = NEGATIVE_CACHE_TTL_SECONDS):
+    """
+    Remembers that an input URL failed validation (404, too large, not an image).
+
+    Why a short TTL:
+    - Repeated bad requests are rejected without downloading again
+    - The origin might fix the file, so we only remember it for a few minutes
+
+    Only deterministic failures (ValueError) should be stored here.
+    Timeouts and 5xx errors may succeed on the next attempt.
+    """
+    if redis_client is None:
+        return
+
+    try:
+        redis_client.setex(generate_negative_cache_key(image_url), expiration_seconds, error_message)
+        logger.info("Negative cache SAVE", extra={"image_url": image_url, "ttl_seconds": expiration_seconds})
     except Exception as e:
-        print(f"Cache write error: {e}")
+        logger.warning("Negative cache write error", extra={"error": str(e)})
+
+
+# ============================================================================
+# Deferred derivative markers
+# ============================================================================
+
+DERIVATIVE_MARKER_TTL_SECONDS = 30 * 24 * 3600  # Derivatives are stored forever, markers for 30 days
+
+
+def retrieve_derivative_url(filename: str):
+    """
+    Returns the public URL of a derivative created on first access, if any.
+
+    Returns:
+        str: Public URL if the derivative was already generated
+        None: If not generated yet
+    """
+    return get_shared_state().get(f"kontext_derivative:{filename}")
+
+
+def store_derivative_url(filename: str, public_url: str) -> None:
+    """Remembers (for every worker) that a deferred derivative now exists in storage."""
+    get_shared_state().set(f"kontext_derivative:{filename}", public_url, DERIVATIVE_MARKER_TTL_SECONDS)
 
 
 # ============================================================================
@@ -117,20 +528,35 @@ def generate_unique_request_key_for_upload(image_data: str, prompt: str, model_p
         model_path: Which fal.ai model to use
 
     Returns:
-        str: Cache key in format kontext_cache:<hash>
+        str: Cache key in format kontext_cache:<model path>:v<version>:<hash>
     """
     import base64
 
     # Decode base64 to get actual image bytes for hashing
     # This ensures different encodings of same image produce same hash
     image_bytes = base64.b64decode(image_data)
-    image_hash = hashlib.sha256(image_bytes).hexdigest()
+    return generate_unique_request_key_for_image_hash(hash_image_bytes(image_bytes), prompt, model_path)
+
+
+def hash_image_bytes(image_bytes: bytes) -> str:
+    """
+    SHA-256 of the decoded image bytes.
+
+    hashlib releases the GIL for large buffers, so async callers can run this
+    in the thread pool (executor_service.run_in_thread) for big uploads.
+    """
+    return hashlib.sha256(image_bytes).hexdigest()
 
+
+def generate_unique_request_key_for_image_hash(image_hash: str, prompt: str, model_path: str) -> str:
+    """
+    Same key as generate_unique_request_key_for_upload, for callers that have
+    already decoded and hashed the upload (so it is not decoded twice).
+    """
     # Create signature using hash instead of raw data
     input_signature = f"{image_hash}::{prompt}::{model_path}"
     hashed_signature = hashlib.sha256(input_signature.encode()).hexdigest()
-    cache_key = f"kontext_cache:{hashed_signature}"
-    return cache_key
+    return build_cache_key(model_path, hashed_signature)
 
 
 def retrieve_cached_response_for_upload(image_data: str, prompt: str, model_path: str):
@@ -145,7 +571,7 @@ def retrieve_cached_response_for_upload(image_data: str, prompt: str, model_path
         model_path: Which fal.ai model was used
 
     Returns:
-        dict: Cached response if found
+        dict: Cached response if found (fresh or stale)
         None: If cache miss or Redis unavailable
     """
     if redis_client is None:
@@ -153,18 +579,14 @@ def retrieve_cached_response_for_upload(image_data: str, prompt: str, model_path
 
     try:
         cache_key = generate_unique_request_key_for_upload(image_data, prompt, model_path)
-        cached_json_string = redis_client.get(cache_key)
-
-        if cached_json_string:
-            print(f"Cache HIT (upload): {cache_key}")
-            return json.loads(cached_json_string)
-        else:
-            print(f"Cache MISS (upload): {cache_key}")
-
-    except Exception as read_error:
-        print(f"Cache read error (upload): {read_error}")
+    except Exception as key_error:
+        logger.warning("Cache read error (upload)", extra={"error": str(key_error)})
+        return None
 
-    return None
+    cache_entry = get_cache_entry(cache_key)
+    if cache_entry is None:
+        return None
+    return cache_entry[0]
 
 
 def store_response_in_cache_for_upload(
@@ -184,17 +606,15 @@ def store_response_in_cache_for_upload(
         prompt: User's prompt
         model_path: Which fal.ai model was used
         response_data: API response to cache
-        expiration_seconds: TTL (default: 1 hour)
+        expiration_seconds: How long the entry counts as fresh (default: 1 hour)
     """
     if redis_client is None:
         return
 
     try:
         cache_key = generate_unique_request_key_for_upload(image_data, prompt, model_path)
-        json_string = json.dumps(response_data)
-
-        redis_client.setex(cache_key, expiration_seconds, json_string)
-        print(f"Cache SAVE (upload): {cache_key} (TTL: {expiration_seconds}s)")
+    except Exception as key_error:
+        logger.warning("Cache write error (upload)", extra={"error": str(key_error)})
+        return
 
-    except Exception as e:
-        print(f"Cache write error (upload): {e}")
\ No newline at end of file
+    set_cache_entry(cache_key, response_data, expiration_seconds)
@@ -0,0 +1,206 @@
+"""
+Cache warmer: refreshes popular cache entries before they expire.
+
+Without this, the first user after every CACHE_TTL_SECONDS expiry pays the full
+generation latency for a template image/prompt that everyone else requests too.
+
+How it works:
+1. Read the most frequent (endpoint, image URL, prompt, params) combinations
+   from the `requests` table
+2. Skip entries that still have plenty of TTL left
+3. Regenerate the rest with the same params (num_images, aspect_ratio, seed, ...)
+   and overwrite the cache entry
+
+The cache key ignores the params, so an entry is replayed only once per pass,
+with its most popular params.
+
+Stale-while-revalidate: the old entry keeps being served while the warmer
+regenerates it, and is only replaced once the new result is ready. Users never
+wait on a refresh.
+
+One pass at a time: every worker process of every replica runs the
+lifespan task, so a pass first takes a shared-state lock (CACHE_WARMER_LOCK_KEY).
+Without it the budget would be spent once per process, on the same entries.
+
+Run it:
+- As a lifespan task: set CACHE_WARMER_INTERVAL_SECONDS > 0
+- As a one-off job:  python -m services.cache_warmer --budget 2.0
+"""
+import argparse
+import asyncio
+import logging
+import os
+from typing import Awaitable, Callable
+
+from services import cache_service
+from services.cache_service import get_cached_response_ttl, store_response_in_cache
+from services.fal_service import MODEL_COST_USD, DEFAULT_MODEL_COST_USD
+from services.history_service import get_popular_requests
+from services.shared_state import get_shared_state, keep_lock_alive
+
+logger = logging.getLogger(__name__)
+
+CACHE_WARMER_INTERVAL_SECONDS = int(os.getenv("CACHE_WARMER_INTERVAL_SECONDS", "0"))  # 0 = disabled
+CACHE_WARMER_BUDGET_USD = float(os.getenv("CACHE_WARMER_BUDGET_USD", "1.0"))  # Max fal spend per run
+CACHE_WARMER_TOP_N = int(os.getenv("CACHE_WARMER_TOP_N", "20"))
+CACHE_WARMER_LOOKBACK_HOURS = int(os.getenv("CACHE_WARMER_LOOKBACK_HOURS", "24"))
+CACHE_WARMER_REFRESH_WINDOW_SECONDS = int(os.getenv("CACHE_WARMER_REFRESH_WINDOW_SECONDS", "600"))
+DEFAULT_IMAGES_PER_REQUEST = 1  # fal.ai's num_images default
+CACHE_WARMER_LOCK_KEY = "cache_warmer:pass"
+CACHE_WARMER_LOCK_TTL_SECONDS = 60  # Renewed while the pass runs
+
+# generate(image_url, prompt, model_path, params) -> response_data
+GenerateFunction = Callable[[str, str, str, dict], Awaitable[dict]]
+
+
+async def warm_cache(
+    generate: GenerateFunction,
+    model_paths: dict,
+    budget_usd: float = CACHE_WARMER_BUDGET_USD,
+    top_n: int = CACHE_WARMER_TOP_N,
+    lookback_hours: int = CACHE_WARMER_LOOKBACK_HOURS,
+    refresh_window_seconds: int = CACHE_WARMER_REFRESH_WINDOW_SECONDS
+) -> dict:
+    """
+    Runs one warming pass over the most popular requests.
+
+    Why a budget cap:
+    - Every refresh is a paid fal.ai generation
+    - A bug or a burst of unique traffic must not turn into an unbounded bill
+    - The pass stops as soon as the next refresh would exceed the budget
+
+    Args:
+        generate: Coroutine that regenerates one entry (the real pipeline, or a fake in tests)
+        model_paths: Route path -> fal model path (history stores route paths)
+        budget_usd: Maximum estimated fal spend for this pass
+        top_n: How many popular combinations to consider
+        lookback_hours: How far back to count requests
+        refresh_window_seconds: Refresh entries with less than this much TTL left
+
+    Returns:
+        dict: Summary with refreshed/skipped/failed counts and estimated spend
+    """
+    summary = {
+        "refreshed": 0, "skipped_fresh": 0, "failed": 0, "spent_usd": 0.0,
+        "budget_exhausted": False, "already_running": False
+    }
+
+    if cache_service.redis_client is None:
+        # Nothing to warm if there is no cache
+        return summary
+
+    pass_lock_token = get_shared_state().acquire_lock(CACHE_WARMER_LOCK_KEY, CACHE_WARMER_LOCK_TTL_SECONDS)
+    if not pass_lock_token:
+        # Another worker or replica is running this pass (and spending the budget)
+        summary["already_running"] = True
+        return summary
+
+    pass_lock_renewal = asyncio.create_task(
+        keep_lock_alive(CACHE_WARMER_LOCK_KEY, pass_lock_token, CACHE_WARMER_LOCK_TTL_SECONDS)
+    )
+    try:
+        candidates = await asyncio.to_thread(get_popular_requests, top_n, lookback_hours)
+        replayed_entries = set()
+
+        for candidate in candidates:
+            model_path = model_paths.get(candidate["endpoint"])
+            if model_path is None:
+                continue
+
+            image_url = candidate["input_image_url"]
+            prompt = candidate["prompt"]
+            params = candidate["params"]
+
+            # Same cache entry with less popular params: replaying them would overwrite the first replay
+            if (model_path, image_url, prompt) in replayed_entries:
+                continue
+            replayed_entries.add((model_path, image_url, prompt))
+
+            # Negative TTL means the entry never expires, so it never needs warming
+            remaining_ttl = get_cached_response_ttl(image_url, prompt, model_path)
+            if remaining_ttl is not None and (remaining_ttl < 0 or remaining_ttl > refresh_window_seconds):
+                summary["skipped_fresh"] += 1
+                continue
+
+            # fal.ai bills per image: the check before and the charge after use the replayed num_images
+            image_count = params.get("num_images") or DEFAULT_IMAGES_PER_REQUEST
+            image_cost = MODEL_COST_USD.get(model_path, DEFAULT_MODEL_COST_USD)
+            estimated_cost = image_cost * image_count
+            if summary["spent_usd"] + estimated_cost > budget_usd:
+                summary["budget_exhausted"] = True
+                break
+
+            try:
+                response_data = await generate(image_url, prompt, model_path, params)
+            except Exception as e:
+                # fal.ai may have billed us even if re-hosting failed, so count the cost
+                summary["spent_usd"] += estimated_cost
+                summary["failed"] += 1
+                logger.warning("Cache warmer refresh failed", extra={"image_url": image_url, "error": str(e)})
+                continue
+
+            # More images than requested would be a generate() bug, but is still counted
+            summary["spent_usd"] += image_cost * max(image_count, len(response_data.get("images", [])))
+            store_response_in_cache(image_url, prompt, model_path, response_data)
+            summary["refreshed"] += 1
+    finally:
+        pass_lock_renewal.cancel()
+        get_shared_state().release_lock(CACHE_WARMER_LOCK_KEY, pass_lock_token)
+
+    logger.info("Cache warmer pass", extra=summary)
+    return summary
+
+
+async def run_cache_warmer_forever(
+    generate: GenerateFunction,
+    model_paths: dict,
+    interval_seconds: int = CACHE_WARMER_INTERVAL_SECONDS
+) -> None:
+    """
+    Runs warm_cache every interval_seconds until cancelled (used as a lifespan task).
+
+    The refresh window should be larger than the interval, otherwise entries
+    can expire between two passes.
+    """
+    while True:
+        try:
+            await warm_cache(generate, model_paths)
+        except Exception as e:
+            # Never let one bad pass kill the background task
+            logger.exception("Cache warmer error", extra={"error": str(e)})
+        await asyncio.sleep(interval_seconds)
+
+
+def main() -> None:
+    """CLI entry point: run a single warming pass and print the summary."""
+    parser = argparse.ArgumentParser(description="Refresh popular kontext cache entries before they expire.")
+    parser.add_argument("--budget", type=float, default=CACHE_WARMER_BUDGET_USD, help="Max estimated fal spend (USD)")
+    parser.add_argument("--top", type=int, default=CACHE_WARMER_TOP_N, help="Number of popular requests to consider")
+    parser.add_argument("--lookback-hours", type=int, default=CACHE_WARMER_LOOKBACK_HOURS)
+    parser.add_argument("--refresh-window", type=int, default=CACHE_WARMER_REFRESH_WINDOW_SECONDS,
+                        help="Refresh entries with less than this many seconds of TTL left")
+    args = parser.parse_args()
+
+    # Imported here so the module stays importable without the web app's env vars
+    from main import generate_for_cache_warmer, validate_config, warm_up_services, ENDPOINT_MODEL_PATHS
+    from services.logging_service import configure_logging
+
+    configure_logging()
+
+    async def run_once() -> None:
+        # Same per-process startup as the web app (Redis, database, storage)
+        validate_config()
+        await warm_up_services()
+        await warm_cache(
+            generate_for_cache_warmer,
+            ENDPOINT_MODEL_PATHS,
+            budget_usd=args.budget,
+            top_n=args.top,
+            lookback_hours=args.lookback_hours,
+            refresh_window_seconds=args.refresh_window
+        )
+
+    asyncio.run(run_once())
+
+if __name__ == "__main__":
+    main()
@@ -1,24 +1,109 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, inspect, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+import logging
 import os
 
+logger = logging.getLogger(__name__)
+
 # Read DATABASE_URL from environment
 DATABASE_URL = os.getenv("DATABASE_URL")
+DATABASE_CONNECT_TIMEOUT_SECONDS = 5  # An unreachable database must not block startup
 
-# Create database engine
-engine = create_engine(DATABASE_URL)
+# Engine is created on first use (init_database at startup, or the first session)
+# so importing this module never connects, and each worker process gets its own pool.
+_engine = None
 
-# Create session factory
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Session factory, bound to the engine when it is created
+SessionLocal = sessionmaker(autocommit=False, autoflush=False)
 
 # Base class for models
 Base = declarative_base()
 
+
+def get_engine():
+    """Creates the engine on first call (no connection is opened until it is used)."""
+    global _engine
+    if _engine is None:
+        if not DATABASE_URL:
+            raise RuntimeError("DATABASE_URL is not set")
+        connect_args = {}
+        if DATABASE_URL.startswith("postgres"):
+            connect_args["connect_timeout"] = DATABASE_CONNECT_TIMEOUT_SECONDS
+        _engine = create_engine(DATABASE_URL, pool_pre_ping=True, connect_args=connect_args)
+        SessionLocal.configure(bind=_engine)
+    return _engine
+
+
+def get_session():
+    """New session bound to the (lazily created) engine."""
+    get_engine()
+    return SessionLocal()
+
+
+def init_database() -> bool:
+    """
+    Creates missing tables (called at startup, in a thread).
+
+    Failures are logged, not raised: request history is optional, so an
+    unreachable database degrades /health/ready instead of blocking boot.
+    """
+    try:
+        # Imported here so every model is registered on Base before create_all
+        from services import models  # noqa: F401
+        Base.metadata.create_all(bind=get_engine())
+        add_missing_columns()
+        return True
+    except Exception as e:
+        logger.warning("Database initialization failed, request history disabled", extra={"error": str(e)})
+        return False
+
+
+def add_missing_columns() -> None:
+    """
+    Adds nullable columns that models gained after their table was created.
+
+    create_all only creates missing tables, so without this an existing
+    `requests` table would reject every insert that sets a new column.
+    """
+    engine = get_engine()
+    existing_tables = set(inspect(engine).get_table_names())
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column["name"] for column in inspect(connection).get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=engine.dialect)
+                connection.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+                logger.info("Added database column", extra={"table": table.name, "column": column.name})
+
+
+def check_database() -> str:
+    """Readiness check: "ok", "disabled" (no DATABASE_URL) or "error"."""
+    if not DATABASE_URL:
+        return "disabled"
+    try:
+        with get_engine().connect() as connection:
+            connection.execute(text("SELECT 1"))
+        return "ok"
+    except Exception:
+        return "error"
+
+
+def dispose_database() -> None:
+    global _engine
+    if _engine is not None:
+        _engine.dispose()
+        _engine = None
+
+
 # Dependency to get database session
 def get_db():
-    db = SessionLocal()
+    db = get_session()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
@@ -0,0 +1,199 @@
+"""
+Event-loop diagnostics: lag sampler, stall watchdog and sampling profiler.
+
+Why: blocking calls (sync Redis, sync Supabase uploads, database writes) do
+not show up as errors - they only make every other request slower. These
+tools show how late the event loop is and which code is blocking it.
+
+Everything is off by default and costs nothing until enabled:
+- LOOP_MONITOR_ENABLED=true      lag sampler + stall watchdog (one task, one thread)
+- DEBUG_PROFILER_ENABLED=true    /debug/profile?seconds=N sampling profiler
+"""
+import asyncio
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+LOOP_MONITOR_ENABLED = os.getenv("LOOP_MONITOR_ENABLED", "false").lower() == "true"
+LOOP_MONITOR_INTERVAL_SECONDS = float(os.getenv("LOOP_MONITOR_INTERVAL_SECONDS", "0.05"))
+SLOW_CALLBACK_THRESHOLD_MS = float(os.getenv("SLOW_CALLBACK_THRESHOLD_MS", "100"))
+DEBUG_PROFILER_ENABLED = os.getenv("DEBUG_PROFILER_ENABLED", "false").lower() == "true"
+DEBUG_PROFILE_MAX_SECONDS = 60
+PROFILER_SAMPLE_INTERVAL_SECONDS = 0.005  # ~200 samples per second
+LAG_SAMPLE_WINDOW = 1200  # Keep the last minute of samples at the default interval
+
+
+class LoopMonitor:
+    """
+    Measures event-loop lag and captures the stack of whatever blocks it.
+
+    Lag sampler (async task):
+    - Sleeps for a short interval and measures how late it wakes up
+    - A late wake-up means some callback held the loop for that long
+
+    Stall watchdog (background thread):
+    - Watches the sampler's heartbeat from outside the loop
+    - If the heartbeat is older than the threshold, the loop is blocked right
+      now, so the loop thread's current stack IS the blocking code
+    - That stack is logged once per stall (sys._current_frames, no asyncio debug mode needed)
+    """
+
+    def __init__(self, interval_seconds: float = LOOP_MONITOR_INTERVAL_SECONDS,
+                 threshold_ms: float = SLOW_CALLBACK_THRESHOLD_MS):
+        self.interval_seconds = interval_seconds
+        self.threshold_seconds = threshold_ms / 1000
+        self.lag_samples = collections.deque(maxlen=LAG_SAMPLE_WINDOW)
+        self.slow_callbacks = collections.deque(maxlen=20)
+        self.last_heartbeat = time.monotonic()
+        self.loop_thread_id: Optional[int] = None
+        self._sampler_task: Optional[asyncio.Task] = None
+        self._watchdog_thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        self.loop_thread_id = threading.get_ident()
+        self.last_heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._sampler_task = asyncio.create_task(self._sample_lag())
+        self._watchdog_thread = threading.Thread(target=self._watch_for_stalls, name="loop-watchdog", daemon=True)
+        self._watchdog_thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._sampler_task:
+            self._sampler_task.cancel()
+
+    async def _sample_lag(self) -> None:
+        while True:
+            sleep_started_at = time.monotonic()
+            await asyncio.sleep(self.interval_seconds)
+            self.last_heartbeat = time.monotonic()
+            self.lag_samples.append(self.last_heartbeat - sleep_started_at - self.interval_seconds)
+
+    def _watch_for_stalls(self) -> None:
+        reported_heartbeat = None
+        while not self._stopped.wait(self.threshold_seconds / 2):
+            heartbeat = self.last_heartbeat
+            stalled_for = time.monotonic() - heartbeat - self.interval_seconds
+            if stalled_for < self.threshold_seconds or heartbeat == reported_heartbeat:
+                continue
+
+            # Only report each stall once, with the stack that is blocking right now
+            reported_heartbeat = heartbeat
+            loop_frame = sys._current_frames().get(self.loop_thread_id)
+            stack = "".join(traceback.format_stack(loop_frame)) if loop_frame else "<no frame>"
+            self.slow_callbacks.append({
+                "blocked_ms": round(stalled_for * 1000),
+                "detected_at": time.time(),
+                "stack": stack
+            })
+            logger.warning("Event loop blocked", extra={"blocked_ms": round(stalled_for * 1000), "stack": stack})
+
+    def get_stats(self) -> dict:
+        """Lag percentiles (ms) over the recent window plus the latest stalls."""
+        samples_ms = sorted(sample * 1000 for sample in self.lag_samples)
+        if not samples_ms:
+            return {"samples": 0}
+        return {
+            "samples": len(samples_ms),
+            "lag_p50_ms": round(samples_ms[len(samples_ms) // 2], 2),
+            "lag_p99_ms": round(samples_ms[min(len(samples_ms) - 1, int(len(samples_ms) * 0.99))], 2),
+            "lag_max_ms": round(samples_ms[-1], 2),
+            "slow_callbacks": list(self.slow_callbacks)
+        }
+
+
+loop_monitor: Optional[LoopMonitor] = None
+
+
+def start_loop_monitor() -> None:
+    """Starts the lag sampler and watchdog if LOOP_MONITOR_ENABLED (call from the lifespan)."""
+    global loop_monitor
+    if not LOOP_MONITOR_ENABLED or loop_monitor is not None:
+        return
+    loop_monitor = LoopMonitor()
+    loop_monitor.start()
+
+
+def stop_loop_monitor() -> None:
+    global loop_monitor
+    if loop_monitor is not None:
+        loop_monitor.stop()
+        loop_monitor = None
+
+
+def get_loop_stats() -> Optional[dict]:
+    """Returns lag stats, or None when the monitor is disabled."""
+    return loop_monitor.get_stats() if loop_monitor else None
+
+
+# ============================================================================
+# Sampling profiler
+# ============================================================================
+
+_profiler_lock = threading.Lock()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+def sample_stacks(seconds: float, interval_seconds: float = PROFILER_SAMPLE_INTERVAL_SECONDS) -> collections.Counter:
+    """
+    Samples every thread's stack for `seconds` and counts identical stacks.
+
+    Runs in its own thread. Sampling from outside means the profiled code is
+    never instrumented; the cost is one sys._current_frames() per sample.
+    """
+    profiler_thread_id = threading.get_ident()
+    thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+    stack_counts = collections.Counter()
+
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == profiler_thread_id:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            labels.append(thread_names.get(thread_id, f"thread-{thread_id}"))
+            # Root first, as flamegraph tools expect
+            stack_counts[";".join(reversed(labels))] += 1
+        time.sleep(interval_seconds)
+
+    return stack_counts
+
+
+def format_collapsed_stacks(stack_counts: collections.Counter) -> str:
+    """
+    Formats stacks as "root;caller;callee count" lines (collapsed format).
+    Works with flamegraph.pl, speedscope.app and inferno.
+    """
+    return "\n".join(f"{stack} {count}" for stack, count in stack_counts.most_common()) + "\n"
+
+
+async def profile(seconds: float) -> str:
+    """
+    Profiles the whole process for `seconds` without blocking the event loop.
+
+    Raises:
+        RuntimeError: If another profile is already running
+    """
+    if not _profiler_lock.acquire(blocking=False):
+        raise RuntimeError("A profile is already running")
+    try:
+        seconds = max(0.1, min(seconds, DEBUG_PROFILE_MAX_SECONDS))
+        stack_counts = await asyncio.to_thread(sample_stacks, seconds)
+    finally:
+        _profiler_lock.release()
+    return format_collapsed_stacks(stack_counts)
@@ -0,0 +1,122 @@
+"""
+Shared executors for CPU-bound work, so it never runs on the event loop.
+
+Two pools, picked by what the work does with the GIL:
+- Thread pool: hashlib (SHA-256) releases the GIL for large buffers, so a
+  thread is enough and there is no copying between processes
+- Process pool: base64 decoding and Pillow transforms hold the GIL, so they
+  need a separate process to keep the event loop responsive
+
+Small payloads stay inline: handing 10KB to a pool costs more than hashing
+or decoding it directly.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Callable, Optional
+
+EXECUTOR_THREAD_WORKERS = int(os.getenv("EXECUTOR_THREAD_WORKERS", "4"))
+EXECUTOR_PROCESS_WORKERS = int(os.getenv("EXECUTOR_PROCESS_WORKERS", "2"))
+# Below these sizes the work runs inline on the event loop (it is faster than the hand-off)
+EXECUTOR_THREAD_THRESHOLD_BYTES = int(os.getenv("EXECUTOR_THREAD_THRESHOLD_BYTES", str(256 * 1024)))
+EXECUTOR_PROCESS_THRESHOLD_BYTES = int(os.getenv("EXECUTOR_PROCESS_THRESHOLD_BYTES", str(1024 * 1024)))
+
+_thread_pool: Optional[ThreadPoolExecutor] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+# Queue-depth metrics per pool (read by /metrics)
+_executor_stats = {
+    "thread": {"workers": EXECUTOR_THREAD_WORKERS, "in_flight": 0, "max_in_flight": 0, "submitted": 0, "inline": 0},
+    "process": {"workers": EXECUTOR_PROCESS_WORKERS, "in_flight": 0, "max_in_flight": 0, "submitted": 0, "inline": 0}
+}
+
+
+def get_thread_pool() -> ThreadPoolExecutor:
+    """Returns the shared thread pool, creating it on first use."""
+    global _thread_pool
+    if _thread_pool is None:
+        _thread_pool = ThreadPoolExecutor(max_workers=EXECUTOR_THREAD_WORKERS, thread_name_prefix="cpu-offload")
+    return _thread_pool
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Returns the shared process pool, creating it on first use.
+
+    "spawn" avoids forking a process that has a running event loop and open
+    sockets. Functions sent here should live in a module that imports nothing
+    heavy (see services/image_transforms.py), since each worker imports it.
+    """
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = ProcessPoolExecutor(
+            max_workers=EXECUTOR_PROCESS_WORKERS,
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _process_pool
+
+
+async def _run_in_pool(pool_name: str, pool, func: Callable, *args):
+    stats = _executor_stats[pool_name]
+    stats["submitted"] += 1
+    stats["in_flight"] += 1
+    stats["max_in_flight"] = max(stats["max_in_flight"], stats["in_flight"])
+    try:
+        return await asyncio.get_running_loop().run_in_executor(pool, func, *args)
+    finally:
+        stats["in_flight"] -= 1
+
+
+async def run_in_thread(func: Callable, *args, size_bytes: Optional[int] = None):
+    """
+    Runs func(*args) in the shared thread pool.
+
+    Args:
+        size_bytes: Payload size. If below EXECUTOR_THREAD_THRESHOLD_BYTES the
+                    call runs inline. None means always offload.
+    """
+    if size_bytes is not None and size_bytes < EXECUTOR_THREAD_THRESHOLD_BYTES:
+        _executor_stats["thread"]["inline"] += 1
+        return func(*args)
+    return await _run_in_pool("thread", get_thread_pool(), func, *args)
+
+
+async def run_in_process(func: Callable, *args, size_bytes: Optional[int] = None):
+    """
+    Runs func(*args) in the shared process pool.
+
+    func and its arguments are pickled, so func must be a top-level function.
+
+    Args:
+        size_bytes: Payload size. If below EXECUTOR_PROCESS_THRESHOLD_BYTES the
+                    call runs inline. None means always offload.
+    """
+    if size_bytes is not None and size_bytes < EXECUTOR_PROCESS_THRESHOLD_BYTES:
+        _executor_stats["process"]["inline"] += 1
+        return func(*args)
+    return await _run_in_pool("process", get_process_pool(), func, *args)
+
+
+def get_executor_stats() -> dict:
+    """
+    Returns per-pool counters.
+
+    queue_depth is the number of submitted jobs waiting for a free worker:
+    if it stays above zero, the pool is too small for the load.
+    """
+    return {
+        pool_name: {**stats, "queue_depth": max(0, stats["in_flight"] - stats["workers"])}
+        for pool_name, stats in _executor_stats.items()
+    }
+
+
+def shutdown_executors() -> None:
+    """Stops both pools (called on app shutdown)."""
+    global _thread_pool, _process_pool
+    if _thread_pool is not None:
+        _thread_pool.shutdown(wait=False, cancel_futures=True)
+        _thread_pool = None
+    if _process_pool is not None:
+        _process_pool.shutdown(wait=False, cancel_futures=True)
+        _process_pool = None
@@ -1,5 +1,6 @@
 import fal_client
 from tenacity import retry, stop_after_attempt, wait_exponential
+from services.tracing_service import start_span, record_retry_attempt, current_retry_attempt
 
 # Parameter sets for each endpoint type
 KONTEXT_PARAMS = {
@@ -13,7 +14,16 @@ KONTEXT_DEV_PARAMS = {
     "enable_safety_checker", "acceleration", "resolution_mode"
 }
 
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=2, min=2, max=30))
+# Approximate price per generated image (USD) for each model path.
+# Used to cap how much background jobs (e.g. the cache warmer) can spend.
+MODEL_COST_USD = {
+    "fal-ai/flux-pro/kontext": 0.04,
+    "fal-ai/flux-pro/kontext/max": 0.08,
+    "fal-ai/flux-kontext/dev": 0.025
+}
+DEFAULT_MODEL_COST_USD = 0.08  # Unknown models are priced like the most expensive one
+
+@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=2, min=2, max=30), before=record_retry_attempt)
 async def kontext_nonblocking(image_url: str, prompt: str, model_path: str, **kwargs) -> dict:
     """
     There are 2 ways to call fal.ai or the client - 
@@ -51,6 +61,9 @@ async def kontext_nonblocking(image_url: str, prompt: str, model_path: str, **kw
         if value is not None and key in allowed_params:
             arguments[key] = value
     
-    async_job_handler = await fal_client.submit_async(model_path, arguments=arguments)
-    fal_api_response = await async_job_handler.get()
-    return fal_api_response
\ No newline at end of file
+    # One span per attempt; the fal request id ties our trace to the fal job
+    with start_span("fal.submit", {"fal.model": model_path, "retry.attempt": current_retry_attempt()}) as span:
+        async_job_handler = await fal_client.submit_async(model_path, arguments=arguments)
+        span.set_attribute("fal.request_id", async_job_handler.request_id)
+        fal_api_response = await async_job_handler.get()
+        return fal_api_response
@@ -0,0 +1,107 @@
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import func
+
+from services.database import get_session
+from services.models import Request
+
+logger = logging.getLogger(__name__)
+
+
+def record_request(
+    endpoint: str,
+    input_image_url: str,
+    prompt: str,
+    status: str,
+    request_params: Optional[dict] = None,
+    output_image_urls: Optional[list] = None,
+    total_response_time: Optional[int] = None,
+    fal_api_time: Optional[int] = None,
+    error_message: Optional[str] = None
+) -> None:
+    """
+    Writes one row to the `requests` table.
+
+    This is a blocking SQLAlchemy call, so async callers should run it in a
+    thread (e.g. run_in_threadpool) instead of calling it on the event loop.
+
+    Graceful degradation:
+    - If the database is down, the request itself must still succeed
+    - Errors are logged and swallowed
+    """
+    try:
+        db = get_session()
+    except Exception as e:
+        logger.warning("Request history unavailable", extra={"error": str(e)})
+        return
+
+    try:
+        db.add(Request(
+            endpoint=endpoint,
+            input_image_url=input_image_url,
+            prompt=prompt,
+            request_params=json.dumps(request_params, sort_keys=True) if request_params is not None else None,
+            output_image_urls=output_image_urls,
+            total_response_time=total_response_time,
+            fal_api_time=fal_api_time,
+            status=status,
+            error_message=error_message
+        ))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning("Request history write error", extra={"error": str(e)})
+    finally:
+        db.close()
+
+
+def get_popular_requests(limit: int = 20, lookback_hours: int = 24, min_count: int = 2) -> list:
+    """
+    Returns the most frequent successful (endpoint, image URL, prompt, params) combinations.
+
+    Used by the cache warmer to decide which cache entries are worth refreshing
+    before they expire. Only http(s) inputs are returned because uploads are
+    cached by image content, not by URL, and only rows with their generation
+    params: the warmer must replay exactly what users asked for.
+
+    Args:
+        limit: Maximum number of combinations to return
+        lookback_hours: Only count requests newer than this
+        min_count: Ignore combinations seen fewer times than this
+
+    Returns:
+        list: Dicts with endpoint, input_image_url, prompt, params and count (most frequent first)
+    """
+    since = datetime.now(timezone.utc) - timedelta(hours=lookback_hours)
+    request_count = func.count(Request.id).label("request_count")
+
+    db = get_session()
+    try:
+        rows = (
+            db.query(Request.endpoint, Request.input_image_url, Request.prompt, Request.request_params, request_count)
+            .filter(Request.status == "success")
+            .filter(Request.created_at >= since)
+            .filter(Request.input_image_url.like("http%"))
+            .filter(Request.request_params.isnot(None))
+            .group_by(Request.endpoint, Request.input_image_url, Request.prompt, Request.request_params)
+            .having(func.count(Request.id) >= min_count)
+            .order_by(request_count.desc())
+            .limit(limit)
+            .all()
+        )
+    finally:
+        db.close()
+
+    return [
+        {
+            "endpoint": row.endpoint,
+            "input_image_url": row.input_image_url,
+            "prompt": row.prompt,
+            "params": json.loads(row.request_params),
+            "count": row.request_count
+        }
+        for row in rows
+    ]
@@ -0,0 +1,206 @@
+"""
+HTTP response helpers: fast JSON encoding, compression and conditional GETs.
+
+Why: every response went through the stdlib json encoder and was sent
+uncompressed, and clients polling the same result downloaded it again each
+time. Here:
+- ORJSONResponse: the app's default response class (orjson is several
+  times faster than json.dumps and returns bytes directly)
+- CompressionMiddleware: brotli or gzip, by Accept-Encoding, for
+  compressible bodies of at least COMPRESSION_MIN_BYTES
+- conditional_json_response(): strong ETag + Cache-Control, and 304 when
+  the client's If-None-Match still matches
+- CachedStaticFiles: static files with Cache-Control and the precompressed
+  .br/.gz siblings written by build_assets.py
+"""
+import gzip
+import hashlib
+import mimetypes
+import os
+import stat
+from typing import Optional
+
+import brotli
+import orjson
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.requests import Request
+from starlette.responses import FileResponse, JSONResponse, Response
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))  # Smaller bodies fit in one packet anyway
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5  # Per-request compression: close to gzip speed, smaller output
+COMPRESSIBLE_CONTENT_TYPES = ("application/json", "text/", "application/javascript", "image/svg+xml")
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"  # Fingerprinted: a new version is a new URL
+REVALIDATE_CACHE_CONTROL = "no-cache"  # May be stored, but revalidated (usually a 304) on every use
+PRECOMPRESSED_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+# Compressed representations get their own strong ETag ("<etag>-br"), as required
+# for byte-different bodies; etag_matches() strips the suffix again
+ETAG_ENCODING_SUFFIXES = ("-br", "-gzip")
+
+
+class ORJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson (non-str dict keys allowed, like json.dumps)."""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+def compute_etag(body: bytes) -> str:
+    """Strong ETag: identical bytes, identical tag (across workers and restarts)."""
+    return f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match comparison (weak, as RFC 9110 requires for GET), ignoring encoding suffixes."""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+
+    def normalize(tag: str) -> str:
+        tag = tag.strip().removeprefix("W/").strip('"')
+        for suffix in ETAG_ENCODING_SUFFIXES:
+            tag = tag.removesuffix(suffix)
+        return tag
+
+    return normalize(etag) in {normalize(candidate) for candidate in if_none_match.split(",")}
+
+
+def conditional_json_response(request: Request, content, cache_control: str) -> Response:
+    """
+    JSON response with ETag and Cache-Control; 304 (no body) when the
+    client already has this exact representation.
+    """
+    body = orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    headers = {"ETag": compute_etag(body), "Cache-Control": cache_control}
+    if etag_matches(request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """Picks "br" or "gzip" from an Accept-Encoding header (q=0 means refused)."""
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        coding, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(coding.strip())
+    if "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing single-message responses (JSON, HTML, text).
+
+    Streamed bodies (file downloads, more_body=True) pass through untouched:
+    static assets are precompressed, and images are already compressed.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_BYTES):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+
+        async def send_compressed(message):
+            nonlocal start_message
+            if message["type"] == "http.response.start":
+                # Held back until the body shows whether it is worth compressing
+                start_message = message
+                return
+            if start_message is None:
+                await send(message)
+                return
+
+            pending_start, start_message = start_message, None
+            headers = MutableHeaders(raw=pending_start["headers"])
+            body = message.get("body", b"")
+            content_type = headers.get("content-type", "")
+            should_compress = (
+                not message.get("more_body", False)
+                and len(body) >= self.minimum_size
+                and "content-encoding" not in headers
+                and content_type.startswith(COMPRESSIBLE_CONTENT_TYPES)
+            )
+            if should_compress:
+                body = compress(body, encoding)
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(body))
+                etag = headers.get("etag")
+                if etag and not etag.startswith("W/"):
+                    headers["ETag"] = f'{etag[:-1]}-{encoding}"'
+                message = {**message, "body": body}
+            if content_type.startswith(COMPRESSIBLE_CONTENT_TYPES) and "accept-encoding" not in headers.get("vary", "").lower():
+                headers.add_vary_header("Accept-Encoding")
+
+            await send(pending_start)
+            await send(message)
+
+        await self.app(scope, receive, send_compressed)
+
+
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles with Cache-Control, serving <file>.br / <file>.gz instead of
+    <file> when the client accepts that encoding and the sibling exists.
+
+    immutable=True is for fingerprinted build output only: those files are
+    never revalidated. Everything else is "no-cache" (ETag/Last-Modified 304s).
+    """
+
+    def __init__(self, *args, immutable: bool = False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cache_control = IMMUTABLE_CACHE_CONTROL if immutable else REVALIDATE_CACHE_CONTROL
+
+    def file_response(self, full_path, stat_result, scope, status_code: int = 200) -> Response:
+        request_headers = Headers(scope=scope)
+        headers = {"Cache-Control": self.cache_control, "Vary": "Accept-Encoding"}
+        media_type = mimetypes.guess_type(str(full_path))[0] or "text/plain"
+
+        encoding = choose_encoding(request_headers.get("accept-encoding", ""))
+        if encoding:
+            compressed_path = f"{full_path}{PRECOMPRESSED_SUFFIXES[encoding]}"
+            try:
+                compressed_stat = os.stat(compressed_path)
+            except OSError:
+                compressed_stat = None
+            if compressed_stat and stat.S_ISREG(compressed_stat.st_mode):
+                full_path, stat_result = compressed_path, compressed_stat
+                headers["Content-Encoding"] = encoding
+
+        response = FileResponse(
+            full_path, status_code=status_code, headers=headers, media_type=media_type, stat_result=stat_result
+        )
+        if self.is_not_modified(response.headers, request_headers):
+            return NotModifiedResponse(response.headers)
+        return response
+
+    def is_not_modified(self, response_headers, request_headers) -> bool:
+        # As in StaticFiles, but also matching the "-br"/"-gzip" ETags CompressionMiddleware sends
+        if "if-none-match" in request_headers:
+            return etag_matches(request_headers["if-none-match"], response_headers.get("etag", ""))
+        return super().is_not_modified(response_headers, request_headers)
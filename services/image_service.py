@@ -1,9 +1,12 @@
+import asyncio
 import httpx
 import os
+import threading
 import uuid
-from supabase import create_client, Client
+from typing import Optional
 from dotenv import load_dotenv
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_not_exception_type
+from tenacity import AsyncRetrying, stop_after_attempt, wait_exponential, retry_if_not_exception_type
+from services.tracing_service import start_span, record_retry_attempt, current_retry_attempt
 
 
 MAX_IMAGE_SIZE_BYTES = 100 * 1024 * 1024  # 100MB limit for downloads
@@ -29,19 +32,65 @@ load_dotenv()
 SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_KEY")
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("Missing SUPABASE_URL or SUPABASE_KEY in .env file")
+# Created on first use (or by init_supabase at startup), not at import:
+# building the client imports the whole supabase SDK (~200ms) and its HTTP pools.
+supabase = None
+_supabase_lock = threading.Lock()
+
+
+def get_supabase_client():
+    """Returns the Supabase client, creating it on first call (thread-safe)."""
+    global supabase
+    if supabase is None:
+        with _supabase_lock:
+            if supabase is None:
+                if not SUPABASE_URL or not SUPABASE_KEY:
+                    raise RuntimeError("Missing SUPABASE_URL or SUPABASE_KEY in .env file")
+                from supabase import create_client
+                supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+    return supabase
+
+
+def init_supabase() -> None:
+    """
+    Creates the storage client at startup so the first request doesn't pay for it.
+
+    Raises:
+        RuntimeError: If credentials are missing (storage is required, so startup fails)
+    """
+    get_supabase_client()
+
+
+def check_storage() -> str:
+    """Readiness check: "ok" once the storage client exists (no network call)."""
+    return "ok" if supabase is not None else "error"
+
+# Retry policy for downloads: 3 attempts with exponential backoff (1s, 2s, ...).
+# This handles temporary network failures, timeouts, and server errors.
+# ValueError is excluded from retries because it indicates validation errors (e.g., file too large).
+DOWNLOAD_RETRY_ATTEMPTS = 3
+DOWNLOAD_RETRY_WAIT = wait_exponential(multiplier=1, min=1, max=10)
+
+
+class DownloadState:
+    """
+    What a download keeps between retry attempts, so a retry can continue
+    where the previous attempt stopped instead of starting from byte zero.
+    """
+
+    __slots__ = ("data", "validator", "can_resume")
+
+    def __init__(self):
+        self.data = bytearray()  # Appending to bytes would copy the whole buffer on every chunk
+        self.validator = None  # Strong ETag (or Last-Modified) of the bytes in `data`
+        self.can_resume = False  # Origin sent Accept-Ranges: bytes and a validator
+
+    def restart(self) -> None:
+        self.data.clear()
+        self.validator = None
+        self.can_resume = False
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
-# Retry decorator: Automatically retries 3 times with exponential backoff (1s, 2s, 4s)
-# This handles temporary network failures, timeouts, and server errors
-# ValueError is excluded from retries because it indicates validation errors (e.g., file too large)
-@retry(
-    stop=stop_after_attempt(3), 
-    wait=wait_exponential(multiplier=1, min=1, max=10),
-    retry=retry_if_not_exception_type(ValueError)
-)
 async def download_image(image_url: str) -> bytes:
     """
     Downloads image with TRUE streaming protection and automatic retry.
@@ -51,8 +100,19 @@ async def download_image(image_url: str) -> bytes:
     - Attempt 1: Immediate
     - Attempt 2: Wait 1 second
     - Attempt 3: Wait 2 seconds
-    - Attempt 4: Wait 4 seconds
     - If all fail: raises the last exception
+
+    Resumable retries:
+    - If the connection drops mid-stream and the origin supports ranges
+      (Accept-Ranges: bytes + a strong ETag or Last-Modified), the retry asks
+      only for the missing bytes: Range: bytes=<received>-
+    - If-Range makes that conditional: if the file changed in between, the
+      origin sends the whole new file (200) and we start over, so bytes of
+      two versions are never mixed
+    - Origins without range support are downloaded from the start again
+    - We ask for Accept-Encoding: identity (images are compressed already).
+      Ranges count encoded bytes while we count decoded ones, so a response
+      that is content-encoded anyway is never resumed, only restarted
     
     Security considerations:
     - Malicious users could provide URLs to large files
@@ -64,45 +124,104 @@ async def download_image(image_url: str) -> bytes:
     Returns:
         bytes: Raw image data
     """
+    download_state = DownloadState()
+    retrying = AsyncRetrying(
+        stop=stop_after_attempt(DOWNLOAD_RETRY_ATTEMPTS),
+        wait=DOWNLOAD_RETRY_WAIT,
+        retry=retry_if_not_exception_type(ValueError),
+        before=record_retry_attempt,
+        reraise=True
+    )
+    async for attempt in retrying:
+        with attempt:
+            return await download_image_attempt(image_url, download_state)
+
+
+async def download_image_attempt(image_url: str, download_state: DownloadState) -> bytes:
+    """One attempt of download_image: resumes from download_state when possible."""
     headers = {
-        "User-Agent": "FalProxyApp/1.0 (Educational Project; +http://localhost:8000)"
+        "User-Agent": "FalProxyApp/1.0 (Educational Project; +http://localhost:8000)",
+        "Accept-Encoding": "identity"  # Byte offsets must match what we count (see download_image)
     }
-    
-    async with httpx.AsyncClient(
-        timeout=DOWNLOAD_TIMEOUT_SECONDS, 
-        follow_redirects=True, 
-        headers=headers
-    ) as http_client:
-        async with http_client.stream("GET", image_url) as response:
-            response.raise_for_status()
-            
-            # Fast fail: Check Content-Length header if present
-            content_length = response.headers.get("Content-Length")
-            if content_length and int(content_length) > MAX_IMAGE_SIZE_BYTES:
-                raise ValueError(
-                    f"Image too large ({int(content_length)} bytes). "
-                    f"Maximum allowed: {MAX_IMAGE_SIZE_BYTES} bytes."
-                )
-            
-            # Safe download: Read in chunks and abort if limit exceeded
-            # Why chunked downloading prevents crashes:
-            # - Malicious actors can send Content-Length: 1MB but actually stream 10GB
-            # - Loading entire file into memory first may cause OOM crash (Out Of Memory)
-            # - Chunked approach: check size after each 8KB chunk, abort immediately if exceeded
-            # - Memory footprint: max 100MB (our limit) instead of unlimited
-            downloaded_data = b""
-            async for chunk in response.aiter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE_BYTES):
-                downloaded_data += chunk
-                
-                if len(downloaded_data) > MAX_IMAGE_SIZE_BYTES:
+    resume_offset = len(download_state.data) if download_state.can_resume else 0
+    if resume_offset:
+        headers["Range"] = f"bytes={resume_offset}-"
+        headers["If-Range"] = download_state.validator
+    else:
+        download_state.restart()
+
+    # One span per attempt, so retries show up as separate timings in the trace
+    with start_span("download_image", {"http.url": image_url, "retry.attempt": current_retry_attempt(),
+                                       "download.resume_offset": resume_offset}) as span:
+        async with httpx.AsyncClient(
+            timeout=DOWNLOAD_TIMEOUT_SECONDS, 
+            follow_redirects=True, 
+            headers=headers
+        ) as http_client:
+            async with http_client.stream("GET", image_url) as response:
+                if response.status_code == 416 and resume_offset:
+                    # Our offset no longer fits the file: retry from the start
+                    download_state.restart()
+                    raise httpx.HTTPStatusError("Range not satisfiable", request=response.request, response=response)
+                # 4xx (404, 403, ...) will not fix itself on retry: treat it as bad input.
+                # 408 and 429 are temporary, so they still go through raise_for_status and retry.
+                if 400 <= response.status_code < 500 and response.status_code not in (408, 429):
+                    raise ValueError(f"Image URL returned HTTP {response.status_code}.")
+                response.raise_for_status()
+                span.set_attribute("http.status_code", response.status_code)
+
+                if response.status_code == 206 and resume_offset:
+                    # Continuing: the origin must send exactly the bytes after ours
+                    content_range = response.headers.get("Content-Range", "")
+                    if not content_range.startswith(f"bytes {resume_offset}-"):
+                        download_state.restart()
+                        raise httpx.RemoteProtocolError(f"Unexpected Content-Range: {content_range!r}")
+                    total_size = content_range.rpartition("/")[2]
+                    expected_size = int(total_size) if total_size.isdigit() else None
+                else:
+                    # Full body (first attempt, no range support, or the file changed)
+                    download_state.restart()
+                    etag = response.headers.get("ETag")
+                    # Weak ETags (W/"...") cannot be used with If-Range
+                    download_state.validator = etag if etag and not etag.startswith("W/") else response.headers.get("Last-Modified")
+                    download_state.can_resume = (
+                        response.headers.get("Accept-Ranges", "").lower() == "bytes"
+                        and download_state.validator is not None
+                        and response.headers.get("Content-Encoding", "identity").lower() == "identity"
+                    )
+                    content_length = response.headers.get("Content-Length")
+                    expected_size = int(content_length) if content_length and content_length.isdigit() else None
+
+                # Fast fail: Check the announced size if present
+                if expected_size and expected_size > MAX_IMAGE_SIZE_BYTES:
                     raise ValueError(
-                        f"Download aborted: Image exceeded {MAX_IMAGE_SIZE_BYTES} bytes."
+                        f"Image too large ({expected_size} bytes). "
+                        f"Maximum allowed: {MAX_IMAGE_SIZE_BYTES} bytes."
                     )
             
-            return downloaded_data
+                # Safe download: Read in chunks and abort if limit exceeded
+                # Why chunked downloading prevents crashes:
+                # - Malicious actors can send Content-Length: 1MB but actually stream 10GB
+                # - Loading entire file into memory first may cause OOM crash (Out Of Memory)
+                # - Chunked approach: check size after each 8KB chunk, abort immediately if exceeded
+                # - Memory footprint: max 100MB (our limit) instead of unlimited
+                # Chunks go straight into download_state, so a dropped connection keeps them for the retry
+                async for chunk in response.aiter_bytes(chunk_size=DOWNLOAD_CHUNK_SIZE_BYTES):
+                    download_state.data += chunk
+                
+                    if len(download_state.data) > MAX_IMAGE_SIZE_BYTES:
+                        raise ValueError(
+                            f"Download aborted: Image exceeded {MAX_IMAGE_SIZE_BYTES} bytes."
+                        )
 
+                if expected_size is not None and response.status_code == 206 and len(download_state.data) != expected_size:
+                    raise httpx.RemoteProtocolError("Resumed download ended before the full file was received")
+            
+                span.set_attribute("download.bytes", len(download_state.data))
+                return bytes(download_state.data)
 
-async def save_image(image_bytes: bytes) -> str:
+
+async def save_image(image_bytes: bytes, filename: Optional[str] = None, content_type: str = "image/jpeg") -> str:
     """
     Uploads image to Supabase Storage and returns a public URL.
     No format validation - fal.ai will validate the image format.
@@ -113,28 +232,35 @@ async def save_image(image_bytes: bytes) -> str:
     
     Args:
         image_bytes: Raw image data to upload
+        filename: Storage path (default: random UUID). Derivatives pass
+                  "<original id>_<variant>.<ext>" so they sit next to the original.
+        content_type: MIME type stored with the object
     Returns:
         str: Public URL to the uploaded image   
     """
     # Generate cryptographically random filename to prevent collisions
-    unique_filename = f"{uuid.uuid4()}"
-
-    # Upload to cloud storage
-    supabase.storage.from_(STORAGE_BUCKET_NAME).upload(
-        path=unique_filename,
-        file=image_bytes,
-        file_options={
-            "content-type": "image/jpeg",  # Default content-type
-            "upsert": "true"  # Overwrite if UUID collision (extremely rare)
-        }
-    )
+    unique_filename = filename or f"{uuid.uuid4()}"
+
+    # Upload to cloud storage. The Supabase client is blocking: run it in a
+    # thread so the event loop keeps serving (and concurrent uploads overlap)
+    with start_span("storage.upload", {"storage.bucket": STORAGE_BUCKET_NAME, "storage.object": unique_filename,
+                                       "storage.bytes": len(image_bytes)}):
+        await asyncio.to_thread(
+            get_supabase_client().storage.from_(STORAGE_BUCKET_NAME).upload,
+            path=unique_filename,
+            file=image_bytes,
+            file_options={
+                "content-type": content_type,
+                "upsert": "true"  # Overwrite if UUID collision (extremely rare)
+            }
+        )
+
+    return get_image_public_url(unique_filename)
 
-    # Get the permanent public URL
-    public_access_url = supabase.storage.from_(STORAGE_BUCKET_NAME).get_public_url(
-        unique_filename
-    )
 
-    return public_access_url
+def get_image_public_url(filename: str) -> str:
+    """Returns the permanent public URL of a stored image (no network call)."""
+    return get_supabase_client().storage.from_(STORAGE_BUCKET_NAME).get_public_url(filename)
 
 
 def validate_image_type_from_magic_bytes(file_content: bytes) -> str:
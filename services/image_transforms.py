@@ -0,0 +1,133 @@
+"""
+CPU-bound functions that run inside worker processes (see executor_service).
+
+Kept separate from the service modules on purpose: worker processes are
+started with "spawn" and import this module fresh, so it must only import
+Pillow - not Redis, Supabase or the database.
+"""
+import base64
+import io
+import math
+import os
+
+from PIL import Image, ImageOps
+
+IMAGE_PREPROCESS_JPEG_QUALITY = int(os.getenv("IMAGE_PREPROCESS_JPEG_QUALITY", "90"))
+
+# Longest edge in pixels for each variant
+DERIVATIVE_SIZES = {
+    "thumbnail": 256,
+    "medium": 1024
+}
+
+# Pillow format name and MIME type for each output format
+DERIVATIVE_FORMATS = {
+    "webp": ("WEBP", "image/webp"),
+    "avif": ("AVIF", "image/avif")
+}
+DERIVATIVE_QUALITY = 80
+
+
+def read_image_size(image_bytes: bytes) -> tuple:
+    """(width, height) from the image header, without decoding the pixels."""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        return image.size
+
+
+def get_derivative_dimensions(width: int, height: int, size_name: str) -> tuple:
+    """
+    Size a variant will have, without rendering it.
+    Same rounding as Image.thumbnail(), which render_derivatives() uses.
+    """
+    max_edge = DERIVATIVE_SIZES[size_name]
+    if width <= max_edge and height <= max_edge:
+        return width, height
+
+    def round_aspect(number, key):
+        return max(min(math.floor(number), math.ceil(number), key=key), 1)
+
+    aspect = width / height
+    if aspect <= 1:  # Portrait or square: the height is the long edge
+        return round_aspect(max_edge * aspect, key=lambda n: abs(aspect - n / max_edge)), max_edge
+    return max_edge, round_aspect(max_edge / aspect, key=lambda n: 0 if n == 0 else abs(aspect - max_edge / n))
+
+
+def render_derivatives(image_bytes: bytes, size_names: list, output_formats: list) -> list:
+    """
+    Decodes the image once and encodes every requested size/format.
+
+    Runs inside a worker process, so it must stay a plain top-level function
+    that only takes and returns picklable values.
+
+    Returns:
+        list: Dicts with size, format, bytes, width and height
+    """
+    rendered = []
+    with Image.open(io.BytesIO(image_bytes)) as source_image:
+        # JPEG only: decode at reduced size when the largest variant allows it
+        largest_edge = max(DERIVATIVE_SIZES[size_name] for size_name in size_names)
+        source_image.draft("RGB", (largest_edge, largest_edge))
+        source_image.load()
+
+        for size_name in size_names:
+            max_edge = DERIVATIVE_SIZES[size_name]
+            resized = source_image.copy()
+            resized.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+            if resized.mode not in ("RGB", "RGBA"):
+                resized = resized.convert("RGBA" if "A" in resized.getbands() else "RGB")
+
+            for output_format in output_formats:
+                pillow_format, _ = DERIVATIVE_FORMATS[output_format]
+                output_buffer = io.BytesIO()
+                resized.save(output_buffer, format=pillow_format, quality=DERIVATIVE_QUALITY)
+                rendered.append({
+                    "size": size_name,
+                    "format": output_format,
+                    "bytes": output_buffer.getvalue(),
+                    "width": resized.width,
+                    "height": resized.height
+                })
+
+    return rendered
+
+
+def resize_image(image_bytes: bytes, max_edge: int, mime_type: str) -> bytes:
+    """
+    Decodes, downscales to max_edge, strips metadata and re-encodes the image.
+
+    Runs inside a worker process (see preprocess_image), so it must stay a
+    plain top-level function that only takes and returns picklable values.
+
+    - EXIF orientation is applied to the pixels first, so dropping EXIF
+      does not rotate the image
+    - The output keeps the input format (JPEG stays JPEG, PNG stays PNG)
+    """
+    with Image.open(io.BytesIO(image_bytes)) as source_image:
+        # JPEG only: let the decoder scale down by 1/2, 1/4 or 1/8 while decoding
+        # (never below max_edge), which is much cheaper than decoding at full size
+        source_image.draft("RGB", (max_edge, max_edge))
+        image = ImageOps.exif_transpose(source_image)
+        image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+
+        output_buffer = io.BytesIO()
+        if mime_type == "image/png":
+            image.save(output_buffer, format="PNG")
+        else:
+            if image.mode not in ("RGB", "L"):
+                image = image.convert("RGB")
+            image.save(output_buffer, format="JPEG", quality=IMAGE_PREPROCESS_JPEG_QUALITY, optimize=True)
+
+    return output_buffer.getvalue()
+
+
+def decode_base64_image(image_data: str) -> bytes:
+    """
+    Decodes a base64 upload.
+
+    A 10MB upload is ~13MB of base64; decoding it holds the GIL, so large
+    uploads are sent here through the process pool.
+
+    Raises:
+        ValueError: If the string is not valid base64 (binascii.Error)
+    """
+    return base64.b64decode(image_data)
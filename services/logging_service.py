@@ -0,0 +1,95 @@
+"""
+Structured, async-safe logging.
+
+Replaces the bare print() calls so that every log line can be correlated
+with its request:
+- Each line is one JSON object (LOG_FORMAT=json, default) or plain text (LOG_FORMAT=text)
+- request_id / trace_id / span_id are added automatically from the tracing context
+- Extra fields passed as logger.info("...", extra={"cache_key": key}) become JSON keys
+
+Why a queue:
+- Writing to stderr/a file is blocking I/O
+- Request code only puts the record on an in-memory queue (QueueHandler)
+- A background thread (QueueListener) does the actual writing
+"""
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+
+# Attributes every LogRecord has; anything else came from `extra=`
+_STANDARD_RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "asctime", "taskName"}
+
+_queue_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats a record as a single JSON line including the tracing context."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        # Imported here: tracing_service logs through this module too
+        from services.tracing_service import get_log_context
+
+        log_entry = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage()
+        }
+        log_entry.update(getattr(record, "trace_context", None) or get_log_context())
+
+        for key, value in vars(record).items():
+            if key not in _STANDARD_RECORD_ATTRIBUTES and key != "trace_context":
+                log_entry[key] = value
+
+        if record.exc_info:
+            log_entry["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(log_entry, default=str)
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """
+    Captures the tracing context on the calling thread/task.
+
+    The listener thread formats the record later, when the request's
+    contextvars are no longer visible, so they are attached to the record here.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        from services.tracing_service import get_log_context
+
+        record.trace_context = get_log_context()
+        return record
+
+
+def configure_logging() -> None:
+    """
+    Routes all logging through one queue to a stderr writer thread.
+    Safe to call more than once.
+    """
+    global _queue_listener
+    if _queue_listener is not None:
+        return
+
+    stream_handler = logging.StreamHandler(sys.stderr)
+    if LOG_FORMAT == "json":
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+
+    log_queue = queue.SimpleQueue()
+    root_logger = logging.getLogger()
+    root_logger.handlers = [ContextQueueHandler(log_queue)]
+    root_logger.setLevel(LOG_LEVEL)
+
+    _queue_listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _queue_listener.start()
+    atexit.register(_queue_listener.stop)
@@ -0,0 +1,151 @@
+"""
+Model routing for /kontext/auto: picks a fal.ai model path from live stats.
+
+Why: latency and availability of each model change over the day, and a
+client that hard-codes /kontext/max pays for it even when /kontext would
+meet its needs, or keeps failing while a sibling model is healthy.
+
+Every fal.ai call (from any endpoint) is recorded with track_model_call():
+a rolling window of outcomes (ROUTER_WINDOW_SECONDS) plus the number of
+calls currently in flight. Stats are per worker process; each worker
+learns from its own traffic, which is enough to steer away from a slow or
+failing model within a few requests.
+
+Policies:
+- fastest:  lowest expected latency among models meeting a quality floor
+- cheapest: lowest cost among those whose expected latency meets a latency
+            SLO (falls back to the fastest if none does)
+Degraded models (error rate above ROUTER_DEGRADED_ERROR_RATE) go last, so
+they are only used when every candidate is degraded.
+"""
+import collections
+import os
+import statistics
+import threading
+import time
+from contextlib import contextmanager
+from typing import List
+
+from services.fal_service import MODEL_COST_USD, DEFAULT_MODEL_COST_USD
+
+ROUTER_WINDOW_SECONDS = float(os.getenv("ROUTER_WINDOW_SECONDS", "300"))
+ROUTER_LATENCY_SLO_MS = int(os.getenv("ROUTER_LATENCY_SLO_MS", "15000"))
+ROUTER_DEGRADED_ERROR_RATE = float(os.getenv("ROUTER_DEGRADED_ERROR_RATE", "0.5"))
+ROUTER_MIN_SAMPLES = 5  # Fewer outcomes than this never mark a model degraded
+ROUTER_QUEUE_PARALLELISM = 4  # In-flight calls a model absorbs before queueing adds a full latency
+ROUTER_MAX_ATTEMPTS = 2  # Chosen model + one sibling fallback
+ROUTER_MAX_SAMPLES = 500  # Per model, bounds memory under heavy traffic
+
+ROUTING_POLICIES = ("fastest", "cheapest")
+
+# Quality floor names accepted by /kontext/auto
+QUALITY_LEVELS = {"draft": 1, "standard": 2, "max": 3}
+
+# Routable models: quality rank and a latency prior (ms) used until real samples exist
+MODEL_PROFILES = {
+    "fal-ai/flux-kontext/dev": {"quality": 1, "prior_latency_ms": 5000},
+    "fal-ai/flux-pro/kontext": {"quality": 2, "prior_latency_ms": 7000},
+    "fal-ai/flux-pro/kontext/max": {"quality": 3, "prior_latency_ms": 10000}
+}
+
+
+class ModelStats:
+    """Rolling outcomes of one model: (finished_at, latency_ms, succeeded) + calls in flight."""
+
+    __slots__ = ("samples", "in_flight")
+
+    def __init__(self):
+        self.samples = collections.deque(maxlen=ROUTER_MAX_SAMPLES)
+        self.in_flight = 0
+
+
+_model_stats = collections.defaultdict(ModelStats)
+_stats_lock = threading.Lock()
+
+
+@contextmanager
+def track_model_call(model_path: str):
+    """
+    Wraps one fal.ai generation (retries included, as the user waits for them).
+    An exception marks the call failed and is re-raised.
+    """
+    with _stats_lock:
+        _model_stats[model_path].in_flight += 1
+    started_at = time.perf_counter()
+    succeeded = False
+    try:
+        yield
+        succeeded = True
+    finally:
+        latency_ms = (time.perf_counter() - started_at) * 1000
+        with _stats_lock:
+            stats = _model_stats[model_path]
+            stats.in_flight -= 1
+            stats.samples.append((time.monotonic(), latency_ms, succeeded))
+
+
+def get_model_snapshot(model_path: str) -> dict:
+    """Current view of one model, as used for routing (also exposed in /metrics)."""
+    window_start = time.monotonic() - ROUTER_WINDOW_SECONDS
+    with _stats_lock:
+        stats = _model_stats[model_path]
+        samples = [sample for sample in stats.samples if sample[0] >= window_start]
+        in_flight = stats.in_flight
+
+    success_latencies = [latency_ms for _, latency_ms, succeeded in samples if succeeded]
+    error_rate = (len(samples) - len(success_latencies)) / len(samples) if samples else 0.0
+    if success_latencies:
+        p50_latency_ms = statistics.median(success_latencies)
+    else:
+        p50_latency_ms = MODEL_PROFILES.get(model_path, {}).get("prior_latency_ms", ROUTER_LATENCY_SLO_MS)
+
+    return {
+        "samples": len(samples),
+        "in_flight": in_flight,
+        "error_rate": round(error_rate, 3),
+        "p50_latency_ms": round(p50_latency_ms, 1),
+        # Our own in-flight calls are the queue depth we can see: each batch of
+        # ROUTER_QUEUE_PARALLELISM calls ahead of this one adds about one latency
+        "expected_latency_ms": round(p50_latency_ms * (1 + in_flight / ROUTER_QUEUE_PARALLELISM), 1),
+        "degraded": len(samples) >= ROUTER_MIN_SAMPLES and error_rate > ROUTER_DEGRADED_ERROR_RATE,
+        "cost_usd": MODEL_COST_USD.get(model_path, DEFAULT_MODEL_COST_USD)
+    }
+
+
+def choose_models(policy: str, min_quality: int, latency_slo_ms: int = ROUTER_LATENCY_SLO_MS) -> List[str]:
+    """
+    Orders the eligible models by policy: the first is the choice, the rest
+    are fallbacks (healthy siblings first, degraded models last).
+
+    Raises:
+        ValueError: Unknown policy, or no model meets the quality floor
+    """
+    if policy not in ROUTING_POLICIES:
+        raise ValueError(f"Unknown routing policy: {policy}")
+
+    snapshots = {
+        model_path: get_model_snapshot(model_path)
+        for model_path, profile in MODEL_PROFILES.items()
+        if profile["quality"] >= min_quality
+    }
+    if not snapshots:
+        raise ValueError(f"No model meets quality level {min_quality}")
+
+    def rank(model_path: str) -> tuple:
+        snapshot = snapshots[model_path]
+        if snapshot["degraded"]:
+            return (2, snapshot["error_rate"], snapshot["expected_latency_ms"])
+        if policy == "cheapest" and snapshot["expected_latency_ms"] <= latency_slo_ms:
+            return (0, snapshot["cost_usd"], snapshot["expected_latency_ms"])
+        return (1, snapshot["expected_latency_ms"], snapshot["cost_usd"])
+
+    return sorted(snapshots, key=rank)
+
+
+def get_router_stats() -> dict:
+    return {model_path: get_model_snapshot(model_path) for model_path in MODEL_PROFILES}
+
+
+def reset_model_stats() -> None:
+    with _stats_lock:
+        _model_stats.clear()
@@ -23,6 +23,11 @@ class Request(Base):
     # Text prompt provided by the user for image editing
     # Required: For debugging and identifying common prompts/patterns
     prompt = Column(String, nullable=False)
+
+    # Generation parameters (seed, num_images, aspect_ratio, ...) as canonical
+    # JSON (sorted keys, unset ones left out), so identical requests group together
+    # Optional: The cache warmer replays these; rows without them are never replayed
+    request_params = Column(String, nullable=True)
     
     # Array of output image URLs returned by fal.ai (can be multiple images)
     # Stored as JSON to handle variable number of results
@@ -51,4 +56,48 @@ class Request(Base):
     # Timestamp when request was received
     # Auto-generated by database on insert
     # Required: For time-series analysis and tracking usage patterns
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class RehostJob(Base):
+    """
+    Durable queue of generations whose outputs still have to be re-hosted.
+
+    A row is written when fal.ai succeeded but downloading/uploading the
+    generated images failed (step 4), so the paid generation is kept and the
+    re-hosting is retried in the background (see services/rehost_service.py).
+    """
+    __tablename__ = "rehost_jobs"
+
+    # Job reference returned to the client (GET /jobs/{id}); uuid4 hex
+    id = Column(String(32), primary_key=True)
+
+    # Cache key of the request: the result is cached here once re-hosted,
+    # and identical requests wait for this job instead of generating again
+    cache_key = Column(String, nullable=True, index=True)
+
+    # fal.ai model path that produced the result
+    model_path = Column(String, nullable=False)
+
+    # The fal.ai response (images with their fal URLs, prompt)
+    # Required: This is the paid-for generation the job re-hosts
+    fal_result = Column(JSON, nullable=False)
+
+    # "pending" -> "running" -> "succeeded" | "failed" (after REHOST_MAX_ATTEMPTS)
+    status = Column(String, nullable=False, index=True)
+
+    # Number of re-host attempts made so far (the first is the inline one)
+    attempts = Column(Integer, nullable=False, default=0)
+
+    # When the job may next be claimed: backoff for pending jobs, lease expiry
+    # for running ones (a worker that died mid-job releases it this way)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+    # Final response (same shape as the kontext endpoints) once succeeded
+    result = Column(JSON, nullable=True)
+
+    # Last error, for debugging and for the client polling the job
+    error_message = Column(String, nullable=True)
+
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -0,0 +1,101 @@
+import logging
+import os
+import struct
+from typing import Optional, Tuple
+
+from services.executor_service import run_in_process
+from services.image_transforms import resize_image
+
+logger = logging.getLogger(__name__)
+
+# Longest edge (pixels) we send to fal.ai. The kontext models work at ~1MP,
+# so a 6000px original only costs upload time. 0 disables preprocessing.
+IMAGE_PREPROCESS_MAX_EDGE = int(os.getenv("IMAGE_PREPROCESS_MAX_EDGE", "0"))
+
+# JPEG start-of-frame markers carry the image size.
+# 0xC4 (DHT), 0xC8 (JPG extension) and 0xCC (DAC) share the range but are not frames.
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+def probe_image_dimensions(image_bytes: bytes) -> Optional[Tuple[int, int]]:
+    """
+    Reads (width, height) from the image header without decoding the pixels.
+
+    Why header-only:
+    - Decoding a 100MB image takes hundreds of milliseconds and lots of memory
+    - The size lives in the first few bytes (PNG) or the first frame marker (JPEG)
+    - Lets us skip preprocessing entirely for images that are already small
+
+    Returns:
+        tuple: (width, height) if the header could be parsed
+        None: If the format is unknown or the header is truncated
+    """
+    # PNG: fixed layout, IHDR chunk right after the 8-byte signature
+    if image_bytes.startswith(b"\x89PNG\r\n\x1a\n") and len(image_bytes) >= 24:
+        width, height = struct.unpack(">II", image_bytes[16:24])
+        return width, height
+
+    # JPEG: walk the marker segments until the start-of-frame
+    if image_bytes.startswith(b"\xff\xd8"):
+        offset = 2
+        while offset + 4 <= len(image_bytes):
+            if image_bytes[offset] != 0xFF:
+                return None
+            marker = image_bytes[offset + 1]
+            if marker == 0xFF:
+                # Padding byte between markers
+                offset += 1
+                continue
+            segment_length = struct.unpack(">H", image_bytes[offset + 2:offset + 4])[0]
+            if marker in JPEG_SOF_MARKERS:
+                if offset + 9 > len(image_bytes):
+                    return None
+                height, width = struct.unpack(">HH", image_bytes[offset + 5:offset + 9])
+                return width, height
+            offset += 2 + segment_length
+
+    return None
+
+
+async def preprocess_image(image_bytes: bytes, mime_type: str, max_edge: int = IMAGE_PREPROCESS_MAX_EDGE) -> bytes:
+    """
+    Shrinks oversized input images before we upload them to Supabase and fal.ai.
+
+    Flow:
+    1. Disabled (max_edge = 0): return the original bytes
+    2. Header says the image already fits: return the original bytes (no decode)
+    3. Otherwise downscale + strip EXIF in the process pool
+    4. Re-encoded output not smaller (flat PNG -> JPEG, already tight JPEG):
+       return the original bytes, the point is to upload less
+
+    Preprocessing is an optimization, so any failure falls back to the original
+    bytes instead of failing the request (fal.ai will validate the image).
+
+    Args:
+        image_bytes: Validated JPEG or PNG bytes
+        mime_type: Result of validate_image_type_from_magic_bytes
+        max_edge: Longest allowed edge in pixels
+    Returns:
+        bytes: The (possibly smaller) image
+    """
+    if max_edge <= 0:
+        return image_bytes
+
+    dimensions = probe_image_dimensions(image_bytes)
+    if dimensions and max(dimensions) <= max_edge:
+        return image_bytes
+
+    try:
+        resized_bytes = await run_in_process(resize_image, image_bytes, max_edge, mime_type)
+    except Exception as e:
+        logger.warning("Image preprocessing failed, using original", extra={"error": str(e)})
+        return image_bytes
+
+    if len(resized_bytes) >= len(image_bytes):
+        logger.info("Image preprocessing did not shrink the input, using original", extra={
+            "input_bytes": len(image_bytes), "output_bytes": len(resized_bytes)
+        })
+        return image_bytes
+
+    logger.info("Image preprocessed", extra={"input_bytes": len(image_bytes), "output_bytes": len(resized_bytes)})
+    return resized_bytes
@@ -0,0 +1,256 @@
+"""
+Durable re-host queue: keeps a paid fal.ai generation when step 4 fails.
+
+Why: step 4 (download the generated images from fal.ai's CDN, upload them
+to Supabase) runs after fal.ai has already charged for the generation. A
+failure there used to be a 500, and the user's retry paid for a second
+generation. Now the fal.ai result is written to the `rehost_jobs` table,
+the client gets 202 with a job to poll (GET /jobs/{id}), and a background
+worker retries the re-hosting with exponential backoff.
+
+- Durable: jobs live in the database, so they survive restarts/deploys
+- Exactly one worker runs a job: claiming is a conditional UPDATE, and a
+  claim is a lease (a worker that dies mid-job releases it on expiry)
+- No duplicate generation: while a job is pending for a cache key,
+  identical requests get the same job reference instead of calling fal.ai
+- Once re-hosted, the result is cached under the request's cache key
+
+Job status is mirrored in shared state so polling does not hit the database.
+Requires DATABASE_URL; without it step 4 failures are 500s as before.
+"""
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, List, Optional
+
+from sqlalchemy import select, update
+
+from services.cache_service import set_cache_entry
+from services.database import get_session
+from services.models import RehostJob
+from services.shared_state import get_shared_state, set_job_status, get_job_status
+from services.tracing_service import start_span
+
+logger = logging.getLogger(__name__)
+
+REHOST_QUEUE_ENABLED = (
+    os.getenv("REHOST_QUEUE_ENABLED", "true").lower() == "true" and bool(os.getenv("DATABASE_URL"))
+)
+REHOST_POLL_INTERVAL_SECONDS = float(os.getenv("REHOST_POLL_INTERVAL_SECONDS", "5"))
+REHOST_MAX_ATTEMPTS = int(os.getenv("REHOST_MAX_ATTEMPTS", "8"))  # Including the inline attempt
+REHOST_BACKOFF_BASE_SECONDS = 10  # 10s, 20s, 40s, ... between attempts
+REHOST_BACKOFF_MAX_SECONDS = 1800
+REHOST_LEASE_SECONDS = 300  # A claimed job becomes claimable again if not finished by then
+REHOST_BATCH_SIZE = 5  # Jobs claimed per poll and worker
+PENDING_JOB_KEY_PREFIX = "kontext_rehost:"
+PENDING_JOB_TTL_SECONDS = 24 * 3600
+
+# rehost(fal_result) -> response_data (the same as step 4 of the pipeline)
+RehostFunction = Callable[[dict], Awaitable[dict]]
+
+
+class RehostQueued(Exception):
+    """Raised instead of a 500 when step 4 failed and a job now holds the result (answered with 202)."""
+
+    def __init__(self, job_id: str):
+        super().__init__(job_id)
+        self.job_id = job_id
+
+
+def backoff_seconds(attempts: int) -> int:
+    """Delay before the next attempt, after `attempts` failed ones."""
+    return min(REHOST_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1), REHOST_BACKOFF_MAX_SECONDS)
+
+
+def utc_now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def serialize_job(job: RehostJob) -> dict:
+    """What GET /jobs/{id} returns."""
+    job_status = {"job_id": job.id, "status": job.status, "attempts": job.attempts}
+    if job.status == "succeeded":
+        job_status["result"] = job.result
+    elif job.error_message:
+        job_status["error"] = job.error_message
+    return job_status
+
+
+def enqueue_rehost_job(fal_result: dict, model_path: str, cache_key: Optional[str], error_message: str) -> Optional[str]:
+    """
+    Stores a generation whose re-hosting failed inline (that counts as attempt 1).
+
+    Blocking database call: run it in a thread from async code.
+
+    Returns:
+        str: The job id
+        None: If the queue is disabled or the database is unavailable
+    """
+    if not REHOST_QUEUE_ENABLED:
+        return None
+
+    job = RehostJob(
+        id=uuid.uuid4().hex,
+        cache_key=cache_key,
+        model_path=model_path,
+        fal_result=fal_result,
+        status="pending",
+        attempts=1,
+        next_attempt_at=utc_now() + timedelta(seconds=backoff_seconds(1)),
+        error_message=error_message
+    )
+    try:
+        db = get_session()
+    except Exception as e:
+        logger.warning("Rehost queue unavailable", extra={"error": str(e)})
+        return None
+
+    try:
+        db.add(job)
+        db.commit()
+        job_status = serialize_job(job)
+    except Exception as e:
+        db.rollback()
+        logger.warning("Rehost job write error", extra={"error": str(e)})
+        return None
+    finally:
+        db.close()
+
+    set_job_status(job_status["job_id"], job_status)
+    if cache_key:
+        get_shared_state().set(f"{PENDING_JOB_KEY_PREFIX}{cache_key}", job_status["job_id"], PENDING_JOB_TTL_SECONDS)
+    logger.info("Rehost job queued", extra={"job_id": job_status["job_id"], "cache_key": cache_key})
+    return job_status["job_id"]
+
+
+def get_pending_job_id(cache_key: str) -> Optional[str]:
+    """Job currently re-hosting the result for this cache key, if any."""
+    return get_shared_state().get(f"{PENDING_JOB_KEY_PREFIX}{cache_key}")
+
+
+def get_rehost_job(job_id: str) -> Optional[dict]:
+    """
+    Job status from shared state, else from the database.
+    None if unknown, and always None when the queue is disabled (no job can exist).
+    """
+    if not REHOST_QUEUE_ENABLED:
+        return None
+
+    job_status = get_job_status(job_id)
+    if job_status is not None:
+        return job_status
+
+    db = get_session()
+    try:
+        job = db.get(RehostJob, job_id)
+        return serialize_job(job) if job else None
+    finally:
+        db.close()
+
+
+def claim_due_jobs(limit: int = REHOST_BATCH_SIZE) -> List[dict]:
+    """
+    Claims up to `limit` jobs that are due (backoff over, or lease expired).
+
+    Each claim is a conditional UPDATE, so when several workers or replicas
+    poll at once, exactly one of them gets each job. Claimed jobs are mirrored
+    to shared state as "running", which is what GET /jobs/{id} reads first.
+    """
+    now = utc_now()
+    is_due = (RehostJob.status.in_(("pending", "running")), RehostJob.next_attempt_at <= now)
+
+    db = get_session()
+    try:
+        candidate_ids = db.scalars(
+            select(RehostJob.id).where(*is_due).order_by(RehostJob.next_attempt_at).limit(limit)
+        ).all()
+
+        claimed_jobs = []
+        for job_id in candidate_ids:
+            claim = db.execute(
+                update(RehostJob)
+                .where(RehostJob.id == job_id, *is_due)
+                .values(
+                    status="running",
+                    attempts=RehostJob.attempts + 1,
+                    next_attempt_at=now + timedelta(seconds=REHOST_LEASE_SECONDS)
+                )
+            )
+            db.commit()
+            if claim.rowcount != 1:
+                continue  # Another worker claimed it first
+            job = db.get(RehostJob, job_id)
+            set_job_status(job_id, serialize_job(job))
+            claimed_jobs.append({
+                "id": job.id,
+                "cache_key": job.cache_key,
+                "fal_result": job.fal_result,
+                "attempts": job.attempts
+            })
+        return claimed_jobs
+    finally:
+        db.close()
+
+
+def finish_job(job_id: str, result: Optional[dict] = None, error_message: Optional[str] = None) -> None:
+    """
+    Records the outcome of a claimed attempt: success caches the result;
+    failure schedules the next attempt with backoff, or gives up after
+    REHOST_MAX_ATTEMPTS.
+    """
+    db = get_session()
+    try:
+        job = db.get(RehostJob, job_id)
+        if result is not None:
+            job.status = "succeeded"
+            job.result = result
+            job.error_message = None
+        elif job.attempts >= REHOST_MAX_ATTEMPTS:
+            job.status = "failed"
+            job.error_message = error_message
+        else:
+            job.status = "pending"
+            job.next_attempt_at = utc_now() + timedelta(seconds=backoff_seconds(job.attempts))
+            job.error_message = error_message
+        db.commit()
+        job_status = serialize_job(job)
+        cache_key = job.cache_key
+    finally:
+        db.close()
+
+    set_job_status(job_id, job_status)
+    if job_status["status"] == "pending":
+        return
+    if result is not None and cache_key:
+        set_cache_entry(cache_key, result)
+    if cache_key:
+        get_shared_state().delete(f"{PENDING_JOB_KEY_PREFIX}{cache_key}")
+    logger.info("Rehost job finished", extra={"job_id": job_id, "status": job_status["status"]})
+
+
+async def process_due_jobs(rehost: RehostFunction) -> int:
+    """Claims due jobs and re-hosts them one by one; returns how many were attempted."""
+    jobs = await asyncio.to_thread(claim_due_jobs)
+    for job in jobs:
+        try:
+            with start_span("rehost.job", {"job.id": job["id"], "job.attempt": job["attempts"]}):
+                result = await rehost(job["fal_result"])
+        except Exception as e:
+            logger.warning("Rehost attempt failed", extra={"job_id": job["id"], "attempt": job["attempts"], "error": str(e)})
+            await asyncio.to_thread(finish_job, job["id"], error_message=str(e))
+            continue
+        await asyncio.to_thread(finish_job, job["id"], result=result)
+    return len(jobs)
+
+
+async def run_rehost_worker_forever(rehost: RehostFunction, interval_seconds: float = REHOST_POLL_INTERVAL_SECONDS) -> None:
+    """Polls for due jobs until cancelled (used as a lifespan task in every worker process)."""
+    while True:
+        try:
+            await process_due_jobs(rehost)
+        except Exception as e:
+            # Never let a database hiccup kill the background task
+            logger.warning("Rehost worker error", extra={"error": str(e)})
+        await asyncio.sleep(interval_seconds)
@@ -0,0 +1,229 @@
+"""
+Cross-request state behind one interface: locks (single-flight), small
+key/value markers and job status.
+
+Why: with several worker processes or replicas, anything kept in a Python
+dict is only visible to one of them. Code that needs state shared between
+requests goes through get_shared_state() instead of Redis or a dict directly.
+
+Backends (SHARED_STATE_BACKEND):
+- auto (default): Redis when connected, in-memory otherwise
+- redis: Redis; also moves the rate limiter to Redis (required for >1 worker)
+- memory: process-local only (single process, tests)
+
+Locks are owned: acquire_lock() returns a random token, and only that
+token can release or renew the lock. A holder whose lock expired (and was
+taken over) therefore cannot delete its successor's lock. Long-running
+holders keep their lock with keep_lock_alive() instead of relying on the
+TTL being longer than the work.
+
+The rate limiter storage is chosen from the same setting; see
+get_rate_limit_storage_uri().
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+SHARED_STATE_BACKEND = os.getenv("SHARED_STATE_BACKEND", "auto").lower()
+JOB_STATUS_KEY_PREFIX = "kontext_job:"
+
+# Compare-and-delete / compare-and-expire: atomic, so a lock that changed
+# owner between the check and the write is never touched
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+RENEW_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def new_lock_token() -> str:
+    return uuid.uuid4().hex
+
+
+class InMemorySharedState:
+    """
+    Process-local implementation with the same semantics as the Redis one
+    (NX locks, TTL expiry). Correct for a single process only.
+    """
+
+    name = "memory"
+
+    def __init__(self):
+        self._values = {}  # key -> (value, expires_at or None)
+        self._lock = threading.Lock()
+
+    def _get_unexpired(self, key: str):
+        entry = self._values.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and time.monotonic() >= expires_at:
+            del self._values[key]
+            return None
+        return value
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            return self._get_unexpired(key)
+
+    def set(self, key: str, value: str, ttl_seconds: Optional[int] = None) -> None:
+        with self._lock:
+            self._values[key] = (value, time.monotonic() + ttl_seconds if ttl_seconds else None)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._values.pop(key, None)
+
+    def acquire_lock(self, name: str, ttl_seconds: int) -> Optional[str]:
+        with self._lock:
+            if self._get_unexpired(name) is not None:
+                return None
+            token = new_lock_token()
+            self._values[name] = (token, time.monotonic() + ttl_seconds)
+            return token
+
+    def release_lock(self, name: str, token: str) -> bool:
+        with self._lock:
+            if self._get_unexpired(name) != token:
+                return False
+            del self._values[name]
+            return True
+
+    def renew_lock(self, name: str, token: str, ttl_seconds: int) -> bool:
+        with self._lock:
+            if self._get_unexpired(name) != token:
+                return False
+            self._values[name] = (token, time.monotonic() + ttl_seconds)
+            return True
+
+    def is_locked(self, name: str) -> bool:
+        return self.get(name) is not None
+
+
+class RedisSharedState:
+    """
+    Redis implementation, shared by every worker and replica.
+
+    Uses cache_service.redis_client (connected at startup). Like the cache,
+    Redis errors are logged and treated as "no value" / "lock not acquired".
+    """
+
+    name = "redis"
+
+    @staticmethod
+    def _client():
+        # Read on every call: the client is created at startup (and patched in tests)
+        from services import cache_service
+        return cache_service.redis_client
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            return self._client().get(key)
+        except Exception as e:
+            logger.warning("Shared state read error", extra={"key": key, "error": str(e)})
+            return None
+
+    def set(self, key: str, value: str, ttl_seconds: Optional[int] = None) -> None:
+        try:
+            self._client().set(key, value, ex=ttl_seconds)
+        except Exception as e:
+            logger.warning("Shared state write error", extra={"key": key, "error": str(e)})
+
+    def delete(self, key: str) -> None:
+        try:
+            self._client().delete(key)
+        except Exception as e:
+            logger.warning("Shared state delete error", extra={"key": key, "error": str(e)})
+
+    def acquire_lock(self, name: str, ttl_seconds: int) -> Optional[str]:
+        """SET NX EX: exactly one caller across all processes gets a token until release/expiry."""
+        token = new_lock_token()
+        try:
+            return token if self._client().set(name, token, nx=True, ex=ttl_seconds) else None
+        except Exception as e:
+            logger.warning("Shared state lock error", extra={"key": name, "error": str(e)})
+            return None
+
+    def release_lock(self, name: str, token: str) -> bool:
+        """Deletes the lock only if `token` still owns it (it may have expired and been re-acquired)."""
+        try:
+            return bool(self._client().eval(RELEASE_LOCK_SCRIPT, 1, name, token))
+        except Exception as e:
+            logger.warning("Shared state unlock error", extra={"key": name, "error": str(e)})
+            return False
+
+    def renew_lock(self, name: str, token: str, ttl_seconds: int) -> bool:
+        """Resets the lock's TTL; False if `token` no longer owns it."""
+        try:
+            return bool(self._client().eval(RENEW_LOCK_SCRIPT, 1, name, token, ttl_seconds))
+        except Exception as e:
+            logger.warning("Shared state lock renew error", extra={"key": name, "error": str(e)})
+            return False
+
+    def is_locked(self, name: str) -> bool:
+        return self.get(name) is not None
+
+
+_memory_state = InMemorySharedState()
+_redis_state = RedisSharedState()
+
+
+def get_shared_state():
+    """Returns the backend for this process (see SHARED_STATE_BACKEND)."""
+    from services import cache_service
+
+    if SHARED_STATE_BACKEND != "memory" and cache_service.redis_client is not None:
+        return _redis_state
+    return _memory_state
+
+
+async def keep_lock_alive(name: str, token: str, ttl_seconds: int) -> None:
+    """
+    Renews a held lock every third of its TTL until cancelled.
+
+    Run it as a task next to the work the lock protects, and cancel it
+    before releasing. The TTL then only bounds how long a crashed holder
+    blocks others, not how long the work may take. Stops (with a warning)
+    once the lock is lost, e.g. after a Redis outage longer than the TTL.
+    """
+    while True:
+        await asyncio.sleep(ttl_seconds / 3)
+        if not get_shared_state().renew_lock(name, token, ttl_seconds):
+            logger.warning("Lock lost while held", extra={"key": name})
+            return
+
+
+def get_rate_limit_storage_uri() -> str:
+    """
+    Storage for slowapi/limits. Decided at import (the limiter is built
+    before Redis is connected), so Redis is only used when explicitly
+    configured with SHARED_STATE_BACKEND=redis.
+    """
+    redis_url = os.getenv("REDIS_URL")
+    if SHARED_STATE_BACKEND == "redis" and redis_url:
+        return redis_url
+    return "memory://"
+
+
+def set_job_status(job_id: str, status: dict, ttl_seconds: int = 24 * 3600) -> None:
+    """Stores a job's status (any JSON-serializable dict) where every worker can read it."""
+    get_shared_state().set(f"{JOB_STATUS_KEY_PREFIX}{job_id}", json.dumps(status), ttl_seconds)
+
+
+def get_job_status(job_id: str) -> Optional[dict]:
+    stored = get_shared_state().get(f"{JOB_STATUS_KEY_PREFIX}{job_id}")
+    return json.loads(stored) if stored else None
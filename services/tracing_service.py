@@ -0,0 +1,359 @@
+"""
+Per-request tracing spans (OpenTelemetry-style, no SDK dependency).
+
+Why: a slow request is only debuggable if its timings can be tied to the
+fal job id and the storage objects it produced. Every stage of the pipeline
+runs inside a span; spans of one request share a trace id.
+
+Span tree for one /kontext request:
+    http.request
+      cache.lookup
+      input.fetch
+        download_image (one per retry attempt)
+      input.preprocess
+      input.upload
+      fal.generate
+        fal.submit (one per retry attempt, has fal.request_id)
+      outputs.rehost
+        output.image (one per generated image)
+      cache.store
+
+Exporters (TRACING_EXPORTER):
+- none (default): spans are still created so logs carry trace ids, nothing is exported
+- json: one JSON object per span appended to TRACING_FILE (local testing)
+- otlp: OTLP/HTTP JSON batches POSTed to OTLP_ENDPOINT/v1/traces (Jaeger, Tempo, collector)
+
+Export happens on a background thread so request code never waits on it.
+"""
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from typing import Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none").lower()
+TRACING_FILE = os.getenv("TRACING_FILE", "traces.jsonl")
+OTLP_ENDPOINT = os.getenv("OTLP_ENDPOINT", "http://localhost:4318")
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "fal-proxy-app")
+TRACING_BATCH_SIZE = 256
+TRACING_FLUSH_INTERVAL_SECONDS = 2.0
+
+REQUEST_ID_HEADER = "X-Request-ID"
+_VALID_REQUEST_ID = re.compile(r"^[A-Za-z0-9._:-]{1,128}$")
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+_request_id: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+_retry_attempt: contextvars.ContextVar[int] = contextvars.ContextVar("retry_attempt", default=1)
+
+
+class Span:
+    """One timed operation. Attributes are flat key/value pairs."""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_span_id", "start_time_ns", "end_time_ns",
+                 "attributes", "status", "status_message")
+
+    def __init__(self, name: str, trace_id: str, parent_span_id: Optional[str], attributes: dict):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_span_id = parent_span_id
+        self.start_time_ns = time.time_ns()
+        self.end_time_ns: Optional[int] = None
+        self.attributes = attributes
+        self.status = "UNSET"
+        self.status_message = ""
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def record_error(self, error: BaseException) -> None:
+        self.status = "ERROR"
+        self.status_message = f"{type(error).__name__}: {error}"
+
+    @property
+    def duration_ms(self) -> Optional[float]:
+        if self.end_time_ns is None:
+            return None
+        return (self.end_time_ns - self.start_time_ns) / 1_000_000
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_span_id,
+            "start_time_unix_nano": self.start_time_ns,
+            "end_time_unix_nano": self.end_time_ns,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "status_message": self.status_message,
+            "attributes": self.attributes
+        }
+
+
+# ============================================================================
+# Exporters
+# ============================================================================
+
+class JsonFileExporter:
+    """Appends one JSON line per span to a file."""
+
+    def __init__(self, path: str = TRACING_FILE):
+        self.path = path
+
+    def export(self, spans: list) -> None:
+        with open(self.path, "a", encoding="utf-8") as trace_file:
+            for span in spans:
+                trace_file.write(json.dumps(span.to_dict(), default=str) + "\n")
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OtlpHttpExporter:
+    """Sends spans as OTLP/HTTP JSON (the format every OpenTelemetry collector accepts)."""
+
+    def __init__(self, endpoint: str = OTLP_ENDPOINT, service_name: str = TRACING_SERVICE_NAME):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.service_name = service_name
+        self.client = httpx.Client(timeout=5.0)
+
+    def to_otlp(self, spans: list) -> dict:
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": _otlp_value(self.service_name)}]},
+                "scopeSpans": [{
+                    "scope": {"name": "fal-proxy-app"},
+                    "spans": [{
+                        "traceId": span.trace_id,
+                        "spanId": span.span_id,
+                        "parentSpanId": span.parent_span_id or "",
+                        "name": span.name,
+                        "kind": 1,
+                        "startTimeUnixNano": str(span.start_time_ns),
+                        "endTimeUnixNano": str(span.end_time_ns),
+                        "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+                        "status": {"code": 2 if span.status == "ERROR" else 0, "message": span.status_message}
+                    } for span in spans]
+                }]
+            }]
+        }
+
+    def export(self, spans: list) -> None:
+        response = self.client.post(self.url, json=self.to_otlp(spans))
+        response.raise_for_status()
+
+
+class BatchSpanProcessor:
+    """
+    Queues finished spans and exports them in batches from a daemon thread.
+    Ending a span is just a queue put, so the event loop never does export I/O.
+    """
+
+    def __init__(self, exporter, batch_size: int = TRACING_BATCH_SIZE,
+                 flush_interval_seconds: float = TRACING_FLUSH_INTERVAL_SECONDS):
+        self.exporter = exporter
+        self.batch_size = batch_size
+        self.flush_interval_seconds = flush_interval_seconds
+        self._queue = queue.SimpleQueue()
+        self._flush_requested = threading.Event()
+        self._flushed = threading.Condition()
+        self._drains_started = 0
+        self._drains_completed = 0
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+        self._thread.start()
+
+    def on_end(self, span: Span) -> None:
+        self._queue.put(span)
+        if self._queue.qsize() >= self.batch_size:
+            self._flush_requested.set()
+
+    def _drain(self) -> None:
+        spans = []
+        while True:
+            try:
+                spans.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if spans:
+            try:
+                self.exporter.export(spans)
+            except Exception as e:
+                logger.warning("Span export failed", extra={"error": str(e), "dropped_spans": len(spans)})
+
+    def _run(self) -> None:
+        while not self._stopped:
+            self._flush_requested.wait(self.flush_interval_seconds)
+            self._flush_requested.clear()
+            with self._flushed:
+                self._drains_started += 1
+            self._drain()
+            with self._flushed:
+                self._drains_completed += 1
+                self._flushed.notify_all()
+
+    def force_flush(self, timeout_seconds: float = 5.0) -> None:
+        """Exports everything queued so far (used at shutdown and in tests)."""
+        with self._flushed:
+            # Wait for a drain that starts after this call, not one already in progress
+            target_drain = self._drains_started + 1
+            self._flush_requested.set()
+            self._flushed.wait_for(lambda: self._drains_completed >= target_drain, timeout_seconds)
+
+    def shutdown(self) -> None:
+        """Exports what is queued and stops the export thread."""
+        self._stopped = True
+        self.force_flush()
+
+
+def _create_exporter(name: str):
+    if name == "json":
+        return JsonFileExporter()
+    if name == "otlp":
+        return OtlpHttpExporter()
+    return None
+
+
+_span_processor: Optional[BatchSpanProcessor] = None
+
+
+def set_exporter(exporter) -> None:
+    """Installs an exporter (None disables export). Exporters need one method: export(spans)."""
+    global _span_processor
+    if _span_processor is not None:
+        _span_processor.shutdown()
+    _span_processor = BatchSpanProcessor(exporter) if exporter is not None else None
+
+
+def flush_spans() -> None:
+    if _span_processor is not None:
+        _span_processor.force_flush()
+
+
+def configure_tracing() -> None:
+    """Installs the exporter selected by TRACING_EXPORTER (called from the app lifespan)."""
+    if _span_processor is None:
+        set_exporter(_create_exporter(TRACING_EXPORTER))
+
+
+# ============================================================================
+# Span API
+# ============================================================================
+
+@contextlib.contextmanager
+def start_span(name: str, attributes: Optional[dict] = None, trace_id: Optional[str] = None,
+               parent_span_id: Optional[str] = None):
+    """
+    Runs the block inside a child span of the current span.
+
+    Works across awaits: the current span lives in a contextvar, which
+    asyncio copies per task, so concurrent requests don't mix spans.
+    Exceptions mark the span as ERROR and are re-raised.
+    """
+    parent = _current_span.get()
+    if trace_id is None:
+        trace_id = parent.trace_id if parent else secrets.token_hex(16)
+        parent_span_id = parent.span_id if parent else None
+
+    span = Span(name, trace_id, parent_span_id, dict(attributes or {}))
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.record_error(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end_time_ns = time.time_ns()
+        if span.status == "UNSET":
+            span.status = "OK"
+        if _span_processor is not None:
+            _span_processor.on_end(span)
+
+
+def get_current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def set_span_attribute(key: str, value) -> None:
+    """Sets an attribute on the current span, if any (safe to call outside a request)."""
+    span = _current_span.get()
+    if span is not None:
+        span.set_attribute(key, value)
+
+
+def record_retry_attempt(retry_state) -> None:
+    """
+    tenacity `before` hook: exposes the attempt number to the retried function.
+    Usage: @retry(..., before=record_retry_attempt), then current_retry_attempt() inside.
+    """
+    _retry_attempt.set(retry_state.attempt_number)
+
+
+def current_retry_attempt() -> int:
+    return _retry_attempt.get()
+
+
+# ============================================================================
+# Request ids
+# ============================================================================
+
+def resolve_request_id(incoming: Optional[str]) -> str:
+    """Keeps a caller-supplied request id if it is sane, otherwise makes a new one."""
+    if incoming and _VALID_REQUEST_ID.match(incoming):
+        return incoming
+    return secrets.token_hex(16)
+
+
+def parse_traceparent(header: Optional[str]) -> tuple:
+    """Returns (trace_id, parent_span_id) from a W3C traceparent header, or (None, None)."""
+    match = _TRACEPARENT.match(header or "")
+    return (match.group(1), match.group(2)) if match else (None, None)
+
+
+def format_traceparent(span: Span) -> str:
+    return f"00-{span.trace_id}-{span.span_id}-01"
+
+
+def set_request_id(request_id: Optional[str]) -> contextvars.Token:
+    return _request_id.set(request_id)
+
+
+def reset_request_id(token: contextvars.Token) -> None:
+    _request_id.reset(token)
+
+
+def get_request_id() -> Optional[str]:
+    return _request_id.get()
+
+
+def get_log_context() -> dict:
+    """Ids added to every log line so logs can be joined with traces."""
+    context = {}
+    request_id = _request_id.get()
+    if request_id:
+        context["request_id"] = request_id
+    span = _current_span.get()
+    if span is not None:
+        context["trace_id"] = span.trace_id
+        context["span_id"] = span.span_id
+    return context
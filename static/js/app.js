@@ -247,12 +247,17 @@ document.addEventListener('DOMContentLoaded', () => {
                 body: JSON.stringify(requestBody)
             });
 
-            const data = await response.json();
+            let data = await response.json();
 
             if (!response.ok) {
                 throw new Error(data.detail || 'Something went wrong');
             }
 
+            // 202: the images were generated but are still being saved; poll the job
+            if (response.status === 202) {
+                data = await waitForJob(data.status_url);
+            }
+
             // Display results
             displayResults(data);
 
@@ -263,6 +268,27 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
+    // Poll a queued job until its result is ready (or it failed)
+    async function waitForJob(statusUrl) {
+        const pollIntervalMs = 3000;
+        const maxPolls = 200;
+        for (let poll = 0; poll < maxPolls; poll++) {
+            await new Promise(resolve => setTimeout(resolve, pollIntervalMs));
+            const jobResponse = await fetch(statusUrl);
+            if (!jobResponse.ok) {
+                continue;
+            }
+            const job = await jobResponse.json();
+            if (job.status === 'succeeded') {
+                return job.result;
+            }
+            if (job.status === 'failed') {
+                throw new Error('Your images were generated but could not be saved. Please try again.');
+            }
+        }
+        throw new Error('Saving your images is taking longer than expected. Please try again later.');
+    }
+
     function setLoadingState(isLoading) {
         if (isLoading) {
             submitBtn.disabled = true;
@@ -375,16 +401,38 @@ document.addEventListener('DOMContentLoaded', () => {
                 const wrapper = document.createElement('div');
                 wrapper.className = 'image-wrapper';
 
+                // Show the medium preview (AVIF/WebP) instead of the multi-MB original,
+                // and link the preview to the full-size image
+                const picture = document.createElement('picture');
+                const preview = image.variants && image.variants.medium;
+                if (preview) {
+                    ['avif', 'webp'].forEach(format => {
+                        if (preview[format]) {
+                            const source = document.createElement('source');
+                            source.srcset = preview[format];
+                            source.type = `image/${format}`;
+                            picture.appendChild(source);
+                        }
+                    });
+                }
+
                 const img = document.createElement('img');
                 img.src = image.url;
                 img.alt = `Generated image ${index + 1}`;
                 img.loading = 'lazy';
+                picture.appendChild(img);
+
+                const link = document.createElement('a');
+                link.href = image.url;
+                link.target = '_blank';
+                link.rel = 'noopener';
+                link.appendChild(picture);
 
                 const info = document.createElement('div');
                 info.className = 'image-info';
                 info.textContent = `${image.width} × ${image.height}`;
 
-                wrapper.appendChild(img);
+                wrapper.appendChild(link);
                 wrapper.appendChild(info);
                 imageContainer.appendChild(wrapper);
             });
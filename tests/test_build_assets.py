@@ -0,0 +1,69 @@
+import json
+import os
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from build_assets import build, minify_css
+from services.http_service import CachedStaticFiles
+
+
+def test_build_fingerprints_and_rewrites_references(tmp_path):
+    """
+    Verify assets get content-hashed names, index.html points at them, and .gz/.br siblings exist.
+    Why: Immutable caching is only safe if every change produces a new URL that the page references.
+    """
+    report = build("static", str(tmp_path))
+    manifest = json.loads((tmp_path / "manifest.json").read_text())
+    index_html = (tmp_path / "index.html").read_text()
+
+    assert manifest["css/style.css"] == report["css/style.css"]["path"]
+    assert f'/assets/{manifest["css/style.css"]}' in index_html
+    assert f'/assets/{manifest["js/app.js"]}' in index_html
+    assert "/static/" not in index_html
+    for built_path in manifest.values():
+        for suffix in ("", ".gz", ".br"):
+            assert os.path.exists(tmp_path / "assets" / f"{built_path}{suffix}")
+
+
+def test_css_minifier_keeps_strings():
+    """
+    Verify the CSS minifier removes comments/whitespace but leaves quoted strings alone.
+    Why: Font names and content strings must survive minification byte for byte.
+    """
+    source = "/* header */\nbody {\n    font-family: 'Segoe UI', Arial;\n    margin : 0 ;\n}\n"
+
+    assert minify_css(source) == "body{font-family:'Segoe UI',Arial;margin :0}"
+
+
+def test_built_assets_served_precompressed_and_immutable(tmp_path):
+    """
+    Verify fingerprinted assets come back brotli-encoded with an immutable Cache-Control.
+    Why: Browsers then load them once per version, at the smallest size.
+    """
+    manifest = build("static", str(tmp_path))
+    app = FastAPI()
+    app.mount("/assets", CachedStaticFiles(directory=str(tmp_path / "assets"), immutable=True))
+
+    response = TestClient(app).get(f'/assets/{manifest["js/app.js"]["path"]}', headers={"Accept-Encoding": "br"})
+
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "br"
+    assert "immutable" in response.headers["cache-control"]
+    assert response.headers["content-type"].startswith(("application/javascript", "text/javascript"))
+    assert int(response.headers["content-length"]) == manifest["js/app.js"]["bytes"]["br"]
+
+
+def test_index_page_is_revalidated():
+    """
+    Verify / is served with no-cache and answers 304 to a matching If-None-Match.
+    Why: The page must pick up a new build immediately, but an unchanged page should cost no body bytes.
+    """
+    os.environ.setdefault('DATABASE_URL', 'sqlite:///:memory:')
+    from main import app
+
+    client = TestClient(app)
+    first_response = client.get("/")
+    repeat_response = client.get("/", headers={"If-None-Match": first_response.headers["etag"]})
+
+    assert first_response.headers["cache-control"] == "no-cache"
+    assert repeat_response.status_code == 304
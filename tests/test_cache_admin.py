@@ -0,0 +1,155 @@
+import json
+import os
+import time
+import fakeredis
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+
+# Use SQLite in-memory database for tests
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from services import cache_service
+from services.cache_admin import get_cache_stats, purge_cache, export_cache, import_cache
+from services.cache_service import (
+    generate_unique_request_key,
+    get_legacy_cache_key,
+    get_cache_entry,
+    set_cache_entry,
+    parse_cache_key,
+    get_result_id,
+    get_cache_key_for_result_id
+)
+
+KONTEXT = "fal-ai/flux-pro/kontext"
+KONTEXT_MAX = "fal-ai/flux-pro/kontext/max"
+RESULT = {"images": [{"url": "https://storage.example.com/out.jpg"}], "prompt": "make it blue"}
+
+
+def cache_key(image_number: int, model_path: str = KONTEXT) -> str:
+    return generate_unique_request_key(f"https://example.com/{image_number}.jpg", "make it blue", model_path)
+
+
+def test_keys_embed_model_and_version_and_legacy_entries_migrate_on_read():
+    """
+    Verify keys carry model and version, a version bump changes them, and a legacy key is moved on its first hit.
+    Why: Per-model SCAN/purge needs the model in the key, and upgrading must not turn the existing cache into misses.
+    """
+    key = cache_key(1)
+    assert parse_cache_key(key)["model"] == KONTEXT and parse_cache_key(key)["version"] == 1
+    assert parse_cache_key(f"{key}:refreshing") is None
+    assert get_cache_key_for_result_id(get_result_id(key)) == key
+    with patch.dict("services.cache_service.CACHE_MODEL_VERSIONS", {KONTEXT: 2}):
+        assert parse_cache_key(cache_key(1))["version"] == 2
+
+    fake_redis = fakeredis.FakeRedis(decode_responses=True)
+    legacy_key = get_legacy_cache_key(key)
+    fake_redis.set(legacy_key, json.dumps({"response": RESULT, "fresh_until": time.time() + 100}), ex=500)
+    with patch("services.cache_service.redis_client", fake_redis):
+        assert get_cache_entry(key) == (RESULT, False)
+
+    assert not fake_redis.exists(legacy_key)
+    assert 0 < fake_redis.ttl(key) <= 500
+
+
+def test_result_ids_issued_before_the_key_change_still_resolve():
+    """
+    Verify a bare-hash result id finds its entry both before and after the entry moved to the new key.
+    Why: Clients keep the Content-Location ids they were given; a key layout change must not turn them into 404s.
+    """
+    key = cache_key(1)
+    legacy_result_id = parse_cache_key(key)["hash"]
+    fake_redis = fakeredis.FakeRedis(decode_responses=True)
+    fake_redis.set(get_legacy_cache_key(key), json.dumps({"response": RESULT, "fresh_until": time.time() + 100}), ex=500)
+
+    client = TestClient(app)
+    with patch("services.cache_service.redis_client", fake_redis):
+        before_move = client.get(f"/results/{legacy_result_id}")
+        get_cache_entry(key)  # First read through the new key moves the entry
+        after_move = client.get(f"/results/{legacy_result_id}")
+        unknown = client.get(f"/results/{'0' * 64}")
+
+    assert before_move.status_code == 200 and before_move.json() == RESULT
+    assert after_move.status_code == 200 and after_move.json() == RESULT
+    assert unknown.status_code == 404
+
+
+def test_stats_group_entries_by_model_version_and_legacy():
+    """
+    Verify one SCAN walk counts entries and stale entries per model/version, reports legacy keys apart, and ignores lock keys.
+    Why: This is what tells an operator which model fills the cache; a second full walk doubles the load on Redis.
+    """
+    fake_redis = fakeredis.FakeRedis(decode_responses=True)
+    with patch("services.cache_service.redis_client", fake_redis):
+        set_cache_entry(cache_key(1), RESULT)
+        set_cache_entry(cache_key(2), RESULT, expiration_seconds=0)  # Only the stale window left
+        set_cache_entry(cache_key(3, KONTEXT_MAX), RESULT)
+        fake_redis.set(f"{cache_key(1)}:refreshing", "1")
+        fake_redis.set(get_legacy_cache_key(cache_key(4)), json.dumps(RESULT), ex=60)  # Old plain-JSON value
+        with patch("services.cache_admin.SCAN_BATCH_SIZE", 2), \
+             patch.object(fake_redis, "scan", wraps=fake_redis.scan) as scan_calls:
+            stats = get_cache_stats()
+
+    assert stats["models"][KONTEXT]["entries"] == 2
+    assert stats["models"][KONTEXT]["stale_entries"] == 1
+    assert stats["models"][KONTEXT]["versions"]["1"]["entries"] == 2
+    assert stats["models"][KONTEXT_MAX]["entries"] == 1
+    assert stats["legacy"]["entries"] == 1
+    assert "stale_entries" not in stats["legacy"]  # No fresh_until envelope: neither fresh nor stale
+    assert stats["total"]["entries"] == 4
+    assert stats["total"]["stale_entries"] == 1
+    assert all(call.kwargs["match"] == "kontext_cache:*" for call in scan_calls.call_args_list)
+    assert [call.kwargs["cursor"] for call in scan_calls.call_args_list].count(0) == 1
+    assert stats["total"]["value_bytes"] > 0
+
+
+def test_purge_by_model_version_and_age():
+    """
+    Verify purge deletes only the entries matching every filter, and dry_run deletes nothing.
+    Why: Invalidating one model after an upstream update must not wipe the other models' paid results.
+    """
+    fake_redis = fakeredis.FakeRedis(decode_responses=True)
+    with patch("services.cache_service.redis_client", fake_redis):
+        set_cache_entry(cache_key(1), RESULT)
+        set_cache_entry(cache_key(2, KONTEXT_MAX), RESULT)
+        with patch("services.cache_service.time.time", return_value=time.time() - 7200):
+            set_cache_entry(cache_key(3, KONTEXT_MAX), RESULT, expiration_seconds=10000)
+
+        assert purge_cache(model=KONTEXT, dry_run=True) == {"matched": 1, "deleted": 0}
+        assert purge_cache(model=KONTEXT, version=2) == {"matched": 0, "deleted": 0}
+        assert purge_cache(older_than_seconds=3600) == {"matched": 1, "deleted": 1}
+        assert purge_cache(model=KONTEXT, version=1) == {"matched": 1, "deleted": 1}
+
+    assert fake_redis.keys("kontext_cache:*") == [cache_key(2, KONTEXT_MAX)]
+
+
+def test_export_import_round_trip_and_admin_api_requires_token():
+    """
+    Verify a snapshot restores keys, values and expiry without overwriting newer entries, and /admin needs the token.
+    Why: Snapshots pre-fill a new Redis; the admin API can delete the whole cache, so it must not be open.
+    """
+    source_redis = fakeredis.FakeRedis(decode_responses=True)
+    with patch("services.cache_service.redis_client", source_redis):
+        set_cache_entry(cache_key(1), RESULT)
+        set_cache_entry(cache_key(2), RESULT)
+        snapshot = list(export_cache())
+
+    target_redis = fakeredis.FakeRedis(decode_responses=True)
+    target_redis.set(cache_key(2), "newer")
+    with patch("services.cache_service.redis_client", target_redis):
+        summary = import_cache(snapshot + ['{"key": "other:key", "value": "x"}\n'])
+
+    assert summary == {"imported": 1, "skipped_existing": 1, "skipped_expired": 0, "invalid": 1}
+    assert target_redis.get(cache_key(1)) == source_redis.get(cache_key(1))
+    assert target_redis.get(cache_key(2)) == "newer"
+    assert target_redis.ttl(cache_key(1)) > cache_service.CACHE_TTL_SECONDS
+
+    client = TestClient(app)
+    with patch("services.cache_service.redis_client", target_redis):
+        assert client.get("/admin/cache/stats").status_code == 404
+        with patch("main.ADMIN_TOKEN", "secret"):
+            assert client.get("/admin/cache/stats", headers={"Authorization": "Bearer wrong"}).status_code == 401
+            response = client.get("/admin/cache/stats", headers={"Authorization": "Bearer secret"})
+
+    assert response.status_code == 200
+    assert response.json()["models"][KONTEXT]["entries"] == 2
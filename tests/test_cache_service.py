@@ -1,6 +1,16 @@
 import pytest
+import json
+import time
 from unittest.mock import patch, MagicMock
-from services.cache_service import generate_unique_request_key, retrieve_cached_response, store_response_in_cache
+from services.cache_service import (
+    generate_unique_request_key,
+    retrieve_cached_response,
+    store_response_in_cache,
+    get_cache_entry,
+    retrieve_negative_result,
+    store_negative_result,
+    parse_cache_model_versions
+)
 
 
 def test_cache_key_includes_model_path():
@@ -42,4 +52,78 @@ def test_store_handles_redis_disabled():
     """
     with patch("services.cache_service.redis_client", None):
         result = store_response_in_cache("url", "prompt", "model", {"data": "test"})
-        assert result is None
\ No newline at end of file
+        assert result is None
+
+
+def test_cache_entry_marked_stale_after_soft_ttl():
+    """
+    Verify entries past their soft TTL are still returned but flagged stale.
+    Why: Stale-while-revalidate serves old data instantly while one refresh runs.
+    """
+    mock_redis = MagicMock()
+    mock_redis.get.return_value = json.dumps({"response": {"images": []}, "fresh_until": time.time() - 10})
+
+    with patch("services.cache_service.redis_client", mock_redis):
+        response_data, is_stale = get_cache_entry("kontext_cache:abc")
+
+    assert response_data == {"images": []}
+    assert is_stale is True
+
+
+def test_cache_entry_without_envelope_is_fresh():
+    """
+    Verify entries written before soft TTLs existed are served as fresh.
+    Why: Deploying the new format must not invalidate the existing cache.
+    """
+    mock_redis = MagicMock()
+    mock_redis.get.return_value = json.dumps({"images": [], "prompt": "p"})
+
+    with patch("services.cache_service.redis_client", mock_redis):
+        response_data, is_stale = get_cache_entry("kontext_cache:abc")
+
+    assert response_data == {"images": [], "prompt": "p"}
+    assert is_stale is False
+
+
+def test_store_keeps_entry_for_stale_window():
+    """
+    Verify Redis keeps entries longer than their fresh period.
+    Why: Without a stale window there is nothing to serve during a refresh.
+    """
+    mock_redis = MagicMock()
+
+    with patch("services.cache_service.redis_client", mock_redis), \
+         patch("services.cache_service.CACHE_STALE_WINDOW_SECONDS", 600):
+        store_response_in_cache("url", "prompt", "model", {"images": []}, expiration_seconds=60)
+
+    _, redis_ttl, _ = mock_redis.setex.call_args[0]
+    assert redis_ttl == 660
+
+
+def test_negative_cache_roundtrip():
+    """
+    Verify known-bad URLs are remembered with a short TTL.
+    Why: Repeated bad requests should be rejected without downloading again.
+    """
+    stored = {}
+    mock_redis = MagicMock()
+    mock_redis.setex.side_effect = lambda key, ttl, value: stored.update({key: value})
+    mock_redis.get.side_effect = lambda key: stored.get(key)
+
+    with patch("services.cache_service.redis_client", mock_redis):
+        assert retrieve_negative_result("https://example.com/missing.jpg") is None
+        store_negative_result("https://example.com/missing.jpg", "Image URL returned HTTP 404.")
+        assert retrieve_negative_result("https://example.com/missing.jpg") == "Image URL returned HTTP 404."
+
+
+def test_malformed_model_versions_fail_with_the_setting_name():
+    """
+    Verify a bad CACHE_MODEL_VERSIONS item raises a ValueError naming the setting, and valid ones parse.
+    Why: A bare int() at import crashed every worker with an error that did not say which variable was wrong.
+    """
+    assert parse_cache_model_versions(" fal-ai/flux-pro/kontext=2, fal-ai/flux-kontext/dev=3,") == {
+        "fal-ai/flux-pro/kontext": 2, "fal-ai/flux-kontext/dev": 3
+    }
+    for bad_setting in ("fal-ai/flux-pro/kontext=v2", "fal-ai/flux-pro/kontext", "=2"):
+        with pytest.raises(ValueError, match="CACHE_MODEL_VERSIONS"):
+            parse_cache_model_versions(bad_setting)
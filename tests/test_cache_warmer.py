@@ -0,0 +1,145 @@
+import asyncio
+import pytest
+from unittest.mock import patch, MagicMock, AsyncMock
+import fakeredis
+import json
+import os
+import time
+
+# Use SQLite in-memory database for tests (the warmer imports the history service)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from services.cache_warmer import warm_cache
+
+
+MODEL_PATHS = {"/kontext": "fal-ai/flux-pro/kontext"}
+
+
+class FakeFal:
+    """Stands in for the real generation pipeline and counts paid calls."""
+
+    def __init__(self):
+        self.calls = []
+
+    async def generate(self, image_url, prompt, model_path, params):
+        self.calls.append((image_url, prompt, model_path))
+        return {"images": [{"url": "https://fake-url.com/out.jpg"}], "prompt": prompt}
+
+
+def popular(*urls):
+    return [
+        {"endpoint": "/kontext", "input_image_url": url, "prompt": "cartoon", "params": {}, "count": 10}
+        for url in urls
+    ]
+
+
+@pytest.mark.asyncio
+async def test_warmer_refreshes_only_expiring_entries():
+    """
+    Verify the warmer regenerates entries close to expiry and skips fresh ones.
+    Why: Refreshing fresh entries would waste fal.ai budget for no benefit.
+    """
+    fake_fal = FakeFal()
+    mock_redis = MagicMock()
+    # First entry goes stale in 30s (refresh), second has an hour left (skip)
+    mock_redis.get.side_effect = [
+        json.dumps({"response": {"images": []}, "fresh_until": time.time() + 30}),
+        json.dumps({"response": {"images": []}, "fresh_until": time.time() + 3600})
+    ]
+
+    with patch("services.cache_service.redis_client", mock_redis), \
+         patch("services.cache_warmer.get_popular_requests", return_value=popular("https://a.com/1.jpg", "https://a.com/2.jpg")):
+        summary = await warm_cache(fake_fal.generate, MODEL_PATHS, budget_usd=1.0)
+
+    assert fake_fal.calls == [("https://a.com/1.jpg", "cartoon", "fal-ai/flux-pro/kontext")]
+    assert summary["refreshed"] == 1
+    assert summary["skipped_fresh"] == 1
+    mock_redis.setex.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_warmer_stops_at_budget_cap():
+    """
+    Verify the warmer never exceeds its fal.ai budget.
+    Why: Background jobs must not be able to drain the API budget.
+    """
+    fake_fal = FakeFal()
+    mock_redis = MagicMock()
+    mock_redis.get.return_value = None  # Missing entries
+
+    urls = [f"https://a.com/{i}.jpg" for i in range(10)]
+    with patch("services.cache_service.redis_client", mock_redis), \
+         patch("services.cache_warmer.get_popular_requests", return_value=popular(*urls)):
+        # kontext costs 0.04 per image, so only 2 refreshes fit in 0.1
+        summary = await warm_cache(fake_fal.generate, MODEL_PATHS, budget_usd=0.1)
+
+    assert len(fake_fal.calls) == 2
+    assert summary["budget_exhausted"] is True
+    assert summary["spent_usd"] <= 0.1
+
+
+@pytest.mark.asyncio
+async def test_warmer_skips_when_redis_disabled():
+    """
+    Verify the warmer does nothing when the cache is unavailable.
+    Why: Generating results that cannot be cached only costs money.
+    """
+    fake_fal = FakeFal()
+
+    with patch("services.cache_service.redis_client", None):
+        summary = await warm_cache(fake_fal.generate, MODEL_PATHS)
+
+    assert fake_fal.calls == []
+    assert summary["refreshed"] == 0
+
+
+@pytest.mark.asyncio
+async def test_concurrent_passes_spend_the_budget_once():
+    """
+    Verify two passes started at once (two workers/replicas) only run one of them.
+    Why: Every process runs the lifespan task; unguarded, the budget is spent once per process.
+    """
+    fake_fal = FakeFal()
+    original_generate = fake_fal.generate
+
+    async def slow_generate(*args):
+        await asyncio.sleep(0.05)
+        return await original_generate(*args)
+
+    with patch("services.cache_service.redis_client", fakeredis.FakeRedis(decode_responses=True)), \
+         patch("services.cache_warmer.get_popular_requests", return_value=popular("https://a.com/1.jpg")):
+        summaries = await asyncio.gather(
+            warm_cache(slow_generate, MODEL_PATHS, budget_usd=1.0),
+            warm_cache(slow_generate, MODEL_PATHS, budget_usd=1.0)
+        )
+
+    assert len(fake_fal.calls) == 1
+    assert sorted(summary["already_running"] for summary in summaries) == [False, True]
+
+
+@pytest.mark.asyncio
+async def test_warmer_replays_the_original_params_and_budgets_for_them():
+    """
+    Verify a refresh replays the row's params (num_images, aspect_ratio), budgets for its image count, and runs once per entry.
+    Why: The cache key ignores params; a default one-image replay would replace a 4-image 16:9 result users never asked to change.
+    """
+    from main import generate_for_cache_warmer
+
+    params = {"num_images": 4, "aspect_ratio": "16:9"}
+    candidates = [
+        {"endpoint": "/kontext", "input_image_url": "https://a.com/1.jpg", "prompt": "cartoon", "params": params, "count": 10},
+        {"endpoint": "/kontext", "input_image_url": "https://a.com/1.jpg", "prompt": "cartoon", "params": {}, "count": 3}
+    ]
+    four_images = {"images": [{"url": f"https://fake-url.com/{i}.jpg"} for i in range(4)], "prompt": "cartoon"}
+
+    with patch("services.cache_service.redis_client", fakeredis.FakeRedis(decode_responses=True)), \
+         patch("services.cache_warmer.get_popular_requests", return_value=candidates), \
+         patch("main.run_kontext_pipeline", new_callable=AsyncMock, return_value=four_images) as mock_pipeline:
+        too_small = await warm_cache(generate_for_cache_warmer, MODEL_PATHS, budget_usd=0.1)
+        summary = await warm_cache(generate_for_cache_warmer, MODEL_PATHS, budget_usd=1.0)
+
+    assert too_small["budget_exhausted"] is True and too_small["spent_usd"] == 0
+    assert mock_pipeline.call_count == 1
+    replayed_request = mock_pipeline.call_args.args[0]
+    assert (replayed_request.num_images, replayed_request.aspect_ratio) == (4, "16:9")
+    assert summary["refreshed"] == 1 and summary["spent_usd"] == pytest.approx(0.16)
@@ -0,0 +1,122 @@
+import asyncio
+import collections
+import io
+import fakeredis
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, AsyncMock
+from PIL import Image
+from services.derivative_service import (
+    save_generated_image,
+    get_or_create_derivative,
+    remember_derivative_url,
+    get_remembered_derivative_url
+)
+from services.image_transforms import render_derivatives
+
+
+def make_png(width, height):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (10, 120, 200)).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+async def fake_save_image(image_bytes, filename=None, content_type="image/jpeg"):
+    return f"https://storage.example.com/{filename}"
+
+
+def test_render_derivatives_respects_max_edges():
+    """
+    Verify each variant is scaled to its max edge and encoded as WebP.
+    Why: Previews must be small enough to replace the multi-MB originals in the UI.
+    """
+    rendered = render_derivatives(make_png(2048, 1024), ["thumbnail", "medium"], ["webp"])
+
+    sizes = {item["size"]: (item["width"], item["height"]) for item in rendered}
+    assert sizes == {"thumbnail": (256, 128), "medium": (1024, 512)}
+    assert all(item["bytes"].startswith(b"RIFF") for item in rendered)
+
+
+@pytest.mark.asyncio
+async def test_eager_mode_uploads_variants_next_to_original():
+    """
+    Verify eager mode uploads WebP variants beside the original and leaves AVIF deferred.
+    Why: Clients need the variant URLs in the same response, but AVIF encoding is too slow for the response path.
+    """
+    with patch("services.derivative_service.save_image", side_effect=fake_save_image) as mock_save, \
+         patch("services.executor_service.get_process_pool", return_value=ThreadPoolExecutor(1)), \
+         patch("services.derivative_service.get_supported_formats", return_value=["webp", "avif"]):
+        result = await save_generated_image(make_png(1600, 1200), mode="eager")
+
+    image_id = result["url"].rsplit("/", 1)[1]
+    assert result["variants"]["thumbnail"]["webp"].endswith(f"{image_id}_thumbnail.webp")
+    assert result["variants"]["thumbnail"]["avif"] == f"/images/{image_id}/thumbnail.avif"
+    assert result["variants"]["medium"]["width"] == 1024
+    assert mock_save.call_count == 3  # Original + two WebP variants, no AVIF
+
+
+@pytest.mark.asyncio
+async def test_deferred_mode_only_uploads_original():
+    """
+    Verify deferred mode skips rendering and links to the on-demand endpoint, with the variants' dimensions.
+    Why: Deferring saves CPU and storage for images nobody previews; clients still need sizes for layout.
+    """
+    with patch("services.derivative_service.save_image", new_callable=AsyncMock) as mock_save:
+        mock_save.return_value = "https://storage.example.com/original"
+        result = await save_generated_image(make_png(600, 400), mode="deferred")
+
+    mock_save.assert_called_once()
+    assert result["variants"]["thumbnail"]["webp"].startswith("/images/")
+    assert (result["variants"]["thumbnail"]["width"], result["variants"]["thumbnail"]["height"]) == (256, 171)
+    assert (result["variants"]["medium"]["width"], result["variants"]["medium"]["height"]) == (600, 400)
+
+
+def test_local_derivative_urls_are_bounded():
+    """
+    Verify the per-process URL memo evicts the least recently used entries.
+    Why: Every deferred variant ever served would otherwise stay in memory for the life of the worker.
+    """
+    with patch("services.derivative_service._local_derivative_urls", collections.OrderedDict()), \
+         patch("services.derivative_service.DERIVATIVE_URL_MEMO_MAX_ENTRIES", 2):
+        remember_derivative_url("a.webp", "https://storage.example.com/a.webp")
+        remember_derivative_url("b.webp", "https://storage.example.com/b.webp")
+        get_remembered_derivative_url("a.webp")
+        remember_derivative_url("c.webp", "https://storage.example.com/c.webp")
+
+        assert get_remembered_derivative_url("b.webp") is None
+        assert get_remembered_derivative_url("a.webp") == "https://storage.example.com/a.webp"
+
+
+@pytest.mark.asyncio
+async def test_unknown_variant_is_rejected():
+    """
+    Verify only known sizes/formats can be requested on demand.
+    Why: The endpoint must not render arbitrary sizes for arbitrary paths.
+    """
+    with pytest.raises(ValueError):
+        await get_or_create_derivative("8b6f7c1e-4a1d-4a8e-9b1a-3f2f0e6d5c4b", "huge.bmp")
+
+
+@pytest.mark.asyncio
+async def test_concurrent_first_requests_render_a_variant_once():
+    """
+    Verify concurrent first requests for one deferred variant share a single render and upload.
+    Why: /images/{id}/{variant} is public; N simultaneous requests must not start N CPU-heavy AVIF renders.
+    """
+    image_id = "8b6f7c1e-4a1d-4a8e-9b1a-3f2f0e6d5c4b"
+
+    async def slow_save_image(image_bytes, filename, content_type):
+        await asyncio.sleep(0.05)
+        return f"https://storage.example.com/{filename}"
+
+    with patch("services.cache_service.redis_client", fakeredis.FakeRedis(decode_responses=True)), \
+         patch("services.derivative_service._local_derivative_urls", collections.OrderedDict()), \
+         patch("services.derivative_service.DERIVATIVE_WAIT_POLL_SECONDS", 0.01), \
+         patch("services.derivative_service.get_image_public_url", return_value=f"https://storage.example.com/{image_id}"), \
+         patch("services.derivative_service.download_image", new_callable=AsyncMock, return_value=make_png(600, 400)), \
+         patch("services.derivative_service.save_image", side_effect=slow_save_image) as mock_save, \
+         patch("services.executor_service.get_process_pool", return_value=ThreadPoolExecutor(1)):
+        urls = await asyncio.gather(*(get_or_create_derivative(image_id, "thumbnail.webp") for _ in range(5)))
+
+    assert mock_save.call_count == 1
+    assert urls == [f"https://storage.example.com/{image_id}_thumbnail.webp"] * 5
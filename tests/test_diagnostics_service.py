@@ -0,0 +1,93 @@
+import asyncio
+import os
+import threading
+import time
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+
+# Use SQLite in-memory database for tests
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from services.diagnostics_service import LoopMonitor, sample_stacks, format_collapsed_stacks
+
+
+def blocking_sync_call():
+    """Stands in for a sync Redis/Supabase call made on the event loop."""
+    time.sleep(0.3)
+
+
+@pytest.mark.asyncio
+async def test_loop_monitor_captures_blocking_stack():
+    """
+    Verify a blocked loop is reported with the stack of the blocking code.
+    Why: Lag numbers alone don't tell us which sync call to fix.
+    """
+    monitor = LoopMonitor(interval_seconds=0.01, threshold_ms=100)
+    monitor.start()
+    try:
+        await asyncio.sleep(0.05)
+        blocking_sync_call()
+        await asyncio.sleep(0.05)
+    finally:
+        monitor.stop()
+
+    stats = monitor.get_stats()
+    assert stats["lag_max_ms"] >= 200
+    assert any("blocking_sync_call" in stall["stack"] for stall in stats["slow_callbacks"])
+
+
+@pytest.mark.asyncio
+async def test_idle_loop_reports_no_stalls():
+    """
+    Verify a healthy loop does not produce false stall reports.
+    Why: Noisy diagnostics get ignored.
+    """
+    monitor = LoopMonitor(interval_seconds=0.01, threshold_ms=100)
+    monitor.start()
+    try:
+        await asyncio.sleep(0.3)
+    finally:
+        monitor.stop()
+
+    assert monitor.get_stats()["slow_callbacks"] == []
+
+
+def test_profiler_outputs_collapsed_stacks():
+    """
+    Verify the profiler output is in flamegraph collapsed format.
+    Why: The output must load directly into flamegraph.pl / speedscope.
+    """
+    def busy_worker():
+        deadline = time.monotonic() + 0.3
+        while time.monotonic() < deadline:
+            pass
+
+    worker = threading.Thread(target=busy_worker, name="busy")
+    worker.start()
+    stack_counts = sample_stacks(0.2, interval_seconds=0.005)
+    worker.join()
+
+    output = format_collapsed_stacks(stack_counts)
+    busy_lines = [line for line in output.splitlines() if line.startswith("busy;")]
+    assert busy_lines
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in busy_lines)
+    assert any("busy_worker" in line for line in busy_lines)
+
+
+def test_profile_endpoint_requires_admin_token():
+    """
+    Verify /debug/profile stays 404 without ADMIN_TOKEN and answers 401 to a wrong bearer token.
+    Why: Stack samples expose internals, and on-demand profiling costs CPU; the feature flag alone is not access control.
+    """
+    client = TestClient(app)
+    with patch("main.DEBUG_PROFILER_ENABLED", True):
+        assert client.get("/debug/profile?seconds=0.01").status_code == 404
+        with patch("main.ADMIN_TOKEN", "secret"):
+            assert client.get("/debug/profile?seconds=0.01").status_code == 401
+            wrong = client.get("/debug/profile?seconds=0.01", headers={"Authorization": "Bearer wrong"})
+            response = client.get("/debug/profile?seconds=0.01", headers={"Authorization": "Bearer secret"})
+
+    assert wrong.status_code == 401
+    assert response.status_code == 200
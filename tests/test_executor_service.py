@@ -0,0 +1,50 @@
+import hashlib
+import threading
+import pytest
+from unittest.mock import patch
+from services.executor_service import run_in_thread, get_executor_stats
+
+
+def hash_and_report_thread(data):
+    return hashlib.sha256(data).hexdigest(), threading.current_thread().name
+
+
+@pytest.mark.asyncio
+async def test_small_payloads_run_inline():
+    """
+    Verify work below the size threshold stays on the calling thread.
+    Why: Handing tiny payloads to a pool costs more than doing the work.
+    """
+    inline_before = get_executor_stats()["thread"]["inline"]
+
+    _, thread_name = await run_in_thread(hash_and_report_thread, b"small", size_bytes=5)
+
+    assert thread_name == threading.current_thread().name
+    assert get_executor_stats()["thread"]["inline"] == inline_before + 1
+
+
+@pytest.mark.asyncio
+async def test_large_payloads_are_offloaded():
+    """
+    Verify work above the size threshold runs in the shared thread pool.
+    Why: Hashing a 10MB upload on the event loop stalls every other request.
+    """
+    payload = b"x" * 1024
+
+    with patch("services.executor_service.EXECUTOR_THREAD_THRESHOLD_BYTES", 100):
+        digest, thread_name = await run_in_thread(hash_and_report_thread, payload, size_bytes=len(payload))
+
+    assert digest == hashlib.sha256(payload).hexdigest()
+    assert thread_name.startswith("cpu-offload")
+    assert get_executor_stats()["thread"]["in_flight"] == 0
+
+
+def test_queue_depth_counts_jobs_waiting_for_a_worker():
+    """
+    Verify queue depth only counts jobs beyond the number of workers.
+    Why: A persistently non-zero queue depth means the pool is undersized.
+    """
+    fake_stats = {"thread": {"workers": 4, "in_flight": 6, "max_in_flight": 6, "submitted": 6, "inline": 0}}
+
+    with patch("services.executor_service._executor_stats", fake_stats):
+        assert get_executor_stats()["thread"]["queue_depth"] == 2
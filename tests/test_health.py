@@ -0,0 +1,64 @@
+import os
+import pytest
+from unittest.mock import patch
+from fastapi.testclient import TestClient
+
+# Use SQLite in-memory database for tests
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+import main
+from main import app, warm_up_services
+
+
+@pytest.fixture
+def client():
+    yield TestClient(app)
+    main.startup_state.update({"ready": False, "startup_ms": None, "checks": {}})
+
+
+def test_live_before_warm_up_finishes(client):
+    """
+    Verify liveness answers immediately while readiness waits for warm-up.
+    Why: A slow dependency must keep traffic away, not get the process restarted.
+    """
+    assert client.get("/health/live").status_code == 200
+
+    response = client.get("/health/ready")
+    assert response.status_code == 503
+    assert response.json()["status"] == "starting"
+
+
+@pytest.mark.asyncio
+async def test_ready_when_optional_services_are_down(client):
+    """
+    Verify an unreachable Redis/database degrades readiness details but not readiness.
+    Why: The app works without cache and history; only storage is required.
+    """
+    with patch("main.init_redis", return_value=False), \
+            patch("main.init_database", return_value=False), \
+            patch("main.init_supabase"):
+        await warm_up_services()
+
+    with patch("main.check_redis", return_value="disabled"), \
+            patch("main.check_database", return_value="error"), \
+            patch("main.check_storage", return_value="ok"):
+        response = client.get("/health/ready")
+
+    assert response.status_code == 200
+    assert response.json()["checks"] == {"redis": "disabled", "database": "error", "storage": "ok"}
+
+
+@pytest.mark.asyncio
+async def test_not_ready_without_storage(client):
+    """
+    Verify readiness fails when the storage client could not be created.
+    Why: Every request uploads to storage, so routing traffic here would only produce 500s.
+    """
+    with patch("main.init_redis", return_value=True), \
+            patch("main.init_database", return_value=True), \
+            patch("main.init_supabase", side_effect=RuntimeError("bad credentials")):
+        await warm_up_services()
+
+    assert main.startup_state["checks"]["storage"] == "error"
+    with patch("main.check_storage", return_value="error"):
+        assert client.get("/health/ready").status_code == 503
@@ -0,0 +1,86 @@
+import os
+import fakeredis
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from unittest.mock import patch
+
+# Use SQLite in-memory database for tests
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from services.cache_service import generate_unique_request_key, set_cache_entry, get_result_id
+from services.http_service import CompressionMiddleware, ORJSONResponse, etag_matches
+
+
+def make_compressed_app():
+    compressed_app = FastAPI(default_response_class=ORJSONResponse)
+    compressed_app.add_middleware(CompressionMiddleware, minimum_size=1024)
+
+    @compressed_app.get("/large")
+    async def large():
+        return {"images": [{"url": f"https://storage.example.com/{index}.jpg"} for index in range(100)]}
+
+    @compressed_app.get("/small")
+    async def small():
+        return {"status": "ok"}
+
+    return TestClient(compressed_app)
+
+
+def test_compresses_large_json_with_best_accepted_encoding():
+    """
+    Verify large JSON bodies are sent as brotli when accepted, gzip otherwise, and decode to the same JSON.
+    Why: Result payloads repeat URLs heavily; compression cuts the bytes on the wire several times over.
+    """
+    client = make_compressed_app()
+
+    brotli_response = client.get("/large", headers={"Accept-Encoding": "gzip, br"})
+    gzip_response = client.get("/large", headers={"Accept-Encoding": "gzip, br;q=0"})
+
+    assert brotli_response.headers["content-encoding"] == "br"
+    assert gzip_response.headers["content-encoding"] == "gzip"
+    assert "Accept-Encoding" in brotli_response.headers["vary"]
+    # The client decodes both transparently
+    assert brotli_response.json() == gzip_response.json()
+    assert gzip_response.json()["images"][99]["url"].endswith("/99.jpg")
+
+
+def test_small_bodies_are_not_compressed():
+    """
+    Verify bodies under the size threshold are sent as-is.
+    Why: Below one packet compression only costs CPU and adds header bytes.
+    """
+    response = make_compressed_app().get("/small", headers={"Accept-Encoding": "gzip, br"})
+
+    assert "content-encoding" not in response.headers
+
+
+def test_etag_matching_ignores_encoding_suffix():
+    """
+    Verify If-None-Match matches the identity ETag and its compressed variants.
+    Why: A client that received the brotli body must still get a 304 for the same content.
+    """
+    assert etag_matches('"abc-br"', '"abc"')
+    assert etag_matches('W/"other", "abc-gzip"', '"abc"')
+    assert not etag_matches('"abd"', '"abc"')
+
+
+def test_repeat_get_of_cached_result_returns_304():
+    """
+    Verify GET /results/{id} returns ETag/Cache-Control and 304 when the ETag still matches.
+    Why: Clients polling a result should not download the same payload again.
+    """
+    cache_key = generate_unique_request_key("https://example.com/in.jpg", "make it blue", "fal-ai/flux-pro/kontext")
+    with patch("services.cache_service.redis_client", fakeredis.FakeRedis(decode_responses=True)):
+        set_cache_entry(cache_key, {"images": [{"url": "https://storage.example.com/out.jpg"}], "prompt": "make it blue"})
+        client = TestClient(app)
+
+        first_response = client.get(f"/results/{get_result_id(cache_key)}")
+        repeat_response = client.get(
+            f"/results/{get_result_id(cache_key)}", headers={"If-None-Match": first_response.headers["etag"]}
+        )
+
+    assert first_response.status_code == 200
+    assert first_response.headers["cache-control"] == "public, max-age=60"
+    assert repeat_response.status_code == 304
+    assert repeat_response.content == b""
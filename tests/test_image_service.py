@@ -1,8 +1,86 @@
+import asyncio
+import gzip
+import os
 import pytest
 from unittest.mock import patch, AsyncMock
+from tenacity import wait_none
 from services.image_service import save_image, download_image
 
 
+class FlakyRangeServer:
+    """
+    Minimal HTTP origin that drops the connection mid-body on its first
+    `drops` responses. Supports Range/If-Range like a CDN when asked to.
+    """
+
+    def __init__(self, content: bytes, drop_after: int, drops: int = 1, supports_ranges: bool = True,
+                 replacement: bytes = None, gzip_encoded: bool = False):
+        self.content = content
+        self.gzip_encoded = gzip_encoded  # Content-Encoding: gzip whatever the client accepts; ranges are of the gzip bytes
+        self.replacement = replacement  # Served (with a new ETag) from the second request on
+        self.drop_after = drop_after
+        self.drops_remaining = drops
+        self.supports_ranges = supports_ranges
+        self.etag = '"v1"'
+        self.requests = []
+        self.body_bytes_sent = 0
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+        self.url = f"http://127.0.0.1:{self.server.sockets[0].getsockname()[1]}/image.jpg"
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def handle(self, reader, writer):
+        request_head = await reader.readuntil(b"\r\n\r\n")
+        headers = dict(
+            line.split(": ", 1) for line in request_head.decode().split("\r\n")[1:] if ": " in line
+        )
+        headers = {name.lower(): value for name, value in headers.items()}
+        self.requests.append(headers)
+        if self.replacement is not None and len(self.requests) > 1:
+            self.content, self.etag = self.replacement, '"v2"'
+
+        representation = gzip.compress(self.content) if self.gzip_encoded else self.content
+        start = 0
+        if self.supports_ranges and "range" in headers and headers.get("if-range") == self.etag:
+            start = int(headers["range"].removeprefix("bytes=").split("-")[0])
+        body = representation[start:]
+
+        head = [f"HTTP/1.1 {206 if start else 200} {'Partial Content' if start else 'OK'}",
+                f"Content-Length: {len(body)}", "Content-Type: image/jpeg", "Connection: close"]
+        if self.gzip_encoded:
+            head.append("Content-Encoding: gzip")
+        if self.supports_ranges:
+            head += ["Accept-Ranges: bytes", f"ETag: {self.etag}"]
+        if start:
+            head.append(f"Content-Range: bytes {start}-{len(representation) - 1}/{len(representation)}")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode())
+
+        if self.drops_remaining > 0:
+            self.drops_remaining -= 1
+            body = body[:self.drop_after]
+            writer.write(body)
+            self.body_bytes_sent += len(body)
+            await writer.drain()
+            writer.transport.abort()  # Connection reset mid-body
+            return
+
+        writer.write(body)
+        self.body_bytes_sent += len(body)
+        await writer.drain()
+        writer.close()
+
+
+@pytest.fixture
+def no_retry_wait():
+    with patch("services.image_service.DOWNLOAD_RETRY_WAIT", wait_none()):
+        yield
+
+
 @pytest.mark.asyncio
 async def test_save_image_uploads_to_supabase():
     """
@@ -45,4 +123,76 @@ async def test_download_image_rejects_large_files(httpx_mock):
     )
     
     with pytest.raises(ValueError, match="Image too large"):
-        await download_image("https://example.com/huge.jpg")
\ No newline at end of file
+        await download_image("https://example.com/huge.jpg")
+
+
+@pytest.mark.asyncio
+async def test_download_image_does_not_retry_client_errors(httpx_mock):
+    """
+    Verify a 404 is reported as bad input instead of being retried.
+    Why: Retrying a missing file wastes time and can never succeed.
+    """
+    httpx_mock.add_response(url="https://example.com/missing.jpg", status_code=404)
+
+    with pytest.raises(ValueError, match="HTTP 404"):
+        await download_image("https://example.com/missing.jpg")
+
+
+@pytest.mark.asyncio
+async def test_download_resumes_after_dropped_connection(no_retry_wait):
+    """
+    Verify a retry after a mid-stream drop requests only the missing bytes (Range + If-Range).
+    Why: Restarting large downloads from zero multiplies transfer time and bandwidth on flaky origins.
+    """
+    content = os.urandom(1024 * 1024)
+    async with FlakyRangeServer(content, drop_after=400 * 1024, drops=2) as server:
+        result = await download_image(server.url)
+
+    assert result == content
+    assert len(server.requests) == 3
+    assert server.requests[1]["range"] == "bytes=409600-"
+    assert server.requests[1]["if-range"] == '"v1"'
+    assert server.body_bytes_sent == len(content)
+
+
+@pytest.mark.asyncio
+async def test_download_restarts_when_origin_has_no_range_support(no_retry_wait):
+    """
+    Verify origins without Accept-Ranges are downloaded from the start again, without corrupting the result.
+    Why: Appending a full response to a partial one would produce a broken image.
+    """
+    content = os.urandom(256 * 1024)
+    async with FlakyRangeServer(content, drop_after=100 * 1024, supports_ranges=False) as server:
+        result = await download_image(server.url)
+
+    assert result == content
+    assert "range" not in server.requests[1]
+
+
+@pytest.mark.asyncio
+async def test_download_starts_over_when_file_changed(no_retry_wait):
+    """
+    Verify a changed ETag between attempts yields the complete new file, not a mix of both versions.
+    Why: If-Range must make the origin send the full new version instead of a range of it.
+    """
+    old_content, new_content = os.urandom(256 * 1024), os.urandom(256 * 1024)
+    async with FlakyRangeServer(old_content, drop_after=100 * 1024, replacement=new_content) as server:
+        result = await download_image(server.url)
+
+    assert result == new_content
+    assert server.requests[1]["if-range"] == '"v1"'
+
+
+@pytest.mark.asyncio
+async def test_download_does_not_resume_content_encoded_responses(no_retry_wait):
+    """
+    Verify downloads ask for identity encoding, and a gzip response is restarted rather than resumed.
+    Why: Range offsets count encoded bytes while we count decoded ones, so a resumed gzip body would be spliced corruptly.
+    """
+    content = os.urandom(64 * 1024) + b"\0" * (192 * 1024)  # Compressible, so encoded and decoded offsets differ
+    async with FlakyRangeServer(content, drop_after=30 * 1024, gzip_encoded=True) as server:
+        result = await download_image(server.url)
+
+    assert result == content
+    assert server.requests[0]["accept-encoding"] == "identity"
+    assert "range" not in server.requests[1]
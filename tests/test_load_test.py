@@ -0,0 +1,47 @@
+from benchmarks.load_test import build_request_plan, compare_to_baseline, summarize
+
+
+def scenario_result(rps, p95_ms, error_rate=0.0):
+    return {"rps": rps, "p50_ms": 10.0, "p95_ms": p95_ms, "p99_ms": 50.0, "error_rate": error_rate}
+
+
+def test_regressions_are_flagged_beyond_tolerance():
+    """
+    Verify only slowdowns larger than the tolerance are reported as regressions.
+    Why: Run-to-run noise must not fail the benchmark, real slowdowns must.
+    """
+    baseline = {"scenarios": {"cache-hit": scenario_result(rps=100, p95_ms=20)}}
+
+    noisy = {"scenarios": {"cache-hit": scenario_result(rps=95, p95_ms=22)}}
+    slower = {"scenarios": {"cache-hit": scenario_result(rps=60, p95_ms=40)}}
+
+    assert compare_to_baseline(noisy, baseline, tolerance=0.2) == []
+    regressions = compare_to_baseline(slower, baseline, tolerance=0.2)
+    assert any("rps" in regression for regression in regressions)
+    assert any("p95_ms" in regression for regression in regressions)
+
+
+def test_request_plan_follows_the_requested_mix():
+    """
+    Verify the plan's cache-hit and upload ratios match the scenario.
+    Why: Results are only comparable if each run sends the same kind of traffic.
+    """
+    plan = build_request_plan(1000, cache_hit_ratio=0.7, upload_ratio=0.3, seed=1)
+
+    hit_ratio = sum(prompt.startswith("hot") for _, prompt in plan) / len(plan)
+    upload_ratio = sum(input_kind == "upload" for input_kind, _ in plan) / len(plan)
+    assert abs(hit_ratio - 0.7) < 0.05
+    assert abs(upload_ratio - 0.3) < 0.05
+
+
+def test_summary_percentiles_and_error_rate():
+    """
+    Verify RPS counts only successful requests and errors are reported separately.
+    Why: Fast failures would otherwise look like a throughput improvement.
+    """
+    summary = summarize([float(value) for value in range(1, 101)], errors=10, wall_seconds=2.0)
+
+    assert summary["rps"] == 50.0
+    assert summary["p50_ms"] == 50.0
+    assert summary["p99_ms"] == 99.0
+    assert summary["error_rate"] == round(10 / 110, 4)
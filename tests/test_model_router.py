@@ -0,0 +1,96 @@
+import os
+import pytest
+from fastapi.testclient import TestClient
+from fastapi import HTTPException
+from unittest.mock import patch
+
+# Use SQLite in-memory database for tests
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app, limiter
+from services.model_router import choose_models, track_model_call, reset_model_stats, QUALITY_LEVELS
+
+DEV = "fal-ai/flux-kontext/dev"
+PRO = "fal-ai/flux-pro/kontext"
+MAX = "fal-ai/flux-pro/kontext/max"
+
+
+@pytest.fixture(autouse=True)
+def clean_stats():
+    reset_model_stats()
+    yield
+    reset_model_stats()
+
+
+def record_calls(model_path, latency_ms, count=5, fail=False):
+    with patch("services.model_router.time.perf_counter", side_effect=[0.0, latency_ms / 1000] * count):
+        for _ in range(count):
+            try:
+                with track_model_call(model_path):
+                    if fail:
+                        raise RuntimeError("fal.ai error")
+            except RuntimeError:
+                pass
+
+
+def test_fastest_respects_quality_floor():
+    """
+    Verify "fastest" picks the lowest observed latency, but never below the quality floor.
+    Why: A client asking for standard quality must not silently get the dev model.
+    """
+    record_calls(DEV, 1000)
+    record_calls(PRO, 8000)
+    record_calls(MAX, 4000)
+
+    assert choose_models("fastest", QUALITY_LEVELS["draft"])[0] == DEV
+    assert choose_models("fastest", QUALITY_LEVELS["standard"]) == [MAX, PRO]
+
+
+def test_cheapest_under_latency_slo():
+    """
+    Verify "cheapest" skips cheap models that miss the latency SLO.
+    Why: The cost saving is only worth it while the user still gets an answer in time.
+    """
+    record_calls(DEV, 20000)
+    record_calls(PRO, 6000)
+    record_calls(MAX, 5000)
+
+    assert choose_models("cheapest", QUALITY_LEVELS["draft"], latency_slo_ms=10000) == [PRO, MAX, DEV]
+    # Nothing meets the SLO: fall back to the fastest
+    assert choose_models("cheapest", QUALITY_LEVELS["draft"], latency_slo_ms=1000)[0] == MAX
+
+
+def test_degraded_model_goes_last():
+    """
+    Verify a model with a high recent error rate is ranked behind healthy siblings.
+    Why: A fast model that fails most calls is slower in practice (retries) and wastes budget.
+    """
+    record_calls(DEV, 1000, fail=True)
+    record_calls(PRO, 7000)
+
+    assert choose_models("fastest", QUALITY_LEVELS["draft"]) == [PRO, MAX, DEV]
+
+
+def test_auto_endpoint_falls_back_to_sibling_and_reports_model():
+    """
+    Verify a fal.ai failure on the chosen model is retried on the next one, and the response names it.
+    Why: Clients should get an image when any suitable model is up, and know which one made it.
+    """
+    async def fail_on_first_model(image_request, fal_model_path, response_info=None):
+        if fal_model_path == PRO:
+            raise HTTPException(status_code=503, detail="fal.ai had a problem")
+        return {"images": [{"url": "https://storage.example.com/out.jpg"}], "prompt": "test prompt"}
+
+    limiter.reset()
+    with patch("main.process_kontext_request", side_effect=fail_on_first_model):
+        response = TestClient(app).post(
+            "/kontext/auto?policy=cheapest&min_quality=standard",
+            json={"image_url": "https://picsum.photos/200", "prompt": "test prompt"}
+        )
+
+    assert response.status_code == 200
+    assert response.headers["x-kontext-model"] == MAX
+    assert response.headers["x-kontext-routing-policy"] == "cheapest"
+    assert response.headers["x-kontext-routing-fallback"] == "true"
+    # Same body (and ETag) as the cached result, so revalidating at Content-Location works
+    assert response.json() == {"images": [{"url": "https://storage.example.com/out.jpg"}], "prompt": "test prompt"}
@@ -0,0 +1,73 @@
+import io
+import pytest
+from unittest.mock import patch, AsyncMock
+from PIL import Image
+from services.preprocess_service import probe_image_dimensions, preprocess_image
+from services.executor_service import shutdown_executors
+
+
+def make_image(width, height, image_format="JPEG", exif=None):
+    buffer = io.BytesIO()
+    save_options = {"exif": exif} if exif else {}
+    Image.new("RGB", (width, height), (200, 100, 50)).save(buffer, format=image_format, **save_options)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("image_format", ["JPEG", "PNG"])
+def test_probe_reads_dimensions_from_header(image_format):
+    """
+    Verify dimensions are read from the header for both supported formats.
+    Why: Lets us skip decoding images that are already small enough.
+    """
+    image_bytes = make_image(640, 480, image_format)
+
+    assert probe_image_dimensions(image_bytes) == (640, 480)
+    # Only the header is needed
+    assert probe_image_dimensions(image_bytes[:1024]) == (640, 480)
+
+
+@pytest.mark.asyncio
+async def test_small_images_are_passed_through_untouched():
+    """
+    Verify images within the size limit are returned byte-for-byte.
+    Why: Re-encoding small images costs CPU and quality for no gain.
+    """
+    image_bytes = make_image(800, 600)
+
+    result = await preprocess_image(image_bytes, "image/jpeg", max_edge=1024)
+
+    assert result is image_bytes
+
+
+@pytest.mark.asyncio
+async def test_large_images_are_downscaled_and_exif_stripped():
+    """
+    Verify oversized images are downscaled to the max edge without EXIF.
+    Why: Smaller payloads upload faster, and EXIF can leak location data.
+    """
+    exif = Image.Exif()
+    exif[0x010F] = "TestCamera"  # Camera make
+    image_bytes = make_image(3000, 1500, exif=exif.tobytes())
+
+    try:
+        result = await preprocess_image(image_bytes, "image/jpeg", max_edge=1024)
+    finally:
+        shutdown_executors()
+
+    with Image.open(io.BytesIO(result)) as resized:
+        assert resized.size == (1024, 512)
+        assert not resized.getexif()
+
+
+@pytest.mark.asyncio
+async def test_original_is_kept_when_reencoding_does_not_shrink_it():
+    """
+    Verify the original bytes are used when the re-encoded image is not smaller.
+    Why: A PNG -> JPEG conversion or a recompressed JPEG can grow; uploading more bytes defeats preprocessing.
+    """
+    image_bytes = make_image(3000, 1500)
+
+    with patch("services.preprocess_service.run_in_process", new_callable=AsyncMock, return_value=image_bytes + b"0"):
+        result = await preprocess_image(image_bytes, "image/jpeg", max_edge=1024)
+
+    assert result is image_bytes
@@ -0,0 +1,154 @@
+import os
+import pytest
+import fakeredis
+from datetime import timedelta
+from fastapi.testclient import TestClient
+from unittest.mock import patch, AsyncMock
+
+# Use SQLite in-memory database for tests (the job table gets a file database below)
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app, limiter
+from services import rehost_service
+from services.cache_service import generate_unique_request_key, get_cache_entry
+from services.database import init_database, dispose_database, get_session
+from services.models import RehostJob
+from services.rehost_service import enqueue_rehost_job, claim_due_jobs, finish_job, process_due_jobs, utc_now
+
+FAL_RESULT = {"images": [{"url": "https://fal.media/out.jpg", "width": 512, "height": 512}], "prompt": "make it blue"}
+REHOSTED_RESULT = {"images": [{"url": "https://storage.example.com/out.jpg", "width": 512, "height": 512}], "prompt": "make it blue"}
+
+
+@pytest.fixture
+def job_store(tmp_path):
+    """A file SQLite database (shared by all threads) and a fake Redis."""
+    dispose_database()
+    with patch("services.database.DATABASE_URL", f"sqlite:///{tmp_path / 'jobs.db'}"), \
+            patch.object(rehost_service, "REHOST_QUEUE_ENABLED", True), \
+            patch("services.cache_service.redis_client", fakeredis.FakeRedis(decode_responses=True)):
+        init_database()
+        yield
+        dispose_database()
+
+
+def make_job_due(job_id):
+    db = get_session()
+    job = db.get(RehostJob, job_id)
+    job.next_attempt_at = utc_now() - timedelta(seconds=1)
+    db.commit()
+    db.close()
+
+
+def test_failed_rehost_returns_job_and_suppresses_duplicate_generation(job_store):
+    """
+    Verify a step-4 failure answers 202 with a job, and an identical request reuses that job.
+    Why: The generation is already paid for; a retrying user must not pay for a second one.
+    """
+    async def download(url):
+        if url == "https://fal.media/out.jpg":
+            raise ConnectionError("CDN unavailable")
+        return b"\xff\xd8\xff\xe0" + b"0" * 100
+
+    payload = {"image_url": "https://example.com/in.jpg", "prompt": "make it blue"}
+    limiter.reset()
+    with patch("main.download_image", side_effect=download), \
+            patch("main.preprocess_image", side_effect=lambda image_bytes, mime_type: image_bytes), \
+            patch("main.save_image", new_callable=AsyncMock, return_value="https://storage.example.com/in.jpg"), \
+            patch("main.kontext_nonblocking", new_callable=AsyncMock, return_value=FAL_RESULT) as mock_fal, \
+            patch("main.record_request_history"):
+        client = TestClient(app)
+        first_response = client.post("/kontext", json=payload)
+        repeat_response = client.post("/kontext", json=payload)
+
+        job_response = client.get(first_response.json()["status_url"])
+        repeat_poll = client.get(first_response.json()["status_url"], headers={"If-None-Match": job_response.headers["etag"]})
+
+    assert first_response.status_code == 202
+    assert repeat_response.json()["job_id"] == first_response.json()["job_id"]
+    assert mock_fal.call_count == 1
+    assert first_response.json()["status"] == job_response.json()["status"] == "pending"
+    assert repeat_poll.status_code == 304
+
+
+def test_jobs_endpoint_is_404_when_queue_disabled():
+    """
+    Verify /jobs/{id} answers 404 (not 503) without a job queue.
+    Why: No 202 can have been issued then; a 503 would tell clients to keep retrying.
+    """
+    with patch.object(rehost_service, "REHOST_QUEUE_ENABLED", False), \
+            patch("services.rehost_service.get_session", side_effect=RuntimeError("DATABASE_URL not set")):
+        response = TestClient(app).get("/jobs/0123456789abcdef")
+
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_worker_retries_with_backoff_then_caches_result(job_store):
+    """
+    Verify a failed retry is rescheduled later, and a successful one completes the job and fills the cache.
+    Why: Transient CDN/storage outages should resolve on their own without hammering the failing service.
+    """
+    cache_key = generate_unique_request_key("https://example.com/in.jpg", "make it blue", "fal-ai/flux-pro/kontext")
+    job_id = enqueue_rehost_job(FAL_RESULT, "fal-ai/flux-pro/kontext", cache_key, "CDN unavailable")
+    make_job_due(job_id)
+
+    assert await process_due_jobs(AsyncMock(side_effect=ConnectionError("still down"))) == 1
+    assert rehost_service.get_rehost_job(job_id)["status"] == "pending"
+    assert await process_due_jobs(AsyncMock()) == 0  # Backing off
+
+    make_job_due(job_id)
+    await process_due_jobs(AsyncMock(return_value=REHOSTED_RESULT))
+
+    job_status = rehost_service.get_rehost_job(job_id)
+    assert job_status["status"] == "succeeded"
+    assert job_status["attempts"] == 3
+    assert get_cache_entry(cache_key) == (REHOSTED_RESULT, False)
+    assert rehost_service.get_pending_job_id(cache_key) is None
+
+
+def test_jobs_endpoint_reports_running_while_a_worker_holds_the_job(job_store):
+    """
+    Verify /jobs/{id} goes pending -> running (once claimed) -> succeeded.
+    Why: /jobs reads shared state first; without the claim mirrored there, "running" is never seen.
+    """
+    job_id = enqueue_rehost_job(FAL_RESULT, "fal-ai/flux-pro/kontext", None, "CDN unavailable")
+    make_job_due(job_id)
+    client = TestClient(app)
+
+    assert client.get(f"/jobs/{job_id}").json()["status"] == "pending"
+    claim_due_jobs()
+    running_response = client.get(f"/jobs/{job_id}")
+    finish_job(job_id, result=REHOSTED_RESULT)
+    finished_response = client.get(f"/jobs/{job_id}")
+
+    assert running_response.json()["status"] == "running"
+    assert running_response.json()["attempts"] == 2
+    assert finished_response.json()["status"] == "succeeded"
+    assert finished_response.json()["result"] == REHOSTED_RESULT
+
+def test_job_is_claimed_once(job_store):
+    """
+    Verify a due job is handed to only one claimer.
+    Why: Every worker process and replica polls the same table; a job must not be re-hosted twice at once.
+    """
+    job_id = enqueue_rehost_job(FAL_RESULT, "fal-ai/flux-pro/kontext", None, "CDN unavailable")
+    make_job_due(job_id)
+
+    assert [job["id"] for job in claim_due_jobs()] == [job_id]
+    assert claim_due_jobs() == []
+
+
+@pytest.mark.asyncio
+async def test_job_fails_after_max_attempts(job_store):
+    """
+    Verify the job is marked failed once REHOST_MAX_ATTEMPTS is reached.
+    Why: fal.ai output URLs expire; retrying forever would only burn resources.
+    """
+    job_id = enqueue_rehost_job(FAL_RESULT, "fal-ai/flux-pro/kontext", None, "CDN unavailable")
+    with patch.object(rehost_service, "REHOST_MAX_ATTEMPTS", 2):
+        make_job_due(job_id)
+        await process_due_jobs(AsyncMock(side_effect=ConnectionError("gone")))
+
+    job_status = rehost_service.get_rehost_job(job_id)
+    assert job_status["status"] == "failed"
+    assert job_status["error"] == "gone"
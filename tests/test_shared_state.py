@@ -0,0 +1,164 @@
+import asyncio
+import threading
+import os
+import time
+import pytest
+from unittest.mock import patch, AsyncMock
+
+import fakeredis
+
+# Use SQLite in-memory database for tests
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+import main
+from main import ImageRequest, process_kontext_request
+from services import shared_state
+from services.shared_state import InMemorySharedState, RedisSharedState, get_shared_state
+
+
+def test_memory_lock_is_exclusive_until_released_or_expired():
+    """
+    Verify the in-memory lock has SET NX EX semantics.
+    Why: Code is written against one interface; the single-process backend must not behave differently.
+    """
+    state = InMemorySharedState()
+
+    token = state.acquire_lock("key:generating", ttl_seconds=60)
+    assert token
+    assert not state.acquire_lock("key:generating", ttl_seconds=60)
+    state.release_lock("key:generating", token)
+    assert state.acquire_lock("key:generating", ttl_seconds=60)
+
+    with patch("services.shared_state.time.monotonic", return_value=10 ** 9):
+        assert not state.is_locked("key:generating")
+
+
+@pytest.mark.parametrize("backend", ["memory", "redis"])
+def test_expired_lock_holder_cannot_release_or_renew_its_successors_lock(backend):
+    """
+    Verify a lock that expired and was taken over is not released or renewed by its old holder.
+    Why: A blind DELETE would let a third worker start another paid generation while the second still runs.
+    """
+    state = InMemorySharedState() if backend == "memory" else RedisSharedState()
+    with patch("services.cache_service.redis_client", fakeredis.FakeRedis(decode_responses=True)) as fake_redis:
+        old_token = state.acquire_lock("key:generating", ttl_seconds=60)
+        # The old holder outlives its TTL
+        if backend == "memory":
+            with patch("services.shared_state.time.monotonic", return_value=time.monotonic() + 61):
+                new_token = state.acquire_lock("key:generating", ttl_seconds=60)
+        else:
+            fake_redis.delete("key:generating")
+            new_token = state.acquire_lock("key:generating", ttl_seconds=60)
+
+        assert new_token and new_token != old_token
+        assert not state.release_lock("key:generating", old_token)
+        assert not state.renew_lock("key:generating", old_token, ttl_seconds=60)
+        assert not state.acquire_lock("key:generating", ttl_seconds=60)
+        assert state.release_lock("key:generating", new_token)
+        assert not state.is_locked("key:generating")
+
+
+def test_backend_follows_redis_availability_and_setting():
+    """
+    Verify Redis is used when connected, unless SHARED_STATE_BACKEND=memory.
+    Why: Locks in a per-process dict do nothing across workers, but tests and single-process runs need no Redis.
+    """
+    with patch("services.cache_service.redis_client", None):
+        assert get_shared_state().name == "memory"
+
+    with patch("services.cache_service.redis_client", fakeredis.FakeRedis(decode_responses=True)):
+        assert get_shared_state().name == "redis"
+        with patch.object(shared_state, "SHARED_STATE_BACKEND", "memory"):
+            assert get_shared_state().name == "memory"
+
+
+def test_redis_lock_shared_between_processes():
+    """
+    Verify two Redis-backed instances (as in two workers) see the same lock and job status.
+    Why: This is what makes single-flight and job polling work behind a load balancer.
+    """
+    server = fakeredis.FakeServer()
+    worker_a, worker_b = RedisSharedState(), RedisSharedState()
+
+    with patch("services.cache_service.redis_client", fakeredis.FakeRedis(server=server, decode_responses=True)):
+        assert worker_a.acquire_lock("key:generating", ttl_seconds=60)
+        shared_state.set_job_status("job-1", {"status": "queued"})
+    with patch("services.cache_service.redis_client", fakeredis.FakeRedis(server=server, decode_responses=True)):
+        assert not worker_b.acquire_lock("key:generating", ttl_seconds=60)
+        assert shared_state.get_job_status("job-1") == {"status": "queued"}
+
+
+@pytest.mark.asyncio
+async def test_concurrent_identical_misses_generate_once():
+    """
+    Verify concurrent identical requests share one generation and get the same result.
+    Why: A burst of identical misses would otherwise pay fal.ai once per request.
+    """
+    result = {"images": [{"url": "https://storage.example.com/out.jpg"}], "prompt": "make it blue"}
+
+    async def slow_pipeline(*args):
+        await asyncio.sleep(0.2)
+        return result
+
+    request = ImageRequest(image_url="https://example.com/in.jpg", prompt="make it blue")
+    with patch("services.cache_service.redis_client", fakeredis.FakeRedis(decode_responses=True)), \
+            patch("main.run_kontext_pipeline", side_effect=slow_pipeline) as mock_pipeline, \
+            patch("main.record_request_history"), \
+            patch("main.IN_FLIGHT_POLL_SECONDS", 0.01):
+        responses = await asyncio.gather(
+            *(process_kontext_request(request, "fal-ai/flux-pro/kontext") for _ in range(3))
+        )
+
+    assert mock_pipeline.call_count == 1
+    assert responses == [result] * 3
+
+
+@pytest.mark.asyncio
+async def test_result_stored_between_miss_and_lock_is_not_generated_again():
+    """
+    Verify a request that wins the lock after another request stored the result serves that result.
+    Why: Miss, then the leader stores and releases, then we acquire: without a second lookup we pay fal.ai twice.
+    """
+    result = {"images": [{"url": "https://storage.example.com/out.jpg"}], "prompt": "make it blue"}
+    request = ImageRequest(image_url="https://example.com/in.jpg", prompt="make it blue")
+    original_acquire = main.acquire_generation_lock
+
+    def acquire_after_leader_finished(cache_key):
+        main.set_cache_entry(cache_key, result)  # The leader finished right after our miss
+        return original_acquire(cache_key)
+
+    with patch("services.cache_service.redis_client", fakeredis.FakeRedis(decode_responses=True)), \
+            patch("main.acquire_generation_lock", side_effect=acquire_after_leader_finished), \
+            patch("main.run_kontext_pipeline", new_callable=AsyncMock) as mock_pipeline, \
+            patch("main.record_request_history"):
+        assert await process_kontext_request(request, "fal-ai/flux-pro/kontext") == result
+        cache_key = await main.get_request_cache_key(request, "fal-ai/flux-pro/kontext")
+        assert not main.is_generation_in_flight(cache_key)
+
+    mock_pipeline.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_cache_hit_does_not_wait_for_the_history_write():
+    """
+    Verify a cache hit returns while its history insert is still running, and a failed insert is only logged.
+    Why: The hottest path must not pay a database round-trip (or queue behind other threadpool work).
+    """
+    result = {"images": [{"url": "https://storage.example.com/out.jpg"}], "prompt": "make it blue"}
+    request = ImageRequest(image_url="https://example.com/in.jpg", prompt="make it blue")
+    database_reachable = threading.Event()
+
+    def slow_failing_insert(**row):
+        database_reachable.wait(5)
+        raise ConnectionError("database down")
+
+    with patch("services.cache_service.redis_client", fakeredis.FakeRedis(decode_responses=True)), \
+            patch("main.record_request", side_effect=slow_failing_insert) as mock_insert:
+        main.set_cache_entry(await main.get_request_cache_key(request, "fal-ai/flux-pro/kontext"), result)
+        assert await process_kontext_request(request, "fal-ai/flux-pro/kontext") == result
+        assert len(main.background_history_tasks) == 1
+
+        database_reachable.set()
+        await asyncio.gather(*main.background_history_tasks, return_exceptions=True)
+
+    assert mock_insert.call_args.kwargs["status"] == "success"
+    assert not main.background_history_tasks
@@ -0,0 +1,113 @@
+import json
+import logging
+import os
+import pytest
+from unittest.mock import AsyncMock, MagicMock, patch
+from fastapi.testclient import TestClient
+from tenacity import wait_none
+
+# Use SQLite in-memory database for tests
+os.environ['DATABASE_URL'] = 'sqlite:///:memory:'
+
+from main import app
+from services import tracing_service
+from services.fal_service import kontext_nonblocking
+from services.logging_service import JsonFormatter
+from services.tracing_service import JsonFileExporter, start_span, set_request_id, reset_request_id
+
+
+class InMemoryExporter:
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+
+@pytest.fixture
+def exporter():
+    in_memory_exporter = InMemoryExporter()
+    tracing_service.set_exporter(in_memory_exporter)
+    yield in_memory_exporter
+    tracing_service.set_exporter(None)
+
+
+def test_nested_spans_are_exported_as_one_trace(tmp_path):
+    """
+    Verify child spans share the trace id and point at their parent in the JSON file.
+    Why: The file exporter is how a slow request is reconstructed locally.
+    """
+    trace_file = tmp_path / "traces.jsonl"
+    tracing_service.set_exporter(JsonFileExporter(str(trace_file)))
+    try:
+        with start_span("http.request") as root_span:
+            with start_span("input.upload", {"storage.object": "abc"}):
+                pass
+        tracing_service.flush_spans()
+    finally:
+        tracing_service.set_exporter(None)
+
+    spans = {span["name"]: span for span in map(json.loads, trace_file.read_text().splitlines())}
+    assert spans["input.upload"]["trace_id"] == root_span.trace_id
+    assert spans["input.upload"]["parent_span_id"] == root_span.span_id
+    assert spans["input.upload"]["attributes"] == {"storage.object": "abc"}
+
+
+@pytest.mark.asyncio
+async def test_each_fal_retry_attempt_gets_a_span(exporter):
+    """
+    Verify every tenacity attempt is its own span, with the fal request id on the one that worked.
+    Why: A slow request is often slow because of retries, and the fal job id is needed to ask fal about it.
+    """
+    job_handle = MagicMock(request_id="fal-job-123")
+    job_handle.get = AsyncMock(return_value={"images": []})
+
+    with patch("services.fal_service.fal_client") as mock_fal, \
+            patch.object(kontext_nonblocking.retry, "wait", wait_none()):
+        mock_fal.submit_async = AsyncMock(side_effect=[RuntimeError("fal down"), job_handle])
+        with start_span("fal.generate"):
+            await kontext_nonblocking("https://example.com/img.jpg", "test", "fal-ai/flux-pro/kontext")
+    tracing_service.flush_spans()
+
+    attempts = [span for span in exporter.spans if span.name == "fal.submit"]
+    assert [span.attributes["retry.attempt"] for span in attempts] == [1, 2]
+    assert attempts[0].status == "ERROR"
+    assert attempts[1].attributes["fal.request_id"] == "fal-job-123"
+
+
+def test_request_id_is_propagated_in_response_headers(exporter):
+    """
+    Verify a caller's X-Request-ID is echoed back and a new one is generated otherwise.
+    Why: Users quote the request id in bug reports; it must match our logs and traces.
+    """
+    client = TestClient(app)
+
+    echoed = client.get("/health", headers={"X-Request-ID": "checkout-42"})
+    generated = client.get("/health")
+    tracing_service.flush_spans()
+
+    assert echoed.headers["X-Request-ID"] == "checkout-42"
+    assert len(generated.headers["X-Request-ID"]) == 32
+    root_span = next(span for span in exporter.spans if span.attributes.get("request.id") == "checkout-42")
+    assert echoed.headers["traceparent"] == f"00-{root_span.trace_id}-{root_span.span_id}-01"
+
+
+def test_log_lines_carry_request_and_trace_ids():
+    """
+    Verify JSON log lines include the request id, trace id and extra fields.
+    Why: Logs are only useful in production if they can be joined with the request's trace.
+    """
+    token = set_request_id("req-1")
+    try:
+        with start_span("cache.lookup") as span:
+            record = logging.getLogger("test").makeRecord(
+                "test", logging.INFO, __file__, 1, "Cache HIT", (), None, extra={"cache_key": "kontext_cache:abc"}
+            )
+            log_line = json.loads(JsonFormatter().format(record))
+    finally:
+        reset_request_id(token)
+
+    assert log_line["message"] == "Cache HIT"
+    assert log_line["request_id"] == "req-1"
+    assert log_line["trace_id"] == span.trace_id
+    assert log_line["cache_key"] == "kontext_cache:abc"